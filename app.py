@@ -2,23 +2,20 @@
 import os
 import io
 import time
-import json
+import orjson
 import uuid
-import pickle
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import numpy as np
-import tempfile
 import re
-import faiss
 from datetime import datetime
 
 # Importér vores moduler
 from utils import storage
 from utils import api_utils
-from utils import pdf_utils
 from utils import text_analysis
-from utils import indexing
 from utils import validation
 from utils.optimization import cached_call_gpt4o, process_segments_parallel, optimize_chunks
 from indexers import get_available_indexers, get_indexer_class
@@ -26,29 +23,35 @@ from indexers import get_available_indexers, get_indexer_class
 # Konfiguration
 st.set_page_config(page_title="Skatteretlig Indekseringsværktøj", layout="wide")
 
-# Initialisering af session state
-if 'chunks' not in st.session_state:
-    st.session_state.chunks = []
-if 'doc_id' not in st.session_state:
-    st.session_state.doc_id = None
-if 'context_summary' not in st.session_state:
-    st.session_state.context_summary = None
-if 'faiss_index' not in st.session_state:
-    st.session_state.faiss_index = None
-if 'embedding_dict' not in st.session_state:
-    st.session_state.embedding_dict = {}
-if 'raw_text' not in st.session_state:
-    st.session_state.raw_text = None
-if 'original_text' not in st.session_state:
-    st.session_state.original_text = None
-if 'original_text_sections' not in st.session_state:
-    st.session_state.original_text_sections = {}
-if 'preserved_content' not in st.session_state:
-    st.session_state.preserved_content = {}
-if 'processing_stats' not in st.session_state:
-    st.session_state.processing_stats = {}
-if 'filtered_chunks' not in st.session_state:
-    st.session_state.filtered_chunks = []
+# Standardværdier for session state
+_SESSION_DEFAULTS = {
+    'chunks': [],
+    'doc_id': None,
+    'context_summary': None,
+    'faiss_index': None,
+    'embedding_dict': {},
+    'data_version': None,
+    'raw_text': None,
+    'preserved_content': {},
+    'processing_stats': {},
+    'filtered_chunks': []
+}
+
+# Initialisering af session state (kun ved første kørsel i sessionen)
+if not st.session_state.get("_init"):
+    st.session_state.update({k: v for k, v in _SESSION_DEFAULTS.items() if k not in st.session_state})
+    st.session_state["_init"] = True
+
+# st.fragment (Streamlit >= 1.37) begrænser reruns til den dekorerede funktion.
+# På ældre versioner køres funktionen blot som en del af hele scriptet.
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
+@st.cache_resource
+def _ensure_directories():
+    """Opretter datamapperne én gang pr. serverproces i stedet for ved hver rerun."""
+    storage.ensure_directories()
+
+_ensure_directories()
 
 # Forsøg at initialisere OpenAI-klienten
 try:
@@ -80,18 +83,55 @@ def get_advanced_options():
     )
     
     wait_time_between_calls = st.slider(
-        "Ventetid mellem API-kald (sekunder)",
+        "Minimum ventetid ved rate limit (sekunder)",
         min_value=1,
         max_value=30,
         value=5,
         step=1,
-        help="Længere ventetid reducerer risikoen for rate limit fejl"
+        help="Kald styres efter API'ets rate limit-headers. Ved rate limit fejl ventes mindst denne tid, fordoblet for hvert nyt forsøg"
+    )
+    
+    segments_per_call = st.slider(
+        "Maks. segmenter per API-kald",
+        min_value=1,
+        max_value=10,
+        value=5,
+        step=1,
+        help="Korte segmenter samles i ét kald op til et fast tokenbudget. Store segmenter sendes stadig alene"
+    )
+    
+    concurrency = st.slider(
+        "Parallelle API-kald",
+        min_value=1,
+        max_value=8,
+        value=4,
+        step=1,
+        help="Antal segmentkald der sendes samtidigt. Kaldene venter stadig på rate limit-budgettet"
+    )
+    
+    batch_mode = st.checkbox(
+        "Brug OpenAI Batch API",
+        value=False,
+        help="Halv pris pr. token og ingen rate limits, men resultatet kan tage op til 24 timer. "
+             "Bruges for afgørelser, cirkulærer og analysen af juridiske vejledninger"
+    )
+    
+    quantization = st.selectbox(
+        "Kvantisering af søgeindeks",
+        ["none", "sq8", "pq"],
+        index=0,
+        format_func=lambda x: {"none": "Ingen (float32)", "sq8": "8-bit (int8)", "pq": "Produktkvantisering (PQ)"}[x],
+        help="Kvantisering gør indekset op til 4-50 gange mindre og søgningen hurtigere mod et lille tab i præcision"
     )
     
     return {
         "model": model_for_context,
         "max_text_length": max_text_per_request,
-        "wait_time": wait_time_between_calls
+        "wait_time": wait_time_between_calls,
+        "batch_size": segments_per_call,
+        "concurrency": concurrency,
+        "batch_mode": batch_mode,
+        "quantization": quantization
     }
 
 def display_context_summary(context_summary):
@@ -206,49 +246,155 @@ def display_context_summary(context_summary):
         for temp in summary.get("temporary_provisions", []):
             st.write(f"- {temp}")
 
+# Kolonner der vises i chunk-tabellen (de øvrige bruges kun til filtrering)
+CHUNK_TABLE_COLUMNS = [
+    "Type", "Tekst", "Paragraf", "Stykke", "Status", "Tema", "Undertema", "Nøgleord",
+    "Persongrupper", "Krydsreferencer", "Note-nr", "Prioritet", "Kompleksitet"
+]
+
+def _arrow_column(values):
+    """Konverterer en kolonne til Arrow; blandede typer vises som tekst."""
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array(values.astype(str))
+
+def build_chunk_tables(chunks):
+    """
+    Bygger filter-DataFrame og visningstabel (Arrow) for alle chunks (kolonnevis).
+    
+    Tekstforkortelse og sammensætning af lister sker med pyarrow.compute i C
+    i stedet for en Python-operation pr. chunk.
+    """
+    n = len(chunks)
+    types, contents, paragraphs, stykker, statuses = [None] * n, [None] * n, [None] * n, [None] * n, [None] * n
+    themes, subthemes, keywords, groups, crossrefs = [None] * n, [None] * n, [None] * n, [None] * n, [None] * n
+    note_nrs, priorities, complexities = [None] * n, [None] * n, [None] * n
+    is_notes, has_bidrag, has_crossrefs, is_temporary = [False] * n, [False] * n, [False] * n, [False] * n
+    has_exceptions, affected_counts, search_texts = [False] * n, [0] * n, [None] * n
+    
+    for i, chunk in enumerate(chunks):
+        m = chunk["metadata"]
+        content = chunk["content"]
+        is_note = bool(m.get("is_note", False))
+        fortolkningsbidrag = m.get("fortolkningsbidrag") or []
+        note_reference = m.get("note_reference")
+        concepts = m.get("concepts", [])
+        affected_groups = m.get("affected_groups") or []
+        status = m.get("status")
+        
+        types[i] = "Note" if is_note else "Lovtekst"
+        contents[i] = content
+        paragraphs[i] = m.get("paragraph", "")
+        stykker[i] = m.get("stykke", "")
+        statuses[i] = m.get("status", "gældende")
+        themes[i] = m.get("theme", "")
+        subthemes[i] = m.get("subtheme", "")
+        keywords[i] = concepts
+        groups[i] = affected_groups
+        if is_note:
+            crossrefs[i] = str(note_reference) if note_reference else ""
+        else:
+            crossrefs[i] = ", ".join(str(x) for x in fortolkningsbidrag)
+        note_nrs[i] = m.get("note_number", "") if is_note else ""
+        priorities[i] = m.get("priority", "medium")
+        complexities[i] = m.get("complexity", "moderat")
+        
+        # Filterkolonner
+        is_notes[i] = is_note
+        has_bidrag[i] = len(fortolkningsbidrag) > 0
+        has_crossrefs[i] = has_bidrag[i] or bool(note_reference)
+        is_temporary[i] = status == "midlertidig"
+        has_exceptions[i] = bool(m.get("legal_exceptions"))
+        affected_counts[i] = len(affected_groups)
+        # Al søgbar tekst samlet i én streng, så tekstfilteret kun scanner én kolonne
+        search_texts[i] = "\n".join([
+            str(paragraphs[i]), str(stykker[i]), str(m.get("note_number", "")), content,
+            "\n".join(concepts), "\n".join(affected_groups)
+        ])
+    
+    chunk_df = pd.DataFrame({
+        "Type": pd.Categorical(types),
+        "Paragraf": paragraphs,
+        "Stykke": stykker,
+        "Status": pd.Categorical(statuses),
+        "Tema": themes,
+        "Undertema": subthemes,
+        "Krydsreferencer": crossrefs,
+        "Note-nr": note_nrs,
+        "Prioritet": pd.Categorical(priorities),
+        "Kompleksitet": pd.Categorical(complexities),
+        "is_note": is_notes,
+        "has_fortolkningsbidrag": has_bidrag,
+        "has_crossrefs": has_crossrefs,
+        "is_temporary": is_temporary,
+        "has_exceptions": has_exceptions,
+        "affected_count": affected_counts,
+        "search_text": search_texts
+    }, copy=False)
+    
+    # Visningskolonner beregnet direkte i Arrow
+    previews = pc.binary_join_element_wise(pc.utf8_slice_codeunits(pa.array(contents, type=pa.string()), 0, 100), "...", "")
+    computed = {
+        "Tekst": previews,
+        "Nøgleord": pc.binary_join(pa.array(keywords, type=pa.list_(pa.string())), ", "),
+        "Persongrupper": pc.binary_join(pa.array(groups, type=pa.list_(pa.string())), ", ")
+    }
+    display_table = pa.table({
+        column: computed[column] if column in computed else _arrow_column(chunk_df[column])
+        for column in CHUNK_TABLE_COLUMNS
+    })
+    
+    return chunk_df, display_table
+
+def get_chunk_dataframe(chunks):
+    """
+    Returnerer chunk-tabellen for chunks og dens visningskolonner som Arrow-tabel.
+    Begge bygges kun igen når listen udskiftes.
+    """
+    cached = st.session_state.get("_chunk_df")
+    if cached is None or cached[0] is not chunks or cached[1] != len(chunks):
+        # Streamlit sender data som Arrow; ved at bygge tabellen én gang undgås pandas-rundturen ved hver visning
+        chunk_df, display_table = build_chunk_tables(chunks)
+        cached = (chunks, len(chunks), chunk_df, display_table)
+        st.session_state["_chunk_df"] = cached
+    return cached[2], cached[3]
+
 def display_chunks(chunks, filter_type=None, filter_text=None):
     """Viser chunks med forbedrede filtreringsmuligheder."""
-    filtered_chunks = chunks
+    # Tabellen bygges én gang pr. chunks-liste; filtrering sker med boolske masker
+    chunk_df, display_table = get_chunk_dataframe(chunks)
+    mask = pd.Series(True, index=chunk_df.index)
     
     # Anvend filter efter type
     if filter_type:
         if filter_type == "Kun lovtekst":
-            filtered_chunks = [c for c in chunks if not c["metadata"].get("is_note", False)]
+            mask = ~chunk_df["is_note"]
         elif filter_type == "Kun noter":
-            filtered_chunks = [c for c in chunks if c["metadata"].get("is_note", False)]
+            mask = chunk_df["is_note"]
         elif filter_type == "Med krydsreferencer":
-            filtered_chunks = [c for c in chunks if 
-                            (c["metadata"].get("fortolkningsbidrag") and c["metadata"]["fortolkningsbidrag"]) or
-                            c["metadata"].get("note_reference")]
+            mask = chunk_df["has_crossrefs"]
         elif filter_type == "Midlertidige bestemmelser":
-            filtered_chunks = [c for c in chunks if c["metadata"].get("status") == "midlertidig"]
+            mask = chunk_df["is_temporary"]
         elif filter_type == "Med juridiske undtagelser":
-            filtered_chunks = [c for c in chunks if 
-                            c["metadata"].get("legal_exceptions") and len(c["metadata"]["legal_exceptions"]) > 0]
+            mask = chunk_df["has_exceptions"]
         elif filter_type == "Berørte persongrupper":
-            filtered_chunks = [c for c in chunks if 
-                            c["metadata"].get("affected_groups") and len(c["metadata"]["affected_groups"]) > 0]
+            mask = chunk_df["affected_count"] > 0
         elif filter_type == "Uden referencer":
-            filtered_chunks = [c for c in chunks if 
-                            not c["metadata"].get("is_note", False) and 
-                            (not c["metadata"].get("fortolkningsbidrag") or len(c["metadata"].get("fortolkningsbidrag", [])) == 0)]
+            mask = ~chunk_df["is_note"] & ~chunk_df["has_fortolkningsbidrag"]
         elif filter_type == "Høj prioritet":
-            filtered_chunks = [c for c in chunks if c["metadata"].get("priority") == "høj"]
+            mask = chunk_df["Prioritet"] == "høj"
         elif filter_type == "Komplekse bestemmelser":
-            filtered_chunks = [c for c in chunks if c["metadata"].get("complexity") == "kompleks"]
+            mask = chunk_df["Kompleksitet"] == "kompleks"
     
     # Anvend tekstfilter
     if filter_text:
-        filter_text = filter_text.lower().strip()
-        filtered_chunks = [
-            c for c in filtered_chunks if 
-            (c["metadata"].get("paragraph", "").lower().find(filter_text) >= 0) or
-            (c["metadata"].get("stykke", "").lower().find(filter_text) >= 0) or
-            (str(c["metadata"].get("note_number", "")).lower().find(filter_text) >= 0) or
-            (c["content"].lower().find(filter_text) >= 0) or
-            any(concept.lower().find(filter_text) >= 0 for concept in c["metadata"].get("concepts", [])) or
-            any(group.lower().find(filter_text) >= 0 for group in c["metadata"].get("affected_groups", []))
-        ]
+        # Ét forkompileret mønster uden store/små-bogstavsfølsomhed i stedet for .lower()-kopier
+        pattern = re.compile(re.escape(filter_text.strip()), re.IGNORECASE)
+        mask = mask & chunk_df["search_text"].str.contains(pattern, na=False)
+    
+    selected = mask.to_numpy(dtype=bool)
+    filtered_chunks = [chunks[i] for i in chunk_df.index[selected]]
     
     # Gem filtrerede chunks i session state til eksportering
     st.session_state.filtered_chunks = filtered_chunks
@@ -256,36 +402,65 @@ def display_chunks(chunks, filter_type=None, filter_text=None):
     # Vis antal chunks
     st.info(f"Viser {len(filtered_chunks)} af {len(chunks)} chunks")
     
-    # Skab en mere detaljeret tabel med chunks
-    chunk_df = pd.DataFrame([
-        {
-            "Type": "Note" if chunk["metadata"].get("is_note", False) else "Lovtekst",
-            "Tekst": chunk["content"][:100] + "...",
-            "Paragraf": chunk["metadata"].get("paragraph", ""),
-            "Stykke": chunk["metadata"].get("stykke", ""),
-            "Status": chunk["metadata"].get("status", "gældende"),
-            "Tema": chunk["metadata"].get("theme", ""),
-            "Undertema": chunk["metadata"].get("subtheme", ""),
-            "Nøgleord": ", ".join(chunk["metadata"].get("concepts", [])),
-            "Persongrupper": ", ".join(chunk["metadata"].get("affected_groups", [])),
-            "Krydsreferencer": ", ".join(str(x) for x in chunk["metadata"].get("fortolkningsbidrag", [])) if not chunk["metadata"].get("is_note", False) else 
-                            (str(chunk["metadata"].get("note_reference", "")) if chunk["metadata"].get("note_reference") else ""),
-            "Note-nr": chunk["metadata"].get("note_number", "") if chunk["metadata"].get("is_note", False) else "",
-            "Prioritet": chunk["metadata"].get("priority", "medium"),
-            "Kompleksitet": chunk["metadata"].get("complexity", "moderat") 
-        }
-        for chunk in filtered_chunks
-    ])
-    st.dataframe(chunk_df)
+    # Vis den detaljerede tabel med chunks
+    st.dataframe(display_table.filter(pa.array(selected)))
     
     return filtered_chunks
 
-def provide_download_options(chunks, context_summary, doc_id, faiss_index=None, embedding_dict=None):
+@_fragment
+def chunk_table_section(chunks):
+    """Filtre og tabel for chunks. Kører som fragment, så filtrering kun genindlæser tabellen."""
+    # Tilføj en dropdown til at filtrere chunks
+    chunk_filter = st.selectbox(
+        "Filtrer chunks efter type:",
+        ["Alle", "Kun lovtekst", "Kun noter", "Med krydsreferencer", "Midlertidige bestemmelser", 
+         "Med juridiske undtagelser", "Berørte persongrupper", "Uden referencer", "Høj prioritet", "Komplekse bestemmelser"]
+    )
+    
+    # Filter for specifikke noter eller paragraffer
+    specific_filter = st.text_input("Filtrer efter specifik paragraf, stykke, notenummer eller nøgleord (f.eks. '§ 33 A', '794' eller 'grænsegængere'):")
+    
+    # Vis filtrerede chunks
+    display_chunks(
+        chunks, 
+        filter_type=chunk_filter if chunk_filter != "Alle" else None,
+        filter_text=specific_filter if specific_filter else None
+    )
+
+# Serialisering af download-data caches pr. doc_id og dataversion, så den ikke gentages ved hver rerun.
+# Argumenter med underscore hashes ikke af Streamlit; data_version skifter hver gang nye chunks,
+# indeks eller embeddings lægges i session state, så en genindeksering med samme doc_id ikke giver gamle data.
+# Hver dataversion giver nye cacheposter; de ældste eksporter smides ud
+_EXPORT_CACHE_ENTRIES = 8
+
+def _new_data_version():
+    return uuid.uuid4().hex
+
+@st.cache_data(show_spinner=False, max_entries=_EXPORT_CACHE_ENTRIES)
+def _chunks_json(doc_id, data_version, _chunks):
+    return orjson.dumps(_chunks, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+
+@st.cache_data(show_spinner=False, max_entries=_EXPORT_CACHE_ENTRIES)
+def _index_bytes(doc_id, data_version, _index):
+    # Gemte indekser læses direkte fra disk; et memory-mappet indeks kan ikke serialiseres selvstændigt
+    index_path = os.path.join(storage.get_document_dir(doc_id), "index.faiss")
+    if os.path.exists(index_path):
+        with open(index_path, "rb") as f:
+            return f.read()
+    
+    import faiss  # Tung import; indlæses først når der eksporteres
+    return faiss.serialize_index(_index).tobytes()
+
+@st.cache_data(show_spinner=False, max_entries=_EXPORT_CACHE_ENTRIES)
+def _embedding_bytes(doc_id, data_version, _embedding_dict):
+    return storage.serialize_embeddings(_embedding_dict)
+
+def provide_download_options(chunks, context_summary, doc_id, faiss_index=None, embedding_dict=None, data_version=None):
     """Giver forbedrede muligheder for at downloade data."""
     st.subheader("Eksporter data")
     
     # Download chunks som JSON
-    chunks_json = json.dumps(chunks, ensure_ascii=False, indent=2)
+    chunks_json = _chunks_json(doc_id, data_version, chunks)
     st.download_button(
         label="Download chunks som JSON",
         data=chunks_json,
@@ -295,7 +470,7 @@ def provide_download_options(chunks, context_summary, doc_id, faiss_index=None,
     
     # Download kontekstopsummering
     if context_summary:
-        context_json = json.dumps(context_summary, ensure_ascii=False, indent=2)
+        context_json = orjson.dumps(context_summary, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
         st.download_button(
             label="Download dokumentoversigt som JSON",
             data=context_json,
@@ -309,23 +484,9 @@ def provide_download_options(chunks, context_summary, doc_id, faiss_index=None,
         col1, col2 = st.columns(2)
         
         with col1:
-            # Gem indeks til tempfil og læs bytes
+            # Serialisér indekset direkte i hukommelsen
             try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".faiss") as f:
-                    faiss.write_index(faiss_index, f.name)
-                    temp_name = f.name  # Gem navnet uden for with-blokken
-                
-                # Læs filen i en separat blok
-                with open(temp_name, "rb") as f_read:
-                    index_bytes = f_read.read()
-                
-                # Forsøg at slette filen efter brug
-                try:
-                    os.unlink(temp_name)  # Slet tempfil
-                except PermissionError:
-                    # Hvis filen er låst, ignorér fejlen
-                    # Den slettes automatisk ved programafslutning
-                    pass
+                index_bytes = _index_bytes(doc_id, data_version, faiss_index)
                     
                 st.download_button(
                     label="Download FAISS indeks",
@@ -337,21 +498,32 @@ def provide_download_options(chunks, context_summary, doc_id, faiss_index=None,
                 st.error(f"Kunne ikke eksportere FAISS indeks: {e}")
         
         with col2:
-            # Serialisér embeddings dictionary
-            embedding_bytes = pickle.dumps(embedding_dict)
+            # Serialisér embeddings som én samlet matrix (.npz)
+            embedding_bytes = _embedding_bytes(doc_id, data_version, embedding_dict)
             
             st.download_button(
                 label="Download embeddings",
                 data=embedding_bytes,
-                file_name=f"embeddings_{doc_id}.pkl",
+                file_name=f"embeddings_{doc_id}.npz",
                 mime="application/octet-stream"
             )
 
+# Dokumentoversigten caches kortvarigt, så hver interaktion ikke scanner datamappen igen.
+# Cachen ryddes eksplicit når dokumenter gemmes eller slettes.
+@st.cache_data(ttl=60, show_spinner=False)
+def _documents_dataframe():
+    return storage.get_documents_dataframe()
+
+# Indlæste indekser deles mellem reruns og sessioner, så skift tilbage til et dokument er gratis
+@st.cache_resource(show_spinner=False)
+def _faiss_index(doc_id):
+    return storage.load_faiss_index(doc_id)
+
 def document_listing_page():
     """Viser liste over indekserede dokumenter og mulighed for at indlæse dem."""
     st.header("Indekserede dokumenter")
     
-    docs_df = storage.get_documents_dataframe()
+    docs_df = _documents_dataframe()
     if docs_df.empty:
         st.info("Ingen dokumenter er indekseret endnu. Upload et dokument for at starte.")
         return
@@ -364,14 +536,15 @@ def document_listing_page():
     
     if st.button("Indlæs valgt dokument"):
         with st.spinner(f"Indlæser dokument {selected_doc}..."):
-            document_data = storage.load_complete_document(selected_doc)
+            document_data = storage.load_complete_document(selected_doc, load_index=False)
             
             if document_data:
                 st.session_state.doc_id = selected_doc
                 st.session_state.chunks = document_data["chunks"]
                 st.session_state.context_summary = document_data["metadata"]
-                st.session_state.faiss_index = document_data["index"]
+                st.session_state.faiss_index = _faiss_index(selected_doc)
                 st.session_state.embedding_dict = document_data["embeddings"]
+                st.session_state.data_version = _new_data_version()
                 st.session_state.processing_stats = document_data.get("stats", {})
                 
                 st.success(f"Dokumentet '{selected_doc}' blev indlæst med {len(document_data['chunks'])} chunks")
@@ -384,15 +557,19 @@ def document_listing_page():
         doc_to_delete = st.selectbox("Vælg dokument at slette:", docs_df["doc_id"].tolist(), key="delete_selectbox")
         
         if st.button("Slet valgt dokument", type="primary", help="Dette kan ikke fortrydes!"):
+            # Det memory-mappede indeks holder index.faiss åben, hvilket forhindrer sletning på Windows.
+            # Cachen og session state slipper derfor indekset før mappen slettes.
+            _faiss_index.clear()
+            if st.session_state.doc_id == doc_to_delete:
+                st.session_state.doc_id = None
+                st.session_state.chunks = []
+                st.session_state.context_summary = None
+                st.session_state.faiss_index = None
+                st.session_state.embedding_dict = {}
+            
             if storage.delete_document(doc_to_delete):
+                _documents_dataframe.clear()
                 st.success(f"Dokumentet '{doc_to_delete}' blev slettet")
-                # Fjern fra session state hvis det var det aktive dokument
-                if st.session_state.doc_id == doc_to_delete:
-                    st.session_state.doc_id = None
-                    st.session_state.chunks = []
-                    st.session_state.context_summary = None
-                    st.session_state.faiss_index = None
-                    st.session_state.embedding_dict = {}
                 st.rerun()
             else:
                 st.error(f"Kunne ikke slette dokument {doc_to_delete}")
@@ -411,9 +588,6 @@ def main():
     4. Download chunks eller hele indekset til senere brug
     """)
     
-    # Sikr at datamapper eksisterer
-    storage.ensure_directories()
-    
     # Valg af side
     page = st.sidebar.radio("Vælg side:", ["Upload og Indeksér", "Vis Indekserede Dokumenter"])
     
@@ -430,6 +604,9 @@ def main():
             )
             
             if uploaded_file:
+                # PDF- og FAISS-moduler importeres først her, så første sidevisning ikke venter på dem
+                from utils import pdf_utils, indexing
+                
                 # Indlæs PDF
                 with st.spinner("Indlæser PDF..."):
                     text, pdf_stats = pdf_utils.extract_text_from_pdf(uploaded_file)
@@ -449,21 +626,25 @@ def main():
                 indexer_class = get_indexer_class(doc_type)
                 indexer = indexer_class()
                 
-                # Vis dokumenttype-specifikke indstillinger
-                doc_type_key = indexer.display_settings(st)
-                
-                # Generelle indstillinger for alle dokumenttyper
-                st.session_state.identify_temporary = st.checkbox("Identificer midlertidige bestemmelser", value=True)
-                st.session_state.validate_output = st.checkbox("Validér output og rapporter mangler", value=True)
-                st.session_state.identify_legal_exceptions = st.checkbox("Identificer juridiske undtagelser", value=True)
-                
-                document_title = st.text_input("Dokumenttitel:", value=f"Skatteretligt dokument - {doc_type}")
-                
                 # Estimer tokens
                 estimated_tokens = api_utils.estimate_tokens(text)
                 st.info(f"Estimeret dokumentstørrelse: ~{estimated_tokens} tokens")
                 
-                if st.button("Indekser dokument"):
+                # Indstillingerne ligger i en form, så ændringer først giver rerun ved indsendelse
+                with st.form("upload_form"):
+                    # Vis dokumenttype-specifikke indstillinger
+                    doc_type_key = indexer.display_settings(st)
+                    
+                    # Generelle indstillinger for alle dokumenttyper
+                    st.session_state.identify_temporary = st.checkbox("Identificer midlertidige bestemmelser", value=True)
+                    st.session_state.validate_output = st.checkbox("Validér output og rapporter mangler", value=True)
+                    st.session_state.identify_legal_exceptions = st.checkbox("Identificer juridiske undtagelser", value=True)
+                    
+                    document_title = st.text_input("Dokumenttitel:", value=f"Skatteretligt dokument - {doc_type}")
+                    
+                    submitted = st.form_submit_button("Indekser dokument")
+                
+                if submitted:
                     # Generer dokument ID
                     doc_id = f"{doc_type}_{uuid.uuid4().hex[:8]}"
                     st.session_state.doc_id = doc_id
@@ -488,6 +669,7 @@ def main():
                         if chunks and context_summary:
                             st.session_state.chunks = chunks
                             st.session_state.context_summary = context_summary
+                            st.session_state.data_version = _new_data_version()
                             
                             # Tilføj metadata
                             if "title" not in context_summary:
@@ -501,9 +683,12 @@ def main():
                     # Generer embeddings og opret FAISS indeks
                     if chunks:
                         with st.spinner("Bygger søgeindeks..."):
-                            index, embedding_dict = indexing.build_faiss_index(chunks)
+                            index, embedding_dict = indexing.build_faiss_index(
+                                chunks, quantization=options.get("quantization", "none")
+                            )
                             st.session_state.faiss_index = index
                             st.session_state.embedding_dict = embedding_dict
+                            st.session_state.data_version = _new_data_version()
                             
                             if index is not None and embedding_dict:
                                 st.success(f"Dokumentet er indekseret med {len(chunks)} chunks")
@@ -518,6 +703,7 @@ def main():
                                         embedding_dict,
                                         st.session_state.processing_stats
                                     )
+                                    _documents_dataframe.clear()
                                     st.success("Dokumentet er gemt lokalt og kan nu tilgås fra reader.py")
                             else:
                                 st.error("Kunne ikke bygge søgeindeks")
@@ -537,22 +723,7 @@ def main():
         if st.session_state.chunks:
             with st.expander("Indekserede chunks", expanded=True):
                 st.header("Indekserede chunks")
-                # Tilføj en dropdown til at filtrere chunks
-                chunk_filter = st.selectbox(
-                    "Filtrer chunks efter type:",
-                    ["Alle", "Kun lovtekst", "Kun noter", "Med krydsreferencer", "Midlertidige bestemmelser", 
-                     "Med juridiske undtagelser", "Berørte persongrupper", "Uden referencer", "Høj prioritet", "Komplekse bestemmelser"]
-                )
-                
-                # Filter for specifikke noter eller paragraffer
-                specific_filter = st.text_input("Filtrer efter specifik paragraf, stykke, notenummer eller nøgleord (f.eks. '§ 33 A', '794' eller 'grænsegængere'):")
-                
-                # Vis filtrerede chunks
-                filtered_chunks = display_chunks(
-                    st.session_state.chunks, 
-                    filter_type=chunk_filter if chunk_filter != "Alle" else None,
-                    filter_text=specific_filter if specific_filter else None
-                )
+                chunk_table_section(st.session_state.chunks)
                 
                 # Download muligheder
                 provide_download_options(
@@ -560,7 +731,8 @@ def main():
                     st.session_state.context_summary,
                     st.session_state.doc_id,
                     st.session_state.faiss_index,
-                    st.session_state.embedding_dict
+                    st.session_state.embedding_dict,
+                    st.session_state.data_version
                 )
     
     elif page == "Vis Indekserede Dokumenter":
@@ -1,7 +1,8 @@
 import importlib
 import os
-import inspect
+from functools import lru_cache
 
+@lru_cache(maxsize=1)
 def get_available_indexers():
     """
     Returnerer ordbog over alle tilgængelige indekserere.
@@ -38,9 +39,11 @@ def get_available_indexers():
     
     return indexers
 
+@lru_cache(maxsize=16)
 def get_indexer_class(indexer_type):
     """
     Returnerer indeksererklassen for den angivne type.
+    Resultatet caches, så gentagne Streamlit-reruns ikke importerer modulet igen.
     
     Args:
         indexer_type (str): Type af indekserer
@@ -60,9 +63,9 @@ def get_indexer_class(indexer_type):
         module = importlib.import_module(f".{module_name}", package="indexers")
         
         # Find Indexer-klassen i modulet
-        for name, obj in inspect.getmembers(module):
-            if inspect.isclass(obj) and name == "Indexer":
-                return obj
+        indexer_class = getattr(module, "Indexer", None)
+        if isinstance(indexer_class, type):
+            return indexer_class
                 
         raise ImportError(f"Ingen Indexer-klasse fundet i {module_name}")
         
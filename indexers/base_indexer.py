@@ -1,5 +1,24 @@
 # indexers/base_indexer.py
-import streamlit as st
+import orjson
+import functools
+from pathlib import Path
+
+PROMPT_DIR = Path(__file__).parent / "prompts"
+
+# Felter fra kontekstopsummeringen som chunkingen har brug for. Resten (fx eksempler og
+# administrativ praksis) sendes ikke med i hvert segmentkald.
+CHUNKING_CONTEXT_KEYS = ("document_id", "document_type", "version_date", "deciding_authority")
+CHUNKING_SUMMARY_KEYS = (
+    "main_themes", "legal_issues", "key_concepts", "main_sections", "section_hierarchy",
+    "section_titles", "document_structure", "law_references", "case_references",
+    "facts_summary", "legal_reasoning", "conclusion"
+)
+CHUNKING_TEXT_LIMIT = 500
+
+@functools.lru_cache(maxsize=None)
+def load_prompt(name):
+    """Indlæser en promptskabelon fra indexers/prompts. Hver fil læses kun én gang pr. proces."""
+    return (PROMPT_DIR / f"{name}.txt").read_text(encoding="utf-8")
 
 class BaseIndexer:
     """Basis-klasse for alle indekserere med fælles funktionalitet"""
@@ -8,6 +27,7 @@ class BaseIndexer:
         """Initialiser indeksereren med standardværdier"""
         self.name = "Basis-indekserer"
         self.description = "Basis-indeksererklasse - brug ikke direkte"
+        self._context_json_cache = None
     
     def display_settings(self, st):
         """
@@ -36,6 +56,41 @@ class BaseIndexer:
         """
         raise NotImplementedError("BaseIndexer.process_document() skal implementeres af underklasser")
     
+    def _context_json(self, context_summary):
+        """
+        Serialiserer kontekstopsummeringen til brug i prompts.
+        Resultatet genbruges for samme opsummering, så den ikke serialiseres pr. segment.
+        orjson skriver kompakt UTF-8 uden mellemrum, hvilket også giver færre input-tokens.
+        """
+        cached = self._context_json_cache
+        if cached is None or cached[0] is not context_summary:
+            cached = (context_summary, orjson.dumps(context_summary).decode("utf-8"))
+            self._context_json_cache = cached
+        return cached[1]
+    
+    def _prune_context_for_chunking(self, context_summary):
+        """
+        Skærer kontekstopsummeringen ned til de felter chunkingen bruger.
+        Opsummeringen indsættes i hvert segmentkald, så hvert sparet felt spares pr. segment.
+        """
+        if not isinstance(context_summary, dict):
+            return context_summary
+        
+        pruned = {key: context_summary[key] for key in CHUNKING_CONTEXT_KEYS if key in context_summary}
+        summary = context_summary.get("summary")
+        if isinstance(summary, dict):
+            pruned_summary = {}
+            for key in CHUNKING_SUMMARY_KEYS:
+                value = summary.get(key)
+                if not value:
+                    continue
+                # Lange fritekstfelter forkortes
+                if isinstance(value, str) and len(value) > CHUNKING_TEXT_LIMIT:
+                    value = value[:CHUNKING_TEXT_LIMIT] + "..."
+                pruned_summary[key] = value
+            pruned["summary"] = pruned_summary
+        return pruned
+    
     def get_context_prompt_template(self, doc_type_key):
         """
         Hent kontekstprompt skabelonen baseret på dokumenttype.
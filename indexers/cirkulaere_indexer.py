@@ -1,47 +1,133 @@
 # indexers/cirkulaere_indexer.py
+import os
 import re
-import streamlit as st
-import json
-from .base_indexer import BaseIndexer
-from utils import api_utils, text_analysis, validation, pdf_utils, indexing
-from utils.optimization import cached_call_gpt4o, process_segments_parallel
+import bisect
+import string
+from .base_indexer import BaseIndexer, load_prompt
+
+# Regulære udtryk kompileres én gang ved import i stedet for ved hvert kald
+# Forbehandlingens tre erstatninger samlet i ét mønster, så teksten kun gennemløbes én gang:
+# sidenumre, afsnitsnumre (kun 'Eks' er uafhængig af store/små bogstaver) og eksempelformater.
+# Bogstavet efter et afsnitsnummer tjekkes med lookahead, så en efterfølgende 'Eks.' stadig matches.
+_RE_PREPROCESS = re.compile(
+    r'(?P<page>Side \d+ af \d+)'
+    r'|(?P<section>(\d+)\.(\d+)(?=\s+[A-Za-z]))'
+    r'|(?P<eks>(?i:Eks(?:empel)?[:,.]))'
+)
+_RE_MAIN_SPLIT = re.compile(r'(\d+\.\s+[^0-9]+)')
+_RE_EXAMPLE = re.compile(r'(Eksempel:(?:.*?)(?=\n\n|\n\d+\.|\Z))', re.DOTALL)
+_RE_EKSEMPEL_CHECK = re.compile(r'Eksempel:', re.IGNORECASE)
+# Lovhenvisninger med eller uden lovnavn i ét mønster, så hver paragraf kun matches én gang.
+# Et bogstav efter paragrafnummeret (§ 7 A) tælles kun med når det står alene, ikke som
+# begyndelsen på 'stk.'.
+_RE_LAW = re.compile(
+    r'(?:(?P<lov>(?:lignings|person|kilde|selskabs)lovens?)\s+)?'
+    r'§\s*(?P<num>\d+(?:\s?[A-Za-z]\b)?)'
+    r'(?:,?\s*(?:stk\.|stykke)\s*(?P<stk>\d+))?',
+    re.IGNORECASE
+)
+
+def _preprocess_replacement(match):
+    """Vælger erstatningen for det match _RE_PREPROCESS fandt"""
+    kind = match.lastgroup
+    if kind == "page":
+        # Fjern sidenumre og andre forstyrrende elementer
+        return ''
+    if kind == "section":
+        # Normalisér afsnits- og punktnummerering
+        return f"{match.group(3)}.{match.group(4)}."
+    # Standardisér eksempelformater
+    return 'Eksempel:'
+
+# Under denne grænse er opstarten af en procespulje dyrere end selve scanningen
+_PARALLEL_MIN_CHUNKS = 2000
+
+def _scan_chunk_contents(contents):
+    """Finder eksempler og lovhenvisninger i en liste af chunktekster. Returnerer (is_example, law_refs)."""
+    # Alle chunks scannes i én samlet tekst i stedet for ét regex-kald pr. chunk.
+    # NUL-tegnet indgår ikke i nogen af mønstrene, så et match kan ikke krydse to chunks.
+    buffer = "\0".join(contents)
+    starts = []
+    offset = 0
+    for content in contents:
+        starts.append(offset)
+        offset += len(content) + 1
+    
+    def chunk_index(match):
+        return bisect.bisect_right(starts, match.start()) - 1
+    
+    # Identificer eksempler
+    is_example = [False] * len(contents)
+    for match in _RE_EKSEMPEL_CHECK.finditer(buffer):
+        is_example[chunk_index(match)] = True
+    
+    # Find lovhenvisninger
+    law_refs = [[] for _ in contents]
+    for match in _RE_LAW.finditer(buffer):
+        lov, num, stk = match.group('lov', 'num', 'stk')
+        # Lov + paragraf eller direkte paragrafhenvisning
+        ref = f"{lov} § {num}" if lov else f"§ {num}"
+        if stk:
+            ref += f", stk. {stk}"
+        law_refs[chunk_index(match)].append(ref)
+    
+    # Fjern dubletter men bevar rækkefølgen
+    law_refs = [list(dict.fromkeys(refs)) for refs in law_refs]
+    
+    return is_example, law_refs
 
 class Indexer(BaseIndexer):
+    # Promptskabelonerne ligger i indexers/prompts og indlæses én gang ved import.
+    # Indekseringsprompten er en string.Template, så kun de dynamiske felter udfyldes pr. segment.
+    # De dynamiske felter står til sidst, så det statiske præfiks er ens for alle kald og kan
+    # genbruges af API'ets prompt-caching.
+    CONTEXT_PROMPT_SKATTE_CIRKULAERE = load_prompt("cirkulaere_skatte_cirkulaere_context")
+    CONTEXT_PROMPT_DEFAULT = load_prompt("cirkulaere_default_context")
+    INDEXING_PROMPT = string.Template(load_prompt("cirkulaere_indexing"))
+    
+    # Typetabellerne er konstanter og deles af alle instanser, da Streamlit opretter
+    # indeksereren igen ved hver rerun
+    CIRKULAERE_TYPES = {
+        "skatte_cirkulaere": {
+            "display_name": "Skattecirkulære",
+            "template_name": "skatte_cirkulaere_template",
+            "section_pattern": r'\d+(\.\d+)*',
+            "example_pattern": r'Eksempel:',
+            "case_reference_patterns": ["SKM", "TfS", "U", "LSRM"]
+        },
+        "told_cirkulaere": {
+            "display_name": "Toldcirkulære",
+            "template_name": "told_cirkulaere_template",
+            "section_pattern": r'\d+(\.\d+)*',
+            "example_pattern": r'Eksempel:',
+            "case_reference_patterns": ["SKM", "TfS", "U", "LSRM"]
+        },
+        "andet_cirkulaere": {
+            "display_name": "Andet cirkulære",
+            "template_name": "andet_cirkulaere_template",
+            "section_pattern": r'\d+(\.\d+)*',
+            "example_pattern": r'Eksempel:',
+            "case_reference_patterns": ["SKM", "TfS", "U", "LSRM"]
+        }
+    }
+    
+    # Kontekstprompten for hver type slås op én gang her i stedet for at forgrene ved hvert kald
+    CONTEXT_PROMPTS = {
+        **dict.fromkeys(CIRKULAERE_TYPES, CONTEXT_PROMPT_DEFAULT),
+        "skatte_cirkulaere": CONTEXT_PROMPT_SKATTE_CIRKULAERE
+    }
+    
     def __init__(self):
         super().__init__()
         self.name = "Cirkulære-indekserer"
         self.description = "Specialiseret indeksering af cirkulærer"
-        
-        self.cirkulaere_types = {
-            "skatte_cirkulaere": {
-                "display_name": "Skattecirkulære",
-                "template_name": "skatte_cirkulaere_template",
-                "section_pattern": r'\d+(\.\d+)*',
-                "example_pattern": r'Eksempel:',
-                "case_reference_patterns": ["SKM", "TfS", "U", "LSRM"]
-            },
-            "told_cirkulaere": {
-                "display_name": "Toldcirkulære",
-                "template_name": "told_cirkulaere_template",
-                "section_pattern": r'\d+(\.\d+)*',
-                "example_pattern": r'Eksempel:',
-                "case_reference_patterns": ["SKM", "TfS", "U", "LSRM"]
-            },
-            "andet_cirkulaere": {
-                "display_name": "Andet cirkulære",
-                "template_name": "andet_cirkulaere_template",
-                "section_pattern": r'\d+(\.\d+)*',
-                "example_pattern": r'Eksempel:',
-                "case_reference_patterns": ["SKM", "TfS", "U", "LSRM"]
-            }
-        }
     
     def display_settings(self, st):
         """Viser indstillinger specifikt for cirkulærer"""
         cirkulaere_type = st.selectbox(
             "Cirkulæretype:",
-            list(self.cirkulaere_types.keys()),
-            format_func=lambda x: self.cirkulaere_types[x]["display_name"]
+            list(self.CIRKULAERE_TYPES.keys()),
+            format_func=lambda x: self.CIRKULAERE_TYPES[x]["display_name"]
         )
         
         # Cirkulærespecifikke indstillinger
@@ -67,6 +153,11 @@ class Indexer(BaseIndexer):
     
     def process_document(self, text, doc_id, options):
         """Processer cirkulæredokument"""
+        # Streamlit og API-modulerne importeres først her, så modulet kan importeres billigt
+        # uden UI, f.eks. af arbejdsprocesser der kun skal bruge tekstbehandlingen
+        import streamlit as st
+        from utils.optimization import cached_call_gpt4o, process_segments_parallel, process_segments_batched
+        
         # 1. Preprocessering - tilpasset til cirkulærer
         processed_text = self._preprocess_cirkulaere(text)
         
@@ -74,7 +165,6 @@ class Indexer(BaseIndexer):
         segments, preserved_content, segment_stats = self._segment_cirkulaere(
             processed_text, max_segment_length=options.get("max_text_length", 30000)
         )
-        st.session_state.preserved_content = preserved_content
         
         # 3. Kontekstanalyse med cirkulærefokus
         with st.spinner("Analyserer cirkulærets struktur og indhold..."):
@@ -84,7 +174,8 @@ class Indexer(BaseIndexer):
             
             context_summary = cached_call_gpt4o(
                 context_prompt_with_text,
-                model=options.get("model", "gpt-4o")
+                model=options.get("model", "gpt-4o"),
+                prompt_cache_key=f"cirkulaere-context-{cirkulaere_type}"
             )
             if not context_summary:
                 st.error("Kunne ikke generere cirkulæreanalyse. Prøv igen.")
@@ -92,10 +183,12 @@ class Indexer(BaseIndexer):
         
         # 4. Chunking med cirkulærespecifikke prompts
         with st.spinner("Opdeler cirkulæret i meningsfulde chunks..."):
-            chunks = process_segments_parallel(
+            # Batch API'et er billigere men asynkront, så det bruges kun når det er valgt
+            process_segments = process_segments_batched if options.get("batch_mode") else process_segments_parallel
+            chunks = process_segments(
                 segments, 
                 cirkulaere_type, 
-                context_summary, 
+                self._prune_context_for_chunking(context_summary), 
                 doc_id, 
                 options,
                 get_template_func=self.get_indexing_prompt_template
@@ -109,59 +202,55 @@ class Indexer(BaseIndexer):
             if st.session_state.link_to_law:
                 chunks = self._link_to_law_paragraphs(chunks)
         
+        # Session state skrives først når dokumentet er færdigbehandlet, ikke midt i beregningen
+        st.session_state.preserved_content = preserved_content
+        
         return chunks, context_summary
     
     def _preprocess_cirkulaere(self, text):
         """Forbehandling specifikt for cirkulærer"""
-        # Fjern sidenumre og andre forstyrrende elementer
-        text = re.sub(r'Side \d+ af \d+', '', text)
-        
-        # Normalisér afsnits- og punktnummerering 
-        text = re.sub(r'(\d+)\.(\d+)(\s+[A-Za-z])', r'\1.\2.\3', text)
-        
-        # Standardisér eksempelformater
-        text = re.sub(r'Eks(?:empel)?[:,.]', 'Eksempel:', text, flags=re.IGNORECASE)
-        
-        return text
+        return _RE_PREPROCESS.sub(_preprocess_replacement, text)
     
     def _segment_cirkulaere(self, text, max_segment_length=30000):
         """Segmentering tilpasset cirkulærestruktur"""
         segments = []
         preserved_content = {"sections": {}, "examples": {}}
         
-        # Del ved hovedafsnit (f.eks. 1., 2. osv.)
-        main_sections = re.split(r'(\d+\.\s+[^0-9]+)', text)
+        # Del ved hovedafsnit (f.eks. 1., 2. osv.). Der findes kun overskrifternes positioner,
+        # og hver sektion skæres direkte ud af teksten fra sin overskrift til den næste.
+        headers = list(_RE_MAIN_SPLIT.finditer(text))
         
-        current_segment = ""
-        for i in range(0, len(main_sections)-1, 2):
-            if i+1 < len(main_sections):
-                section_header = main_sections[i]
-                section_content = main_sections[i+1]
-                full_section = section_header + section_content
-                
-                # Bevar original sektions-tekst
-                section_id = section_header.strip()
-                preserved_content["sections"][section_id] = full_section
-                
-                # Del i passende segmenter
-                if len(current_segment + full_section) > max_segment_length:
-                    if current_segment:
-                        segments.append(current_segment)
-                    current_segment = full_section
-                else:
-                    current_segment += full_section
+        def collect_examples(section_text):
+            # Eksempler udpakkes mens sektionen alligevel behandles, så segmenterne ikke scannes igen
+            for match in _RE_EXAMPLE.finditer(section_text):
+                example_id = f"eks_{len(preserved_content['examples'])+1}"
+                preserved_content["examples"][example_id] = match.group(1)
         
-        # Tilføj sidste segment
-        if current_segment:
-            segments.append(current_segment)
+        # Sektionerne ligger i forlængelse af hinanden, så et segment er blot et interval i teksten,
+        # der skæres ud én gang når det er fuldt, i stedet for at blive bygget op med +=.
+        # Tekst før første overskrift indgår i første segment.
+        segment_start = 0
+        segment_end = headers[0].start() if headers else len(text)
+        collect_examples(text[:segment_end])
+        for i, header in enumerate(headers):
+            end = headers[i+1].start() if i+1 < len(headers) else len(text)
+            full_section = text[header.start():end]
+            
+            # Bevar original sektions-tekst
+            section_id = header.group(1).strip()
+            preserved_content["sections"][section_id] = full_section
+            collect_examples(full_section)
+            
+            # Del i passende segmenter
+            if (segment_end - segment_start) + len(full_section) > max_segment_length:
+                if segment_end > segment_start:
+                    segments.append(text[segment_start:segment_end])
+                segment_start = header.start()
+            segment_end = end
         
-        # Udpak eksempler
-        example_pattern = r'(Eksempel:(?:.*?)(?=\n\n|\n\d+\.|\Z))'
-        for segment in segments:
-            for match in re.finditer(example_pattern, segment, re.DOTALL):
-                example_text = match.group(1)
-                example_id = f"eks_{len(preserved_content['examples'])+1}"
-                preserved_content["examples"][example_id] = example_text
+        # Tilføj sidste segment
+        if segment_end > segment_start:
+            segments.append(text[segment_start:segment_end])
         
         stats = {
             "segments": len(segments),
@@ -173,189 +262,57 @@ class Indexer(BaseIndexer):
     
     def get_context_prompt_template(self, cirkulaere_type):
         """Bygger en kontekst-prompt skabelon specifikt til cirkulærer"""
-        if cirkulaere_type == "skatte_cirkulaere":
-            return """
-            Du er en ekspert i dansk skatteret, særligt cirkulærer. 
-            Læs hele teksten og opbyg en forståelse af cirkulærets struktur, temaer og relationer.
-            
-            RETURNER DIN SVAR SOM JSON.
-            
-            Returner en JSON-opsummering med:
-            - Cirkulærets nummer og dato
-            - Hovedafsnit og underafsnit (identificeret ved nummerering som 1.2.3)
-            - Centrale temaer der behandles i cirkulæret
-            - Lovhenvisninger og referencer til paragraffer i skattelovgivningen
-            - Eksempler og deres formål
-            - Administrativ praksis beskrevet i cirkulæret
-            
-            Format:
-            {
-              "document_id": "cirkulære_nummer",
-              "document_type": "cirkulære", 
-              "version_date": "YYYY-MM-DD",
-              "summary": {
-                "main_sections": ["1", "2", "3"],
-                "section_hierarchy": {"1": ["1.1", "1.2"]},
-                "section_titles": {"1": "Titel for afsnit 1"},
-                "key_concepts": ["nøgleord1", "nøgleord2"],
-                "law_references": {
-                  "§ 33 A": ["afsnit 1.1", "afsnit 2.3"],
-                  "Kildeskattelovens § 1": ["afsnit 3.2"]
-                },
-                "examples": {
-                  "1": {
-                    "location": "afsnit 1.2",
-                    "describes": "Eksempel på...",
-                    "law_reference": "§ X, stk. Y"
-                  }
-                },
-                "administrative_practice": [
-                  {
-                    "theme": "Tema",
-                    "sections": ["1.3"],
-                    "description": "Beskrivelse af praksis"
-                  }
-                ]
-              }
-            }
-            """
-        else:
-            # Default cirkulære-prompt
-            return """
-            Du er en ekspert i dansk skatteret. Læs dette cirkulære og opbyg en forståelse af dets struktur og indhold.
-            
-            RETURNER DIN SVAR SOM JSON.
-            
-            Returner en JSON-opsummering med:
-            - Cirkulærets nummer og dato
-            - Hovedpunkter og underpunkter
-            - Centrale temaer der behandles
-            - Lovhenvisninger og referencer
-            - Eksempler og deres formål
-            
-            Format:
-            {
-              "document_id": "cirkulære_nummer",
-              "document_type": "cirkulære", 
-              "version_date": "YYYY-MM-DD",
-              "summary": {
-                "main_sections": ["1", "2", "3"],
-                "section_hierarchy": {"1": ["1.1", "1.2"]},
-                "key_concepts": ["nøgleord1", "nøgleord2"],
-                "law_references": {"§ 33 A": ["afsnit 1.1"]},
-                "examples": {"1": {"location": "afsnit 1.2", "describes": "Eksempel på..."}}
-              }
-            }
-            """
+        # Default-prompt for ukendte typer
+        return self.CONTEXT_PROMPTS.get(cirkulaere_type, self.CONTEXT_PROMPT_DEFAULT)
     
     def get_indexing_prompt_template(self, cirkulaere_type, context_summary, doc_id, section_number):
         """Bygger en indekseringsprompt for cirkulærer"""
-        return f"""
-        Du er en ekspert i dansk skatteret der skal indeksere skatteretlige cirkulærer. 
-        Du har fået denne kontekst: {json.dumps(context_summary, ensure_ascii=False)}.
-        
-        Dette er sektion {section_number} af cirkulæret. Din opgave er at opdele denne sektion i semantisk meningsfulde chunks.
-        
-        Opdel teksten i semantisk meningsfulde chunks baseret på cirkulærets struktur (punkter og underpunkter).
-        CHUNK ALDRIG MIDT I EN SÆTNING. 
-        
-        VIGTIGSTE REGEL: Bevar den KOMPLETTE, UÆNDREDE tekst fra kilden. Lav ALDRIG opsummeringer eller parafraseringer.
-        
-        RETURNER DIN SVAR SOM JSON.
-        
-        Tildel følgende metadata til hvert chunk:
-        1. Dokument-ID: "{doc_id}"
-        2. Afsnitsnummer (f.eks. "1.2.3")
-        3. Afsnitstitel hvis den findes
-        4. Nøgleord (maks 5 pr. chunk)
-        5. Lovhenvisninger (hvilke paragraffer omtales)
-        6. Er dette et eksempel? (true/false)
-        7. Referencer til domme/afgørelser
-        8. Normaliserede referencer
-        9. Tema og undertema
-        10. Chunk-type (indledning, definition, beskrivelse, eksempel, praksis)
-        11. Administrativ praksis (beskrivelse af praksis hvis relevant)
-        12. Målgruppe (hvem er cirkulæret rettet mod)
-        13. Kompleksitetsgrad (simpel, moderat, kompleks)
-        
-        Returner JSON:
-        {{
-          "chunks": [
-            {{
-              "content": "NØJAGTIG tekst fra kilden uden ændringer",
-              "metadata": {{
-                "doc_id": "{doc_id}",
-                "section": "1.2.3",
-                "section_title": "Titel på afsnittet",
-                "concepts": ["nøgleord1", "nøgleord2", "nøgleord3", "nøgleord4", "nøgleord5"],
-                "law_references": ["Ligningslovens § 33 A, stk. 1", "Kildeskattelovens § 1"],
-                "is_example": false,
-                "case_references": ["SKM.2019.123", "TfS.2018.456"],
-                "normalized_references": ["SKM.2019.123", "TfS.2018.456"],
-                "theme": "tema",
-                "subtheme": "undertema",
-                "chunk_type": "beskrivelse/eksempel/praksis",
-                "administrative_practice": "beskrivelse af praksis eller null",
-                "target_audience": ["skatteydere", "virksomheder", "rådgivere"],
-                "complexity": "simpel/moderat/kompleks"
-              }}
-            }}
-          ]
-        }}
-        """
+        return self.INDEXING_PROMPT.substitute(
+            context_json=self._context_json(context_summary),
+            doc_id=doc_id,
+            section_number=section_number
+        )
     
     def _extract_examples_and_references(self, chunks):
         """Udtrækker eksempler og lovhenvisninger fra chunks"""
-        updated_chunks = []
+        from utils.optimization import map_in_processes
         
-        for chunk in chunks:
-            updated_chunk = chunk.copy()
-            content = chunk.get("content", "")
-            
-            # Identificer eksempler
-            if re.search(r'Eksempel:', content, re.IGNORECASE):
-                updated_chunk["metadata"]["is_example"] = True
-                updated_chunk["metadata"]["chunk_type"] = "eksempel"
-            
-            # Find lovhenvisninger
-            law_refs = []
-            patterns = [
-                r'((?:lignings|person|kilde|selskabs)lovens?)\s+§\s*(\d+\s*[A-Za-z]?)(?:,?\s*(?:stk\.|stykke)\s*(\d+))?',
-                r'(§\s*\d+\s*[A-Za-z]?)(?:,?\s*(?:stk\.|stykke)\s*(\d+))?'
-            ]
-            
-            for pattern in patterns:
-                for match in re.finditer(pattern, content, re.IGNORECASE):
-                    if len(match.groups()) >= 2 and match.group(2):
-                        if match.group(1).lower().startswith('§'):
-                            # Direkte paragrafhenvisning
-                            ref = match.group(1)
-                            if len(match.groups()) >= 3 and match.group(3):
-                                ref += f", stk. {match.group(3)}"
-                            law_refs.append(ref)
-                        else:
-                            # Lov + paragraf
-                            lov = match.group(1)
-                            para = match.group(2)
-                            ref = f"{lov} § {para}"
-                            if len(match.groups()) >= 3 and match.group(3):
-                                ref += f", stk. {match.group(3)}"
-                            law_refs.append(ref)
-            
-            if law_refs:
-                updated_chunk["metadata"]["law_references"] = law_refs
-            
-            updated_chunks.append(updated_chunk)
+        contents = [chunk.get("content", "") for chunk in chunks]
+        
+        # Store dokumenter fordeles i sammenhængende dele over en procespulje, da scanningen er ren CPU.
+        # map_in_processes starter processerne med 'spawn', så de ikke arver serverens låse og caches.
+        workers = min(os.cpu_count() or 1, len(contents) // _PARALLEL_MIN_CHUNKS)
+        if workers > 1:
+            step = -(-len(contents) // workers)
+            parts = [contents[i:i+step] for i in range(0, len(contents), step)]
+            part_results = [None] * len(parts)
+            for i, future in map_in_processes(_scan_chunk_contents, parts, max_workers=len(parts)):
+                part_results[i] = future.result()
+            is_example, law_refs = [], []
+            for part_examples, part_refs in part_results:
+                is_example.extend(part_examples)
+                law_refs.extend(part_refs)
+        else:
+            is_example, law_refs = _scan_chunk_contents(contents)
+        
+        # Resultatkolonnerne skrives direkte i chunkenes metadata i stedet for at kopiere hver chunk
+        for chunk, example, refs in zip(chunks, is_example, law_refs):
+            if example:
+                chunk["metadata"]["is_example"] = True
+                chunk["metadata"]["chunk_type"] = "eksempel"
+            if refs:
+                chunk["metadata"]["law_references"] = refs
         
-        return updated_chunks
+        return chunks
     
     def _link_to_law_paragraphs(self, chunks):
         """Skaber relationer mellem cirkulære og lovtekst"""
         # Dette ville kræve en database af indekserede lovparagraffer
         # Her vises en simplificeret version
         
+        # Kun chunks med lovhenvisninger berøres; de øvrige springes over med ét opslag
         for chunk in chunks:
-            if "law_references" in chunk["metadata"] and chunk["metadata"]["law_references"]:
+            if chunk["metadata"].get("law_references"):
                 # Her ville man faktisk slå op i en database af lovtekst
                 # For nu markerer vi bare relationen
                 chunk["metadata"]["linked_to_law"] = True
@@ -1,12 +1,71 @@
 # indexers/generisk_indexer.py
 import re
+import string
 import streamlit as st
 import json
-from .base_indexer import BaseIndexer
+from concurrent.futures import Future
+from .base_indexer import BaseIndexer, load_prompt
 from utils import api_utils, text_analysis, validation, pdf_utils, indexing
-from utils.optimization import cached_call_gpt4o, process_segments_parallel
+from utils.optimization import start_context_call, process_segments_parallel
+
+# Referencemønsteret kompileres én gang ved import og genbruges for alle dokumenter
+_REF_SCANNER = text_analysis.build_ref_scanner()
+
+# Generiske dokumenter under denne længde som fylder ét segment får ingen separat kontekstanalyse;
+# segmentkaldet ser alligevel hele teksten, og den generiske opsummering har ingen typespecifikke felter
+SHORT_DOCUMENT_LENGTH = 8000
+
+# JSON-skemaerne sendes minificeret i prompterne; feltforklaringerne står i promptteksten.
+# doc_id er udeladt af chunk-skemaet, da det sættes på hvert chunk efter svaret er modtaget.
+CONTEXT_SCHEMA = {
+    "document_id": "",
+    "document_type": "",
+    "version_date": "",
+    "summary": {
+        "main_themes": [],
+        "key_concepts": [],
+        "document_structure": {"§ 1": ["Stk. 1"]},
+        "section_titles": {"§ 1": ""},
+        "law_references": [],
+        "notes_overview": {"1": {"text": "", "references": [], "key_legal_exceptions": []}},
+        "legal_exceptions": [{"rule": "", "exception": "", "source": ""}]
+    }
+}
+CHUNK_SCHEMA = {
+    "chunks": [{
+        "content": "",
+        "metadata": {
+            "type": "",
+            "paragraph": "",
+            "stykke": "",
+            "concepts": [],
+            "law_references": [],
+            "case_references": [],
+            "normalized_references": [],
+            "theme": "",
+            "subtheme": "",
+            "is_note": False,
+            "is_exception": False,
+            "affected_groups": [],
+            "complexity": ""
+        }
+    }]
+}
+
+def _schema_json(schema):
+    return json.dumps(schema, ensure_ascii=False, separators=(",", ":"))
 
 class Indexer(BaseIndexer):
+    # Promptskabelonerne ligger i indexers/prompts og indlæses én gang ved import.
+    # De dynamiske felter står til sidst i indekseringsprompten, så det statiske præfiks er ens
+    # for alle segmentkald og kan genbruges af API'ets prompt-caching.
+    CONTEXT_PROMPT = string.Template(load_prompt("generisk_context")).substitute(
+        schema_json=_schema_json(CONTEXT_SCHEMA)
+    )
+    INDEXING_PROMPT = string.Template(
+        string.Template(load_prompt("generisk_indexing")).safe_substitute(schema_json=_schema_json(CHUNK_SCHEMA))
+    )
+    
     def __init__(self):
         super().__init__()
         self.name = "Generisk indekserer"
@@ -35,146 +94,88 @@ class Indexer(BaseIndexer):
         
         return doc_type_key
     
+    def _short_document_context(self, segments, processed_text, doc_type_key):
+        """
+        Returnerer en minimal kontekstopsummering for korte dokumenter i ét segment,
+        så kontekstkaldet kan springes over. Returnerer None når kontekstanalysen skal køres.
+        """
+        if len(segments) == 1 and len(processed_text) < SHORT_DOCUMENT_LENGTH:
+            return {"document_type": doc_type_key, "summary": {}}
+        return None
+    
     def process_document(self, text, doc_id, options):
         """
         Processer dokument med generisk indeksering
         """
         # 1. Preprocessering
-        processed_text, text_sections = pdf_utils.preprocess_legal_text(text)
-        st.session_state.original_text_sections = text_sections
-        st.session_state.original_text = text
-        
-        # 2. Segmentering
-        segments, preserved_content, segment_stats = text_analysis.segment_text_for_processing(
-            processed_text, max_segment_length=options.get("max_text_length", 30000)
+        # Sektionsudsnittene bruges ikke videre, så de gemmes ikke i session state
+        processed_text, _ = pdf_utils.preprocess_legal_text(text)
+        
+        # 2. Segmentering leveres løbende, så kontekstanalysen kan starte på første segment
+        max_segment_length = options.get("max_text_length", 30000)
+        st.write(f"Original tekstlængde: {len(processed_text)} tegn")
+        st.write(f"Maksimal segmentlængde: {max_segment_length} tegn")
+        preserved_content = text_analysis.new_preserved_content()
+        segment_counts = {}
+        segment_iter = text_analysis.iter_segments_for_processing(
+            processed_text, max_segment_length, preserved_content, segment_counts
         )
-        st.session_state.preserved_content = preserved_content
-        
-        # 3. Kontekstanalyse
-        with st.spinner("Analyserer dokumentets struktur og indhold..."):
-            context_prompt = self.get_context_prompt_template(options.get("doc_type_key", "generisk"))
-            context_prompt_with_text = context_prompt + "\n\nDokument:\n" + segments[0]
-            
-            context_summary = cached_call_gpt4o(
+        first_segment = next(segment_iter, None)
+        if first_segment is None:
+            st.error("Dokumentet indeholder ingen tekst der kan segmenteres.")
+            return None, None
+        
+        # 3. Kontekstanalyse startes i baggrunden, så resten af segmenteringen kører mens kaldet er undervejs.
+        # Korte dokumenter segmenteres færdigt med det samme, og fylder de ét segment springes kaldet over.
+        doc_type_key = options.get("doc_type_key", "generisk")
+        remaining_segments = list(segment_iter) if len(processed_text) < SHORT_DOCUMENT_LENGTH else []
+        context_summary = self._short_document_context([first_segment, *remaining_segments], processed_text, doc_type_key)
+        if context_summary is None:
+            context_prompt = self.get_context_prompt_template(doc_type_key)
+            context_prompt_with_text = context_prompt + "\n\nDokument:\n" + first_segment
+            context_summary = start_context_call(
                 context_prompt_with_text,
-                model=options.get("model", "gpt-4o")
+                model=options.get("model", "gpt-4o"),
+                prompt_cache_key=f"generisk-context-{doc_type_key}"
             )
-            if not context_summary:
-                st.error("Kunne ikke generere kontekstopsummering. Prøv igen.")
-                return None, None
+        
+        segments = [first_segment, *remaining_segments, *segment_iter]
+        text_analysis.summarize_segments(segments, preserved_content, segment_counts)
         
         # 4. Chunking med parallelisering
-        with st.spinner("Opdeler dokumentet i meningsfulde chunks..."):
+        with st.spinner("Analyserer dokumentet og opdeler det i meningsfulde chunks..."):
             chunks = process_segments_parallel(
                 segments, 
-                options.get("doc_type_key", "generisk"), 
+                doc_type_key, 
                 context_summary, 
                 doc_id, 
                 options,
                 get_template_func=self.get_indexing_prompt_template
             )
         
+        if isinstance(context_summary, Future):
+            context_summary = context_summary.result()
+        if not context_summary:
+            st.error("Kunne ikke generere kontekstopsummering. Prøv igen.")
+            return None, None
+        
         # 5. Normalisér referencer hvis aktiveret
         if st.session_state.detect_references:
-            chunks = text_analysis.normalize_case_references(chunks)
+            chunks = text_analysis.normalize_case_references(chunks, scanner=_REF_SCANNER)
+        
+        # Session state skrives først når dokumentet er færdigbehandlet, ikke midt i beregningen
+        st.session_state.preserved_content = preserved_content
         
         return chunks, context_summary
     
     def get_context_prompt_template(self, doc_type_key):
         """Henter kontekstprompt skabelonen for generisk indeksering."""
-        return """
-        Du er en ekspert i dansk skatteret. Læs dette dokument og opbyg en forståelse af dets struktur og indhold.
-        
-        RETURNER DIN SVAR SOM JSON.
-        
-        Returner en JSON-opsummering med:
-        - Dokumentets type og formål
-        - Hovedtemaer og nøglebegreber
-        - Struktur (kapitler, afsnit, punkter)
-        - Referencer til love, paragraffer, og retskilder
-        - Noter og fortolkningsbidrag hvis de findes
-        
-        Format:
-        {
-          "document_id": "unik_id_for_dokumentet",
-          "document_type": "lovtekst/vejledning/andet", 
-          "version_date": "YYYY-MM-DD",
-          "summary": {
-            "main_themes": ["tema1", "tema2"],
-            "key_concepts": ["nøgleord1", "nøgleord2"],
-            "document_structure": {
-              "§ 1": ["Stk. 1", "Stk. 2"],
-              "§ 2": ["Stk. 1"]
-            },
-            "section_titles": {"§ 1": "Titel for paragraf 1"},
-            "law_references": ["Kildeskattelovens § 1", "Ligningslovens § 33 A"],
-            "notes_overview": {
-              "1": {
-                "text": "Første del af noten...",
-                "references": ["§ 1", "§ 2"],
-                "key_legal_exceptions": ["Undtagelsesregel 1"]
-              }
-            },
-            "legal_exceptions": [
-              {
-                "rule": "Hovedregel",
-                "exception": "Undtagelse",
-                "source": "§ X, Stk. Y"
-              }
-            ]
-          }
-        }
-        """
+        return self.CONTEXT_PROMPT
     
     def get_indexing_prompt_template(self, doc_type_key, context_summary, doc_id, section_number):
         """Henter indekseringsprompt skabelonen for generisk indeksering."""
-        return f"""
-        Du er en ekspert i dansk skatteret der skal indeksere et dokument. 
-        Du har fået denne kontekst: {json.dumps(context_summary, ensure_ascii=False)}.
-        
-        Dette er sektion {section_number} af dokumentet. Din opgave er at opdele denne sektion i semantisk meningsfulde chunks.
-        
-        Opdel teksten i semantisk meningsfulde chunks baseret på dokumentets struktur.
-        CHUNK ALDRIG MIDT I EN SÆTNING. 
-        
-        VIGTIGSTE REGEL: Bevar den KOMPLETTE, UÆNDREDE tekst fra kilden. Lav ALDRIG opsummeringer eller parafraseringer.
-        
-        RETURNER DIN SVAR SOM JSON.
-        
-        Tildel følgende metadata til hvert chunk:
-        1. Dokument-ID: "{doc_id}"
-        2. Type (lovtekst, note, vejledning, osv.)
-        3. Position (paragraf, stykke, afsnit, osv.) hvis relevant
-        4. Nøgleord (maks 5 pr. chunk)
-        5. Referencer til love/paragraffer
-        6. Referencer til domme/afgørelser
-        7. Normaliserede referencer
-        8. Tema og undertema
-        9. Er dette en specialregel eller undtagelse? (true/false)
-        10. Kompleksitetsgrad (simpel, moderat, kompleks)
-        
-        Returner JSON:
-        {{
-          "chunks": [
-            {{
-              "content": "NØJAGTIG tekst fra kilden uden ændringer",
-              "metadata": {{
-                "doc_id": "{doc_id}",
-                "type": "lovtekst/note/vejledning/osv",
-                "paragraph": "§ X",
-                "stykke": "Stk. Y",
-                "concepts": ["nøgleord1", "nøgleord2", "nøgleord3"],
-                "law_references": ["Ligningslovens § 33 A, stk. 1"],
-                "case_references": ["SKM.2019.123"],
-                "normalized_references": ["SKM.2019.123"],
-                "theme": "tema",
-                "subtheme": "undertema",
-                "is_note": false,
-                "is_exception": false,
-                "affected_groups": ["skatteydere", "virksomheder", "rådgivere"],
-                "complexity": "simpel/moderat/kompleks"
-              }}
-            }}
-          ]
-        }}
-        """
\ No newline at end of file
+        return self.INDEXING_PROMPT.substitute(
+            context_json=self._context_json(context_summary),
+            doc_id=doc_id,
+            section_number=section_number
+        )
\ No newline at end of file
@@ -1,15 +1,441 @@
 # indexers/juridisk_vejledning_indexer.py
 import re
+import time
+import hashlib
 import streamlit as st
 import json
 import numpy as np
 import logging
+import threading
 from typing import Dict, List, Tuple, Any, Optional, Union
 from collections import defaultdict
+from itertools import accumulate
 
 from .base_indexer import BaseIndexer
 from utils import api_utils, text_analysis, validation, pdf_utils
-from utils.optimization import cached_call_gpt4o, process_segments_parallel
+from utils.optimization import (
+    cached_call_gpt4o, process_segments_parallel, map_in_threads, map_in_processes, prefetch_gpt_batch,
+    prefetch_gpt_async
+)
+
+try:
+    import re2  # Lineær regex-motor uden backtracking (pip install google-re2)
+    RE2_AVAILABLE = True
+except ImportError:
+    RE2_AVAILABLE = False
+
+try:
+    import ahocorasick  # Aho-Corasick-automat til søgning efter mange nøgleord (pip install pyahocorasick)
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+try:
+    import hyperscan  # SIMD-baseret scanning efter mange mønstre på én gang (pip install hyperscan)
+    HYPERSCAN_AVAILABLE = True
+except ImportError:
+    HYPERSCAN_AVAILABLE = False
+
+# Pythons \s, \d og \w dækker Unicode (fx hårde mellemrum fra PDF'er og æøå), RE2's kun ASCII.
+# Værdierne er klassernes indhold, så de også kan indsættes i en eksisterende tegnklasse.
+_RE2_UNICODE_CLASSES = {
+    r'\s': r'\t\n\x0b\f\r \x1c-\x1f\x{85}\x{a0}\x{1680}\x{2000}-\x{200a}\x{2028}\x{2029}\x{202f}\x{205f}\x{3000}',
+    r'\d': r'\p{Nd}',
+    r'\w': r'\pL\pN_',
+}
+_RE_CHAR_CLASS = re.compile(r'(\[(?:\\.|[^\]\\])*\])')
+
+
+def _compile_linear(pattern, flags=0):
+    """Kompilerer et mønster uden lookaround og \\b med RE2, hvis det er installeret, ellers med re"""
+    if RE2_AVAILABLE:
+        parts = _RE_CHAR_CLASS.split(pattern)
+        for escape, chars in _RE2_UNICODE_CLASSES.items():
+            parts = [part.replace(escape, chars if part.startswith('[') else '[' + chars + ']') for part in parts]
+        prefix = '(?i)' if flags & re.IGNORECASE else ''
+        try:
+            return re2.compile(prefix + ''.join(parts))
+        except re2.error:
+            pass
+    return re.compile(pattern, flags)
+
+
+# Mønstrene kompileres én gang ved import i stedet for at slås op i re's cache ved hvert kald.
+# Sidefødder og -hoveder fjernes i ét gennemløb med en samlet alternation.
+_RE_HEADER_FOOTER = re.compile(
+    r'Printet fra (?:Karnov|SKAT).*?licensvilkårene'
+    r'|Side \d+ af \d+'
+    r'|(?:Opdateret: |Version: )\d{1,2}\.\d{1,2}\.\d{4}'
+    r'|Copyright © \d{4} (?:Karnov Group|SKAT)',
+    re.DOTALL | re.IGNORECASE
+)
+_RE_SUBSECTION_UNDERLINE = re.compile(r'\n([A-Za-z][\w\s]+)\n-+\n')
+
+# De øvrige erstatninger overlapper ikke hinanden og samles derfor i ét mønster, så teksten
+# kun gennemløbes én gang: henvisninger, eksempel- og paragrafformater samt blanktegn
+_RE_PREPROCESS = re.compile(
+    # Lookahead på alternativernes første tegn lader motoren springe almindelig tekst hurtigt over
+    r'(?=[SjBE§s\n \t])(?:'
+    r'(?P<see_also>Se også\s*\n)'
+    r'|(?P<jf>jf\.\s*)'
+    r'|(?P<note>Bemærk\s*\n)'
+    r'|(?P<example>Eksempel\s*(?P<example_num>\d+)[:.])'
+    # Et evt. litra (§ 8a) står uændret og må ikke sluges, da det kan indlede næste match
+    r'|(?P<paragraph>§\s*(?P<paragraph_num>\d+))'
+    r'|(?P<stk>stk\.\s*(?P<stk_num>\d+))'
+    r'|(?P<newlines>\n\s*\n\s*\n)'
+    # Enkelte mellemrum matches ikke, da de står uændret; ellers kaldes erstatningen ved hvert ord
+    r'|(?P<spaces> {2,}|\t+)'
+    r')'
+)
+
+def _preprocess_replacement(match):
+    """Vælger erstatningen for det match _RE_PREPROCESS fandt"""
+    kind = match.lastgroup
+    # Standardiser interne henvisninger
+    if kind == "see_also":
+        return 'Se også\n'
+    if kind == "jf":
+        return 'jf. '
+    if kind == "note":
+        return 'Bemærk\n'
+    # Standardiser eksempel- og paragrafformater
+    if kind == "example":
+        return f"Eksempel {match.group('example_num')}:"
+    if kind == "paragraph":
+        return f"§ {match.group('paragraph_num')}"
+    if kind == "stk":
+        return f"stk. {match.group('stk_num')}"
+    # Fjern dobbelte linjeskift og unødvendige mellemrum
+    if kind == "newlines":
+        return '\n\n'
+    return ' '
+
+# Afsnit som C.F.X.X.X, C.A.X.X.X osv.
+_RE_SECTION = re.compile(r'(?P<sid>[A-Z]\.[A-Z]\.\d+\.\d+\.\d+)\s+.+?(?=[A-Z]\.[A-Z]\.\d+\.\d+\.\d+|$)', re.DOTALL)
+_RE_SECTION_ID = re.compile(r'([A-Z]\.[A-Z]\.\d+\.\d+\.\d+)')
+# Titlen efter et afsnits-ID; ID'et findes med str.find, så der ikke bygges et mønster pr. afsnit
+_RE_TITLE_AFTER_ID = re.compile(r'\s+([^\n]+)')
+
+_VERSION_DATE_PATTERNS = [
+    re.compile(r'(?:Juridisk vejledning|Version)[\s:]+(\d{4}-\d{2}-\d{2})', re.IGNORECASE),
+    re.compile(r'(?:Version|Gældende fra)[\s:]+(\d{1,2}\.\d{1,2}\.\d{4})', re.IGNORECASE),
+    re.compile(r'(?:Opdateret|Udgivet)[\s:]+(\d{1,2}/\d{1,2}/\d{4})', re.IGNORECASE)
+]
+
+# Chunk-typen afgøres af første ord; gruppenavnet er typen. Mønsteret springer selv indledende
+# blanktegn over og ignorerer store/små bogstaver, så teksten ikke skal kopieres med strip/lower.
+_RE_CHUNK_TYPE = re.compile(
+    r'\s*(?:(?P<regel>(?:hovedregel|regel)\b)'
+    r'|(?P<note>bemærk\b)'
+    r'|(?P<reference>(?:se også|der henvises til)\b)'
+    r'|(?P<undtagelse>(?:undtagelse|særregel)\b)'
+    r'|(?P<eksempel>(?:eksempel|for eksempel|til illustration)\b)'
+    r'|(?P<definition>(?:definition|defineres som|forstås ved)\b))',
+    re.IGNORECASE
+)
+
+# Semantiske markører der indikerer nye logiske sektioner, samlet pr. styrke af brudpunktet
+_RE_PRIMARY_MARKERS = re.compile(
+    r'^\s*(?:Hovedregel|Regel|Undtagelse(?:n|rne)?|Eksempel|Definition)\b',
+    re.MULTILINE
+)
+_RE_SECONDARY_MARKERS = re.compile(
+    r'^\s*(?:Se også|Der henvises til|I praksis|Forudsætninger(?:ne)?|Betingelser(?:ne)?)\b',
+    re.MULTILINE
+)
+_RE_TERTIARY_MARKERS = re.compile(
+    r'Det (antages|forudsættes|kræves)\b|Det (bemærkes|fremgår|følger)\b'
+    r'|Dette gælder (også|dog|ikke)\b|Følgende (betingelser|krav|forudsætninger)',
+    re.MULTILINE
+)
+_RE_BLANK_LINE = re.compile(r'\n\s*\n')
+# Underafsnitsoverskrifter: en linje med kun bogstaver og mellemrum, der starter med stort bogstav
+_RE_SUBSECTION = re.compile(r'\n([A-Z][a-zæøåA-ZÆØÅ\s]+)(?:\n|$)')
+_RE_SUBSECTION_TITLE_ONLY = re.compile(r'^[A-Z][a-zæøåA-ZÆØÅ\s]+$')
+
+# Titel efter første afsnits-ID i strukturanalysens uddrag
+_RE_STRUCTURE_TITLE = re.compile(r'[A-Z]\.[A-Z]\.\d+\.\d+\s+(.*?)(?:\n|$)')
+
+# Sætningsopdeling: efter punktum, udråbs- eller spørgsmålstegn og før stort bogstav, men ikke
+# efter en forkortelse. Forkortelserne har fast længde, så hver kan udelukkes med sit eget lookbehind.
+_ABBREVIATIONS = (
+    'jf', 'bl.a', 'f.eks', 'pkt', 'nr', 'stk', 'ca', 'evt', 'osv', 'mv', 'inkl', 'ekskl',
+    'hhv', 'vedr', 'afd', 'div', 'pga'
+)
+_RE_SENTENCE_SPLIT = re.compile(
+    r'(?<=[.!?])'
+    + ''.join(r'(?<!' + re.escape(abbreviation) + r'\.)' for abbreviation in _ABBREVIATIONS)
+    + r'\s+(?=[A-ZÆØÅ])'
+)
+_RE_CLAUSE_SPLIT = re.compile(r'(?<=[,:])\s+')
+
+# Eksempler, domsoversigter og reglen før et eksempel
+_EXAMPLE_PATTERNS = [
+    re.compile(r'(Eksempel\s+\d+\s*[:\.][^E]*?)(?=Eksempel\s+\d+|$)', re.DOTALL),  # Standard nummererede eksempler
+    re.compile(r'(Eksempel\s*[:\.][^E]*?)(?=Eksempel|$)', re.DOTALL),              # Generelle eksempler uden nummer
+    re.compile(r'(Følgende\s+eksempel[^\.]*?illustrerer.*?(?:\n\n|$))', re.DOTALL),  # Følgende eksempel illustrerer...
+    re.compile(r'((?:Til\s+illustration|Som\s+eksempel)[^\.]*?(?:kan\s+nævnes|vises).*?(?:\n\n|$))', re.DOTALL),  # Til illustration/Som eksempel
+    re.compile(r'(For\s+eksempel\s+(?:kan|vil|har).*?(?:\n\n|$))', re.DOTALL)        # For eksempel...
+]
+_RE_IMPLICIT_EXAMPLE = re.compile(
+    r'(?<!\w)((?:Hvis|Lad os antag|Tænk på)[^\.]*?(?:person|firma|virksomhed|selskab)[^\.]*?(?:der|som|hvilket)[^\.]*?(?:\n\n|$))',
+    re.DOTALL
+)
+_RE_EXAMPLE_NUM = re.compile(r'Eksempel\s+(\d+)')
+_RULE_PATTERNS = [
+    re.compile(r'(?:Hovedregel|Regel).*?(?=\n\n)', re.DOTALL),
+    re.compile(r'(?:Reglerne|Reglen).*?(?=\n\n)', re.DOTALL),
+    re.compile(r'(?:Efter|Ifølge).*?(?:gælder|er).*?(?=\n\n)', re.DOTALL)
+]
+_CASE_TABLE_PATTERNS = [
+    re.compile(r'((?:Skemaet|Oversigten)\s+viser[\s\S]*?(?=\n\n|$))', re.DOTALL),
+    re.compile(r'((?:Følgende|Nedenstående)\s+(?:afgørelser|domme|kendelser)[\s\S]*?(?=\n\n|$))', re.DOTALL),
+    re.compile(r'((?:Domsoversigt|Afgørelsesoversigt)[\s\S]*?(?=\n\n|$))', re.DOTALL)
+]
+
+# Lovhenvisninger. Mønstrene uden lookaround køres med RE2, når den er tilgængelig, så de
+# ledende tegnklasser ikke giver kvadratisk backtracking på lange afsnit.
+# Mønstrene markeret (små bogstaver) skrives med små bogstaver og søges i _lower_aligned(text) i stedet
+# for med re.IGNORECASE, som gør hver sammenligning langsommere; grupperne skæres ud af den
+# oprindelige tekst med matchets positioner.
+_RE_LAW_REF = _compile_linear(  # (små bogstaver)
+    r'([a-zæøå]+(?:lovens?|loven))\s+§[§]?\s*(\d+\s*[a-z]?(?:\s*[-–]\s*\d+\s*[a-z]?)?)'
+)
+_RE_DIRECT_PARAGRAPH = _compile_linear(r'(§[§]?\s*\d+\s*[A-Za-z]?(?:\s*[-–]\s*\d+\s*[A-Za-z]?)?)')
+_RE_NUMBER_RANGE = re.compile(r'(\d+)\s*[-–]\s*(\d+)')
+_RE_PARAGRAPH_RANGE = re.compile(r'§§\s*(\d+)\s*[-–]\s*(\d+)')
+_RE_PARAGRAPH_NUM = re.compile(r'§\s*(\d+\s*[A-Za-z]?)')
+_RE_STK_NUM = re.compile(r'(?:stk\.|stykke)\s*(\d+)')
+
+# Domsreferencer: udtræk og normalisering
+_CASE_REF_PATTERNS = [  # (små bogstaver)
+    # Domme fra Højesteret, Landsretten, Sø- og Handelsretten, etc.
+    _compile_linear(r'((?:ufr|u|tfs|fm|mad)\s*\d{4}[.,]\s*\d+(?:\s*[a-zø]+)?)'),
+    _compile_linear(r'((?:højesterets|landsrettens|sø-\s*og\s*handelsrettens)\s*dom\s*af\s*\d{1,2}\.\s*\w+\s*\d{4})'),
+    # Administrative afgørelser 
+    _compile_linear(r'((?:skm|lsr|tfs|tss)[-\s]*\d{4}[.,]\s*\d+(?:\s*[a-zø]+)?)'),
+    # Andre formater
+    _compile_linear(r'([a-zæøå]{2,5}\s*\d{4}[-.,/]\s*\d+(?:\s*[a-zø]+)?)')
+]
+_RE_CASE_U = re.compile(r'U[fF]?R?\s*(\d{4})[.,]\s*(\d+)(?:\s*([A-ZØ]+))?')
+_RE_CASE_SKM = re.compile(r'SKM[-\s]*(\d{4})[.,]\s*(\d+)[.,]?\s*([A-Z]+)?')
+_RE_CASE_LSR = re.compile(r'LSR\s*[-\s]*(\d{4})[.,]\s*(\d+)')
+_RE_CASE_TFS = re.compile(r'TfS\s*(\d{4})[.,]\s*(\d+)(?:\s*([A-ZØ]+))?')
+
+# Persongrupper, undtagelser og definitioner
+_GROUP_PATTERNS = [  # (små bogstaver)
+    _compile_linear(r'(?:for|gælder for|omfatter)\s+([^\.;,]+?)\s+(?:der|som|når)'),
+    _compile_linear(r'(?:personer|ydere|pligtige|borgere|virksomheder)\s+(?:der|som)\s+([^\.;,]+)'),
+    _compile_linear(r'([^\.;,]+)\s+(?:er|kan være|anses for)\s+(?:pligtig|omfattet|forpligtet|berettiget)')
+]
+_RE_GROUP_NOISE = re.compile(r'\b(personer|ydere|pligtige|alle|disse|de|bestemte)\b')
+_EXCEPTION_PATTERNS = [  # (små bogstaver)
+    re.compile(r'(?:undtagelse|særregel|specialregel)[^\.;,]*?(?=\.|;|$)'),
+    re.compile(r'(?:gælder ikke|finder ikke anvendelse)[^\.;,]*?(?=\.|;|$)'),
+    re.compile(r'(?:medmindre|dog ikke|undtaget herfra er)[^\.;,]*?(?=\.|;|$)'),
+    re.compile(r'(?:uanset|til trods for)[^\.;,]*?(?=\.|;|$)'),
+    re.compile(r'(?:hovedreglen|udgangspunktet).*?(?:men|dog)[^\.;,]*?(?=\.|;|$)')
+]
+_DEFINITION_PATTERNS = [  # (små bogstaver)
+    _compile_linear(r'ved\s+([^\.;,]+)\s+forstås'),
+    _compile_linear(r'([^\.;,]+)\s+defineres\s+som'),
+    _compile_linear(r'([^\.;,]+)\s+betyder\s+i\s+denne\s+sammenhæng')
+]
+_RE_TERM_NOISE = re.compile(r'\b(herved|således|dermed|hermed|at)\b')
+# Hver mønsterfamilie kræver et af disse tegn eller ord. Uden dem springes familien over, hvilket
+# især sparer det sidste persongruppemønster og definitionerne, hvis ledende tegnklasse backtracker
+# over lange led.
+_EXTRACTION_HINTS = {
+    "law": re.compile(r'§'),
+    "case": re.compile(r'\d{4}'),  # Alle domsmønstre kræver et firecifret årstal
+    "group_obligation": re.compile(r'pligtig|omfattet|forpligtet|berettiget', re.IGNORECASE),
+    "exception": re.compile(
+        r'undtagelse|særregel|specialregel|gælder ikke|finder ikke anvendelse|medmindre|dog ikke'
+        r'|undtaget herfra er|uanset|til trods for|Hovedreglen|Udgangspunktet',
+        re.IGNORECASE
+    ),
+    "definition": re.compile(r'forstås|defineres|betyder', re.IGNORECASE),
+}
+
+def _build_hint_database():
+    """Kompilerer alle nøgleordsfiltre til én Hyperscan-database, eller None uden hyperscan"""
+    if not HYPERSCAN_AVAILABLE:
+        return None
+    try:
+        database = hyperscan.Database()
+        database.compile(
+            expressions=[hint.pattern.encode('utf-8') for hint in _EXTRACTION_HINTS.values()],
+            ids=list(range(len(_EXTRACTION_HINTS))),
+            flags=[
+                hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP | hyperscan.HS_FLAG_SINGLEMATCH
+                | (hyperscan.HS_FLAG_CASELESS if hint.flags & re.IGNORECASE else 0)
+                for hint in _EXTRACTION_HINTS.values()
+            ]
+        )
+        return database
+    except hyperscan.error as e:
+        logging.getLogger("juridisk_vejledning_indexer").warning(f"Hyperscan-database kunne ikke kompileres: {e}")
+        return None
+
+_HINT_DATABASE = _build_hint_database()
+_HINT_NAMES = list(_EXTRACTION_HINTS)
+# Afsnit scannes samtidigt fra flere tråde, og Hyperscan-scratch må ikke deles mellem samtidige scanninger
+_hint_scratch = threading.local()
+
+def _extraction_hints(text):
+    """Navnene på de mønsterfamilier i _EXTRACTION_HINTS der kan matche teksten"""
+    data = None
+    if _HINT_DATABASE is not None:
+        try:
+            data = text.encode('utf-8')
+        except UnicodeEncodeError:
+            # Enlige surrogater kan ikke kodes som gyldig UTF-8; re klarer dem
+            pass
+    if data is None:
+        return {name for name, hint in _EXTRACTION_HINTS.items() if hint.search(text)}
+    
+    scratch = getattr(_hint_scratch, "scratch", None)
+    if scratch is None:
+        scratch = _hint_scratch.scratch = hyperscan.Scratch(_HINT_DATABASE)
+    
+    found = set()
+    def on_match(hint_id, start, end, flags, context):
+        found.add(_HINT_NAMES[hint_id])
+    _HINT_DATABASE.scan(data, match_event_handler=on_match, scratch=scratch)
+    return found
+
+def _has_hint(name, text, hints):
+    """Om familien name kan matche; bruger hints fra _extraction_hints når kalderen har dem"""
+    if hints is not None:
+        return name in hints
+    return _EXTRACTION_HINTS[name].search(text) is not None
+
+_RE_EXPLANATION = re.compile(r'\bbestår af\b|\bdefineres som\b|\bforståes ved\b|\bfølger af\b', re.IGNORECASE)
+
+# Juridisk status
+_RE_STATUS_REPEALED = re.compile(r'\b(?:ophævet|bortfaldet|udgået|ikke længere gældende)\b')
+_RE_STATUS_TEMPORARY = re.compile(r'\b(?:midlertidig|tidsbegrænset|gælder indtil|ophører den)\b')
+_RE_EXPIRY_DATE = re.compile(
+    r'(?:indtil|til|ophører|udløber)\s+(?:den)?\s+(\d{1,2}\.?\s+\w+\s+\d{4}|\d{2}/\d{2}/\d{4}|\d{4}-\d{2}-\d{2})'
+)
+
+# Nøgler til API'ets prompt-caching for domæne- og strukturanalysen
+_DOMAIN_PROMPT_CACHE_KEY = "juridisk-vejledning-domain"
+_STRUCTURE_PROMPT_CACHE_KEY = "juridisk-vejledning-structure"
+
+# Felter som _ensure_complete_chunk_metadata udfylder, hvis de mangler
+_REQUIRED_METADATA_FIELDS = (
+    "doc_id", "doc_type", "version_date", "section", 
+    "section_title", "chunk_type", "is_example", "concepts",
+    "law_references", "case_references", "complexity", "authority",
+    "affected_groups", "legal_exceptions", "question_types"
+)
+_LIST_METADATA_FIELDS = frozenset((
+    "concepts", "law_references", "case_references", "affected_groups", 
+    "legal_exceptions", "question_types"
+))
+
+def _stable_hash(text):
+    """Kort hash der, modsat hash(), er den samme på tværs af processer og kørsler"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+def _stripped_span(match):
+    """(start, slut) for match.group(1).strip() i den gennemsøgte tekst"""
+    raw = match.group(1)
+    start = match.start(1) + len(raw) - len(raw.lstrip())
+    return start, start + len(raw.strip())
+
+def _lower_aligned(text):
+    """text.lower() med samme længde som text, så et matchs positioner gælder i begge"""
+    text_lower = text.lower()
+    if len(text_lower) == len(text):
+        return text_lower
+    # Enkelte tegn (fx 'İ') bliver til flere tegn med lower(); kun det første beholdes
+    return ''.join(char.lower()[0] for char in text)
+
+def _original_group(text, match, group=0):
+    """Gruppen fra et match i _lower_aligned(text), skåret ud af den oprindelige tekst"""
+    return text[match.start(group):match.end(group)]
+
+def _is_word_char(char):
+    """Svarer til re's \\w for et enkelt tegn"""
+    return char.isalnum() or char == '_'
+
+def _build_keyword_matcher(keyword_groups):
+    """Samler {gruppe: [nøgleord]} i én Aho-Corasick-automat, eller ét mønster pr. gruppe uden pyahocorasick"""
+    if not AHOCORASICK_AVAILABLE:
+        return {
+            group: re.compile(r'\b(?:' + '|'.join(re.escape(keyword) for keyword in keywords) + r')\b')
+            for group, keywords in keyword_groups.items() if keywords
+        }
+    
+    groups_by_keyword = defaultdict(list)
+    for group, keywords in keyword_groups.items():
+        for keyword in keywords:
+            if keyword:
+                groups_by_keyword[keyword].append(group)
+    if not groups_by_keyword:
+        return None
+    
+    automaton = ahocorasick.Automaton()
+    for keyword, groups in groups_by_keyword.items():
+        automaton.add_word(keyword, (keyword, groups))
+    automaton.make_automaton()
+    return automaton
+
+def _match_keyword_groups(matcher, text):
+    """Mængden af grupper hvor mindst ét nøgleord står som helt ord (\\b...\\b) i teksten"""
+    if not matcher:
+        return set()
+    if not AHOCORASICK_AVAILABLE:
+        return {group for group, pattern in matcher.items() if pattern.search(text)}
+    
+    found = set()
+    for end, (keyword, groups) in matcher.iter(text):
+        start = end - len(keyword) + 1
+        before = _is_word_char(text[start - 1]) if start > 0 else False
+        after = _is_word_char(text[end + 1]) if end + 1 < len(text) else False
+        if before != _is_word_char(keyword[0]) and after != _is_word_char(keyword[-1]):
+            found.update(groups)
+    return found
+
+def _remove_spans(text, spans):
+    """Fjerner (start, slut)-intervallerne fra teksten i ét gennemløb; overlap slås sammen"""
+    parts = []
+    prev_end = 0
+    for start, end in sorted(spans):
+        if start > prev_end:
+            parts.append(text[prev_end:start])
+        prev_end = max(prev_end, end)
+    parts.append(text[prev_end:])
+    return "".join(parts)
+
+# Indstillinger fra display_settings og deres standardværdier, hvis de ikke er sat
+_DEFAULT_SETTINGS = {
+    "extract_examples": False,
+    "extract_case_tables": False,
+    "extract_subsections": False,
+    "balance_chunks": False,
+    "semantic_chunking": False,
+    "parallel_processes": False,
+    "min_chunk_size": 250,
+    "target_chunk_size": 1000
+}
+
+# Indekseren og dokumentets kontekst i en arbejderproces; sættes én gang pr. proces af _init_section_worker
+_section_worker_state = None
+
+def _init_section_worker(indexer, context_summary, doc_id, options):
+    """Gemmer det der er fælles for alle afsnit i arbejderprocessen, så det kun pickles én gang"""
+    global _section_worker_state
+    _section_worker_state = (indexer, context_summary, doc_id, options)
+
+def _process_section_in_worker(section):
+    """Processerer et (afsnits-ID, titel, tekst)-afsnit i en arbejderproces"""
+    indexer, context_summary, doc_id, options = _section_worker_state
+    section_id, section_title, segment = section
+    return indexer._process_segment(segment, context_summary, doc_id, section_id, section_title, options)
 
 class Indexer(BaseIndexer):
     def __init__(self):
@@ -21,9 +447,15 @@ class Indexer(BaseIndexer):
         self.domain_config = {}
         self.question_patterns = {}  
         self.law_abbreviations = {}
+        self._law_names_lower = []  # [(lovnavn.lower(), forkortelse)] i konfigurationens rækkefølge
+        self._law_abbreviations_lower = []  # [(forkortelse.lower(), forkortelse)]
         self.person_groups = {}
+        self._person_group_matcher = None
         self.default_themes = ["juridisk vejledning"]
         
+        # Øjebliksbillede af indstillingerne, læst fra session_state i starten af process_document
+        self.settings = dict(_DEFAULT_SETTINGS)
+        
         # Opsæt logging
         self.logger = logging.getLogger("juridisk_vejledning_indexer")
     
@@ -61,6 +493,13 @@ class Indexer(BaseIndexer):
             help="Anvend forbedret semantisk chunking der bevarer juridiske ræsonnementer"
         )
         
+        st.session_state.parallel_processes = st.checkbox(
+            "Behandl afsnit i flere processer",
+            value=False,
+            help="Fordeler afsnittenes regex-tunge udtræk over alle CPU-kerner. Bedst til store dokumenter "
+                 "hvor API-svarene allerede ligger i cachen; processerne er et par sekunder om at starte"
+        )
+        
         # Indstillinger for chunk-størrelser
         st.session_state.min_chunk_size = st.slider(
             "Minimum chunk-størrelse (tegn)",
@@ -100,29 +539,55 @@ class Indexer(BaseIndexer):
         processing_stats = {}
         
         try:
-            # Fase 1: Dynamisk domæneanalyse
-            with st.spinner("Analyserer dokumentets juridiske område..."):
-                self.domain_config = self._analyze_domain(text[:20000], options.get("model", "gpt-4o"))
-                # Opdater indekserens konfiguration med den dynamiske konfiguration
-                self._update_indexer_config(self.domain_config)
-                st.write(f"Juridisk område identificeret med {len(self.question_patterns)} spørgsmålstyper og {len(self.law_abbreviations)} lovforkortelser")
+            model = options.get("model", "gpt-4o")
+            
+            # Indstillingerne læses én gang her i stedet for gennem session_state-proxyen for hvert afsnit
+            self.settings = {
+                key: st.session_state.get(key, default)
+                for key, default in _DEFAULT_SETTINGS.items()
+            }
             
             # 1. Preprocessering - generisk rensning for juridiske tekster
             processed_text = self._preprocess_text(text)
             
-            # 2. Segmentering efter hovedafsnit (C.X.X.X)
-            segments, preserved_content = self._segment_by_sections(processed_text)
+            # 2. Segmentering efter hovedafsnit (C.X.X.X) som (afsnits-ID, titel, tekst)
+            sections, preserved_content = self._segment_by_sections(processed_text)
             st.session_state.preserved_content = preserved_content
             
-            processing_stats["sections_count"] = len(segments)
+            processing_stats["sections_count"] = len(sections)
             processing_stats["total_length"] = len(processed_text)
             
+            domain_sample = text[:20000]
+            structure_sample = sections[0][2] if sections else processed_text[:10000]
+            
+            # Afsnit, hierarki og titler udledes direkte af afsnits-ID'erne; sprogmodellen spørges kun om resten
+            local_structure = self._local_structure(sections, preserved_content)
+            
+            # I batch-tilstand sendes domæne- og strukturanalysen samlet som ét batch-job til halv pris,
+            # ellers køres de to uafhængige kald samtidigt med den asynkrone klient. Svarene lægges i
+            # cached_call_gpt4o's diskcache, så analyserne nedenfor finder dem dér.
+            analysis_prompts = [self._domain_prompt(domain_sample), self._structure_prompt(structure_sample, local_structure)]
+            if options.get("batch_mode"):
+                with st.spinner("Sender domæne- og strukturanalyse via Batch API..."):
+                    prefetch_gpt_batch(analysis_prompts, model=model, batch_name=f"{doc_id}_analysis")
+            else:
+                with st.spinner("Kører domæne- og strukturanalyse..."):
+                    prefetch_gpt_async(
+                        analysis_prompts,
+                        model=model,
+                        prompt_cache_keys=[_DOMAIN_PROMPT_CACHE_KEY, _STRUCTURE_PROMPT_CACHE_KEY]
+                    )
+            
+            # Fase 1: Dynamisk domæneanalyse
+            with st.spinner("Analyserer dokumentets juridiske område..."):
+                self.domain_config = self._analyze_domain(domain_sample, model)
+                # Opdater indekserens konfiguration med den dynamiske konfiguration
+                self._update_indexer_config(self.domain_config)
+                st.write(f"Juridisk område identificeret med {len(self.question_patterns)} spørgsmålstyper og {len(self.law_abbreviations)} lovforkortelser")
+            
             # 3. Strukturanalyse med AI
             with st.spinner("Analyserer dokumentets struktur og indhold..."):
-                context_summary = self._analyze_structure(
-                    segments[0] if segments else processed_text[:10000],
-                    options.get("model", "gpt-4o")
-                )
+                context_summary = self._analyze_structure(structure_sample, model, local_structure)
                 
                 # Tilføj domæneanalyse til context summary
                 context_summary["domain_config"] = self.domain_config
@@ -138,72 +603,103 @@ class Indexer(BaseIndexer):
                 context_summary["doc_id"] = doc_id
             
             # 4. Processering af alle segmenter
-            with st.spinner(f"Analyserer {len(segments)} afsnit fra dokumentet..."):
-                all_chunks = []
-                
-                # Vis en progressbar
+            # Afsnittene er uafhængige og venter mest på API-kald (begreber og spørgsmålstyper),
+            # så de behandles samtidigt i en trådpulje. Når svarene ligger i cachen, er arbejdet
+            # ren CPU, og afsnittene kan i stedet fordeles over en procespulje.
+            # Resultaterne samles i dokumentets rækkefølge.
+            with st.spinner(f"Analyserer {len(sections)} afsnit fra dokumentet..."):
+                # Vis en progressbar og én statuslinje, der højst opdateres hvert kvarte sekund
                 progress_bar = st.progress(0)
+                status_text = st.empty()
+                last_update = 0.0
                 
-                for i, segment in enumerate(segments):
+                def process_one(section):
+                    # Processer segmentet til chunks med ID og titel fra segmenteringen
+                    section_id, section_title, segment = section
+                    return self._process_segment(
+                        segment, 
+                        context_summary, 
+                        doc_id, 
+                        section_id, 
+                        section_title, 
+                        options
+                    )
+                
+                segment_chunks = [None] * len(sections)
+                if self.settings["parallel_processes"] and len(sections) > 1:
+                    results = map_in_processes(
+                        _process_section_in_worker,
+                        sections,
+                        initializer=_init_section_worker,
+                        initargs=(self, context_summary, doc_id, options)
+                    )
+                else:
+                    results = map_in_threads(process_one, sections, int(options.get("concurrency", 4)))
+                for done, (i, future) in enumerate(results, 1):
                     try:
-                        # Processer dette segment
-                        section_id = self._extract_section_id(segment)
-                        
-                        # Vis fremskridt
-                        st.write(f"Processerer afsnit {section_id if section_id else f'{i+1}/{len(segments)}'}")
-                        
-                        # Processer segmentet til chunks
-                        segment_chunks = self._process_segment(
-                            segment, 
-                            context_summary, 
-                            doc_id, 
-                            section_id, 
-                            self._extract_section_title(segment, section_id), 
-                            options
-                        )
-                        
-                        all_chunks.extend(segment_chunks)
+                        segment_chunks[i] = future.result()
                     except Exception as e:
                         self.logger.error(f"Fejl ved processering af segment {i}: {str(e)}")
                         st.error(f"Advarsel: Problem med afsnit {i+1}. Fortsætter med næste afsnit.")
                     
-                    # Opdater progressbar
-                    progress_bar.progress((i + 1) / len(segments))
+                    # Opdater fremskridt, men ikke for hvert afsnit, når de bliver færdige hurtigt (cache-hits)
+                    now = time.monotonic()
+                    if now - last_update >= 0.25 or done == len(sections):
+                        section_id = sections[i][0]
+                        status_text.write(f"Afsnit {done}/{len(sections)}: {section_id if section_id else '(uden ID)'}")
+                        progress_bar.progress(done / len(sections))
+                        last_update = now
+                
+                all_chunks = [chunk for chunks in segment_chunks if chunks for chunk in chunks]
             
             # 5. Balancér chunklængder hvis aktiveret
-            if hasattr(st.session_state, 'balance_chunks') and st.session_state.balance_chunks:
+            if self.settings["balance_chunks"]:
                 with st.spinner("Balancerer chunks for optimal søgning..."):
                     all_chunks = self._balance_chunks(all_chunks)
             
             # 6. Efterbehandling af chunks
             with st.spinner("Efterbehandler chunks..."):
-                # Tilføj krydsreferencer mellem chunks
+                # Tilføj krydsreferencer mellem chunks (kræver et indeks over alle chunks)
                 all_chunks = self._add_cross_references(all_chunks)
                 
-                # Normaliser lovhenvisninger
-                all_chunks = self._normalize_law_references(all_chunks)
-                
-                # Normaliser domsreferencer
-                all_chunks = self._normalize_case_references(all_chunks)
-                
-                # Reparer manglende felter
-                all_chunks = self._ensure_complete_metadata(all_chunks)
-                
-                # Tilføj juridisk status og fortolkning
-                all_chunks = self._add_legal_status(all_chunks)
+                # Resten af efterbehandlingen vedrører kun det enkelte chunk og klares i ét gennemløb
+                for chunk in all_chunks:
+                    # Normaliser lov- og domshenvisninger
+                    self._normalize_chunk_law_references(chunk)
+                    self._normalize_chunk_case_references(chunk)
+                    
+                    # Reparer manglende felter
+                    self._ensure_complete_chunk_metadata(chunk)
+                    
+                    # Tilføj juridisk status og fortolkning
+                    self._add_chunk_legal_status(chunk)
                 
                 # Tilføj information om chunks til statistik
                 processing_stats["chunks_count"] = len(all_chunks)
-                processing_stats["example_chunks"] = len([c for c in all_chunks if c["metadata"].get("is_example", False)])
-                processing_stats["law_chunks"] = len([c for c in all_chunks if c["metadata"].get("law_references", [])])
-                processing_stats["case_chunks"] = len([c for c in all_chunks if c["metadata"].get("case_references", [])])
                 
-                # Beregn gennemsnitlig chunk-størrelse og standardafvigelse
-                chunk_sizes = [len(c["content"]) for c in all_chunks]
-                processing_stats["avg_chunk_size"] = np.mean(chunk_sizes) if chunk_sizes else 0
-                processing_stats["std_chunk_size"] = np.std(chunk_sizes) if chunk_sizes else 0
-                processing_stats["min_chunk_size"] = min(chunk_sizes) if chunk_sizes else 0
-                processing_stats["max_chunk_size"] = max(chunk_sizes) if chunk_sizes else 0
+                # Tæl eksempler, lov- og domshenvisninger i ét gennemløb
+                example_count = law_count = case_count = 0
+                for chunk in all_chunks:
+                    metadata = chunk["metadata"]
+                    example_count += bool(metadata.get("is_example", False))
+                    law_count += bool(metadata.get("law_references", []))
+                    case_count += bool(metadata.get("case_references", []))
+                processing_stats["example_chunks"] = example_count
+                processing_stats["law_chunks"] = law_count
+                processing_stats["case_chunks"] = case_count
+                
+                # Beregn gennemsnitlig chunk-størrelse og standardafvigelse ud fra ét array
+                chunk_sizes = np.fromiter((len(c["content"]) for c in all_chunks), dtype=np.int64, count=len(all_chunks))
+                if chunk_sizes.size:
+                    processing_stats["avg_chunk_size"] = float(chunk_sizes.mean())
+                    processing_stats["std_chunk_size"] = float(chunk_sizes.std())
+                    processing_stats["min_chunk_size"] = int(chunk_sizes.min())
+                    processing_stats["max_chunk_size"] = int(chunk_sizes.max())
+                else:
+                    processing_stats["avg_chunk_size"] = 0
+                    processing_stats["std_chunk_size"] = 0
+                    processing_stats["min_chunk_size"] = 0
+                    processing_stats["max_chunk_size"] = 0
             
             # Opdater context_summary med processing_stats
             context_summary["processing_stats"] = processing_stats
@@ -216,8 +712,8 @@ class Indexer(BaseIndexer):
             # Returner tomme resultater ved fejl
             return [], {"error": str(e), "doc_id": doc_id}
 
-    def _analyze_domain(self, text_sample, model="gpt-4o"):
-        """Analyserer retsområdet for at identificere domænespecifikke elementer"""
+    def _domain_prompt(self, text_sample):
+        """Bygger prompten til domæneanalysen"""
         prompt = """
         Du er ekspert i dansk jura. Analyser denne del af en juridisk vejledning og identificér:
         
@@ -248,11 +744,16 @@ class Indexer(BaseIndexer):
         }
         """
         
+        return prompt + "\n\nTekst:\n" + text_sample
+    
+    def _analyze_domain(self, text_sample, model="gpt-4o"):
+        """Analyserer retsområdet for at identificere domænespecifikke elementer"""
         try:
             # Kald sprogmodel
             domain_config = cached_call_gpt4o(
-                prompt + "\n\nTekst:\n" + text_sample, 
-                model=model
+                self._domain_prompt(text_sample), 
+                model=model,
+                prompt_cache_key=_DOMAIN_PROMPT_CACHE_KEY
             )
             return domain_config
         except Exception as e:
@@ -273,12 +774,15 @@ class Indexer(BaseIndexer):
         """Opdaterer indekserens konfiguration med domænespecifikke elementer"""
         if "law_abbreviations" in domain_config and domain_config["law_abbreviations"]:
             self.law_abbreviations = domain_config["law_abbreviations"]
+            self._law_names_lower = [(lovnavn.lower(), forkortelse) for lovnavn, forkortelse in self.law_abbreviations.items()]
+            self._law_abbreviations_lower = [(forkortelse.lower(), forkortelse) for forkortelse in self.law_abbreviations.values()]
         
         if "question_patterns" in domain_config and domain_config["question_patterns"]:
             self.question_patterns = domain_config["question_patterns"]
         
         if "person_groups" in domain_config and domain_config["person_groups"]:
             self.person_groups = domain_config["person_groups"]
+            self._person_group_matcher = _build_keyword_matcher(self.person_groups)
         
         if "standard_themes" in domain_config and domain_config["standard_themes"]:
             self.default_themes = domain_config["standard_themes"]
@@ -287,88 +791,56 @@ class Indexer(BaseIndexer):
 
     def _preprocess_text(self, text):
         """Forbehandling generaliseret til juridiske vejledninger"""
-        # Fjern sidefødder og -hoveder med robust mønstergenkendelse
-        header_footer_patterns = [
-            r'Printet fra (?:Karnov|SKAT).*?licensvilkårene',
-            r'Side \d+ af \d+',
-            r'(?:Opdateret: |Version: )\d{1,2}\.\d{1,2}\.\d{4}',
-            r'Copyright © \d{4} (?:Karnov Group|SKAT)'
-        ]
-        
-        for pattern in header_footer_patterns:
-            text = re.sub(pattern, '', text, flags=re.DOTALL | re.IGNORECASE)
-        
-        # Standardiser afsnitsoverskrifter (generelt mønster for afsnit som C.A.X.X.X)
-        text = re.sub(r'([A-Z]\.[A-Z]\.\d+\.\d+\.\d+)(\s+[A-Za-z])', r'\1\2', text)
+        # Fjern sidefødder og -hoveder med robust mønstergenkendelse. Det sker før de øvrige
+        # trin, så f.eks. "stk." og tallet efter et sideskift bliver normaliseret sammen.
+        text = _RE_HEADER_FOOTER.sub('', text)
         
         # Standardiser underafsnitsoverskrifter
-        text = re.sub(r'\n([A-Za-z][\w\s]+)\n-+\n', r'\n\1\n', text)
-        
-        # Standardiser interne henvisninger
-        text = re.sub(r'Se også\s*\n', r'Se også\n', text)
-        text = re.sub(r'jf\.\s*', r'jf. ', text)
-        text = re.sub(r'Bemærk\s*\n', r'Bemærk\n', text)
-        
-        # Standardiser eksempelformater
-        text = re.sub(r'Eksempel\s*(\d+)[:.]', r'Eksempel \1:', text)
-        
-        # Standardiser paragrafformater
-        text = re.sub(r'§\s*(\d+[a-zA-Z]?)', r'§ \1', text)
-        text = re.sub(r'stk\.\s*(\d+)', r'stk. \1', text)
+        text = _RE_SUBSECTION_UNDERLINE.sub(r'\n\1\n', text)
         
-        # Fjern dobbelte linjeskift
-        text = re.sub(r'\n\s*\n\s*\n', r'\n\n', text)
-        
-        # Fjern unødvendige mellemrum
-        text = re.sub(r' +', ' ', text)
-        text = re.sub(r'\t+', ' ', text)
+        # Standardiser henvisninger, eksempel- og paragrafformater og blanktegn i ét gennemløb
+        text = _RE_PREPROCESS.sub(_preprocess_replacement, text)
         
         return text
 
     def _segment_by_sections(self, text):
-        """Opdeler teksten i segmenter baseret på hovedafsnit (generaliseret mønster)"""
+        """Opdeler teksten i (afsnits-ID, titel, tekst) baseret på hovedafsnit (generaliseret mønster)"""
         # Find alle hovedafsnit med generelt regex mønster der matcher juridiske afsnitsformater
         # Dette mønster er generaliseret til at fange både C.F.X.X.X, C.A.X.X.X osv.
-        section_pattern = r'([A-Z]\.[A-Z]\.\d+\.\d+\.\d+\s+.+?)(?=[A-Z]\.[A-Z]\.\d+\.\d+\.\d+|$)'
-        matches = list(re.finditer(section_pattern, text, re.DOTALL))
-    
-        # Hvis ingen afsnit blev fundet, returner hele teksten som ét segment
-        if not matches:
-            return [text], {"sections": {}}
-    
-        # Opdel teksten i segmenter
-        segments = []
+        # Opdel teksten i segmenter; ID og titel udtrækkes her én gang, så de ikke findes igen senere
+        sections = []
         preserved_content = {"sections": {}, "hierarchical_structure": {}}
     
         # Identificer hierarkiet i dokumentet
-        section_hierarchy = {}
+        section_hierarchy = defaultdict(list)
     
-        for match in matches:
-            segment = match.group(1)
-            segments.append(segment)
-        
-            # Uddrag afsnits-ID
-            section_id_match = re.search(r'([A-Z]\.[A-Z]\.\d+\.\d+\.\d+)', segment)
-            if section_id_match:
-                section_id = section_id_match.group(1)
-                preserved_content["sections"][section_id] = segment
-            
-                # Opbyg hierarki
-                parts = section_id.split('.')
-                if len(parts) >= 4:  # A.B.1.2
-                    parent_id = f"{parts[0]}.{parts[1]}.{parts[2]}"
-                    if parent_id not in section_hierarchy:
-                        section_hierarchy[parent_id] = []
-                    section_hierarchy[parent_id].append(section_id)
+        # Matches gennemløbes direkte; afsnits-ID'et er allerede fanget af mønstrets 'sid'-gruppe
+        for match in _RE_SECTION.finditer(text):
+            segment = match.group(0)
+            section_id = match.group('sid')
+            sections.append((section_id, self._extract_section_title(segment, section_id), segment))
+            preserved_content["sections"][section_id] = segment
+            
+            # Opbyg hierarki
+            parts = section_id.split('.')
+            if len(parts) >= 4:  # A.B.1.2
+                parent_id = f"{parts[0]}.{parts[1]}.{parts[2]}"
+                section_hierarchy[parent_id].append(section_id)
     
-        preserved_content["hierarchical_structure"] = section_hierarchy
+        # Hvis ingen afsnit blev fundet, returner hele teksten som ét segment
+        if not sections:
+            section_id = self._extract_section_id(text)
+            return [(section_id, self._extract_section_title(text, section_id), text)], {"sections": {}}
     
-        return segments, preserved_content
+        # Almindelig dict, så opslag på ukendte afsnit ikke opretter tomme lister
+        preserved_content["hierarchical_structure"] = dict(section_hierarchy)
+    
+        return sections, preserved_content
 
     def _extract_section_id(self, segment):
         """Udtrækker afsnits-ID fra et segment (generaliseret til forskellige formater)"""
         # Generaliseret mønster for juridiske vejledninger
-        match = re.search(r'([A-Z]\.[A-Z]\.\d+\.\d+\.\d+)', segment)
+        match = _RE_SECTION_ID.search(segment)
         if match:
             return match.group(1)
         return None
@@ -378,31 +850,89 @@ class Indexer(BaseIndexer):
         if not section_id:
             return None
             
-        title_match = re.search(
-            r'{}\s+([^\n]+)'.format(re.escape(section_id)), 
-            segment
-        )
-        if title_match:
-            return title_match.group(1).strip()
+        # Første forekomst af ID'et efterfulgt af en titel, som re.search(re.escape(section_id) + ...)
+        start = segment.find(section_id)
+        while start != -1:
+            title_match = _RE_TITLE_AFTER_ID.match(segment, start + len(section_id))
+            if title_match:
+                return title_match.group(1).strip()
+            start = segment.find(section_id, start + 1)
         return None
 
     def _extract_version_date(self, text):
         """Udtrækker versionsdato fra vejledningsteksten (generaliseret)"""
         # Søg efter forskellige datoangivelsesformater i starten af dokumentet
-        date_patterns = [
-            r'(?:Juridisk vejledning|Version)[\s:]+(\d{4}-\d{2}-\d{2})',
-            r'(?:Version|Gældende fra)[\s:]+(\d{1,2}\.\d{1,2}\.\d{4})',
-            r'(?:Opdateret|Udgivet)[\s:]+(\d{1,2}/\d{1,2}/\d{4})'
-        ]
-        
-        for pattern in date_patterns:
-            match = re.search(pattern, text[:500], re.IGNORECASE)
+        head = text[:500]
+        for pattern in _VERSION_DATE_PATTERNS:
+            match = pattern.search(head)
             if match:
                 return match.group(1)
         return None
 
-    def _analyze_structure(self, text, model="gpt-4o"):
-        """Analyserer strukturen af vejledningen dynamisk med en sprogmodel"""
+    def _local_structure(self, sections, preserved_content):
+        """Udleder dokumentets afsnitsstruktur af de afsnit _segment_by_sections fandt"""
+        if not preserved_content.get("sections"):
+            return None
+        
+        section_titles = {}
+        for section_id, section_title, _ in sections:
+            if section_title:
+                section_titles[section_id] = section_title
+        
+        return {
+            "main_sections": list(preserved_content["sections"]),
+            "section_hierarchy": preserved_content.get("hierarchical_structure", {}),
+            "section_titles": section_titles
+        }
+
+    def _structure_prompt(self, text, structure=None):
+        """Bygger prompten til strukturanalysen. Er strukturen kendt, spørges kun om indholdet."""
+        if structure:
+            prompt = """
+        Du er en ekspert i dansk jura. Analyser denne del af den juridiske vejledning.
+        Afsnitsstrukturen er allerede kendt; brug afsnits-ID'erne angivet under teksten som nøgler.
+        
+        RETURNER DIN ANALYSE SOM JSON.
+        
+        Lav en JSON-opsummering med:
+        - Hovedtemaer i hvert afsnit
+        - Lovhenvisninger (hvilke paragraffer og stykker fortolkes)
+        - Referencer til domme og afgørelser
+        - Centrale juridiske begreber der omtales
+        - Persongrupper der omtales
+        - Juridiske undtagelser og specialregler
+        
+        Format:
+        {
+          "themes": {
+            "A.B.1.2": ["tema1", "tema2"]
+          },
+          "law_references": {
+            "LOV § X, stk. Y": ["A.B.1.2"],
+            "LOV § Z": ["A.B.1.2"]
+          },
+          "case_references": {
+            "DOM2011.747": {
+              "sections": ["A.B.1.2"],
+              "summary": "Kort beskrivelse"
+            }
+          },
+          "key_concepts": ["begreb1", "begreb2"],
+          "affected_groups": ["gruppe1", "gruppe2"],
+          "legal_exceptions": [
+            {
+              "rule": "Hovedregel beskrivelse",
+              "exception": "Undtagelse beskrivelse",
+              "sections": ["A.B.1.3"] 
+            }
+          ]
+        }
+        """
+            excerpt = text[:8000]
+            section_ids = list(dict.fromkeys(_RE_SECTION_ID.findall(excerpt)))
+            return (prompt + "\n\nJuridisk Vejledning (uddrag):\n" + excerpt
+                    + "\n\nAfsnits-ID'er i uddraget: " + ", ".join(section_ids))
+        
         prompt = """
         Du er en ekspert i dansk jura. Analyser denne del af den juridiske vejledning og opbyg en forståelse af dens struktur.
         
@@ -455,14 +985,22 @@ class Indexer(BaseIndexer):
         """
         
         # Tilføj teksten til prompten
-        prompt_with_text = prompt + "\n\nJuridisk Vejledning (uddrag):\n" + text[:8000]
-        
+        return prompt + "\n\nJuridisk Vejledning (uddrag):\n" + text[:8000]
+    
+    def _analyze_structure(self, text, model="gpt-4o", structure=None):
+        """Analyserer strukturen af vejledningen dynamisk med en sprogmodel.
+        En lokalt udledt struktur bruges som den er; ellers udleder sprogmodellen også den."""
         try:
             # Kald sprogmodel med caching
-            result = cached_call_gpt4o(prompt_with_text, model=model)
+            result = cached_call_gpt4o(
+                self._structure_prompt(text, structure), model=model,
+                prompt_cache_key=_STRUCTURE_PROMPT_CACHE_KEY
+            )
+            if structure:
+                result["structure"] = structure
             
             # Tilføj title baseret på første afsnit
-            title_match = re.search(r'[A-Z]\.[A-Z]\.\d+\.\d+\s+(.*?)(?:\n|$)', text[:1000])
+            title_match = _RE_STRUCTURE_TITLE.search(text[:1000])
             if title_match:
                 title = title_match.group(1).strip()
                 result["title"] = title
@@ -472,7 +1010,7 @@ class Indexer(BaseIndexer):
             self.logger.error(f"Fejl ved strukturanalyse: {str(e)}")
             # Returner standardstruktur ved fejl
             return {
-                "structure": {"main_sections": [], "section_hierarchy": {}, "section_titles": {}},
+                "structure": structure or {"main_sections": [], "section_hierarchy": {}, "section_titles": {}},
                 "themes": {},
                 "law_references": {},
                 "case_references": {},
@@ -488,16 +1026,16 @@ class Indexer(BaseIndexer):
         section_id = section_id or self._extract_section_id(segment)
         if not section_id:
             # Hvis vi ikke kan finde et afsnits-ID, generer et midlertidigt
-            section_id = f"unknown_section_{hash(segment[:100])}"
+            section_id = f"unknown_section_{_stable_hash(segment[:100])}"
         
         if not section_title:
             section_title = self._extract_section_title(segment, section_id)
         
         # 2. Vælg processeringsmetode baseret på indstillinger
-        if hasattr(st.session_state, 'extract_subsections') and st.session_state.extract_subsections:
+        if self.settings["extract_subsections"]:
             # Proces med underafsnit
             return self._process_with_subsections(segment, context_summary, doc_id, section_id, section_title, options)
-        elif hasattr(st.session_state, 'semantic_chunking') and st.session_state.semantic_chunking:
+        elif self.settings["semantic_chunking"]:
             # Brug semantisk chunking
             return self._semantic_chunking(segment, context_summary, doc_id, section_id, section_title, None, options)
         else:
@@ -506,20 +1044,20 @@ class Indexer(BaseIndexer):
 
     def _process_with_subsections(self, segment, context_summary, doc_id, section_id, section_title, options):
         """Processor et segment med opdeling i underafsnit"""
-        # Find underafsnit baseret på overskrifter
-        subsection_pattern = r'\n([A-Z][a-zæøåA-ZÆØÅ\s]+)(?:\n|$)'
-        parts = re.split(subsection_pattern, segment)
+        # Find underafsnit baseret på overskrifter. Uden overskrifter giver split blot [segment],
+        # som nedenfor behandles som introtekst.
+        parts = _RE_SUBSECTION.split(segment)
         
         chunks = []
         current_subsection = None
         
         # Håndter første del (ofte introduktion før første underafsnit)
-        if parts and not re.match(r'^[A-Z][a-zæøåA-ZÆØÅ\s]+$', parts[0].strip()):
+        if parts and not _RE_SUBSECTION_TITLE_ONLY.match(parts[0].strip()):
             # Dette er introduktionstekst
             intro_text = parts[0].strip()
             if intro_text:
                 # Brug semantisk chunking hvis aktiveret
-                if hasattr(st.session_state, 'semantic_chunking') and st.session_state.semantic_chunking:
+                if self.settings["semantic_chunking"]:
                     intro_chunks = self._semantic_chunking(
                         intro_text, 
                         context_summary, 
@@ -546,7 +1084,7 @@ class Indexer(BaseIndexer):
             else:  # Underafsnit-indhold
                 if current_subsection and parts[i].strip():
                     # Process dette underafsnit med semantisk chunking hvis aktiveret
-                    if hasattr(st.session_state, 'semantic_chunking') and st.session_state.semantic_chunking:
+                    if self.settings["semantic_chunking"]:
                         subsection_chunks = self._semantic_chunking(
                             parts[i].strip(), 
                             context_summary, 
@@ -568,7 +1106,7 @@ class Indexer(BaseIndexer):
         
         # Hvis vi ikke fandt underafsnit, brug standard chunking
         if not chunks:
-            if hasattr(st.session_state, 'semantic_chunking') and st.session_state.semantic_chunking:
+            if self.settings["semantic_chunking"]:
                 chunks = self._semantic_chunking(segment, context_summary, doc_id, section_id, section_title, None, options)
             else:
                 chunks = self._basic_chunking(segment, context_summary, doc_id, section_id, section_title, options)
@@ -580,26 +1118,24 @@ class Indexer(BaseIndexer):
         chunks = []
         
         # Hvis teksten er meget kort, opret et enkelt chunk
-        if len(text.strip()) < getattr(st.session_state, 'min_chunk_size', 250):
+        if len(text.strip()) < self.settings["min_chunk_size"]:
             return self._create_single_chunk(text, context_summary, doc_id, section_id, section_title, subsection)
         
         # 1. Uddrag eksempler først hvis aktiveret
-        if hasattr(st.session_state, 'extract_examples') and st.session_state.extract_examples:
-            example_chunks = self._extract_examples(text, context_summary, doc_id, section_id, section_title, subsection)
+        if self.settings["extract_examples"]:
+            example_chunks, example_spans = self._extract_examples(text, context_summary, doc_id, section_id, section_title, subsection)
             if example_chunks:
                 chunks.extend(example_chunks)
-                # Fjern eksemplerne fra teksten
-                for chunk in example_chunks:
-                    text = text.replace(chunk["content"], "")
+                # Fjern eksemplerne fra teksten ud fra deres position
+                text = _remove_spans(text, example_spans)
         
         # 2. Uddrag domsoversigter hvis aktiveret
-        if hasattr(st.session_state, 'extract_case_tables') and st.session_state.extract_case_tables and "dom" in text.lower():
-            table_chunks = self._extract_case_tables(text, context_summary, doc_id, section_id, section_title, subsection)
+        if self.settings["extract_case_tables"] and "dom" in text.lower():
+            table_chunks, table_spans = self._extract_case_tables(text, context_summary, doc_id, section_id, section_title, subsection)
             if table_chunks:
                 chunks.extend(table_chunks)
-                # Fjern tabellerne fra teksten
-                for chunk in table_chunks:
-                    text = text.replace(chunk["content"], "")
+                # Fjern tabellerne fra teksten ud fra deres position
+                text = _remove_spans(text, table_spans)
         
         # 3. Identificer semantiske brudpunkter for resten af teksten
         text = text.strip()
@@ -626,134 +1162,91 @@ class Indexer(BaseIndexer):
     
     def _determine_chunk_type(self, text):
         """Bestemmer chunk-typen baseret på indhold"""
-        text_lower = text.strip().lower()
-        
-        if re.search(r'^\s*(?:hovedregel|regel)\b', text_lower):
-            return "regel"
-        elif re.search(r'^\s*bemærk\b', text_lower):
-            return "note"
-        elif re.search(r'^\s*(?:se også|der henvises til)\b', text_lower):
-            return "reference"
-        elif re.search(r'^\s*(?:undtagelse|særregel)\b', text_lower):
-            return "undtagelse"
-        elif re.search(r'^\s*(?:eksempel|for eksempel|til illustration)\b', text_lower):
-            return "eksempel"
-        elif re.search(r'^\s*(?:definition|defineres som|forstås ved)\b', text_lower):
-            return "definition"
-        else:
-            return "text"
+        match = _RE_CHUNK_TYPE.match(text)
+        if match:
+            return match.lastgroup
+        return "text"
     
     def _split_by_semantic_breakpoints(self, text):
         """Opdeler tekst ved semantiske brudpunkter baseret på juridisk logik"""
         # Hent standard målstørrelse (vil blive justeret per segment baseret på indhold)
-        base_target_size = getattr(st.session_state, 'target_chunk_size', 1000)
+        base_target_size = self.settings["target_chunk_size"]
         
         # Hvis teksten er kortere end målstørrelsen, behold den som ét segment
         if len(text) <= base_target_size:
             return [text]
         
-        # Semantiske markører der indikerer nye logiske sektioner
-        # Sorteret efter prioritet/styrke af brudpunktet
-        primary_markers = [
-            r'^\s*Hovedregel\b',
-            r'^\s*Regel\b',
-            r'^\s*Undtagelse(n|rne)?\b',
-            r'^\s*Eksempel\b',
-            r'^\s*Definition\b'
-        ]
-        
-        secondary_markers = [
-            r'^\s*Se også\b', 
-            r'^\s*Der henvises til\b',
-            r'^\s*I praksis\b',
-            r'^\s*Forudsætninger(ne)?\b',
-            r'^\s*Betingelser(ne)?\b'
-        ]
-        
-        tertiary_markers = [
-            r'Det (antages|forudsættes|kræves)\b',
-            r'Det (bemærkes|fremgår|følger)\b',
-            r'Dette gælder (også|dog|ikke)\b',
-            r'Følgende (betingelser|krav|forudsætninger)'
-        ]
-        
         # Identificér potentielle breakpoints
         breakpoints = []
         
         # Håndter først afsnit som klare brudpunkter
         paragraphs = []
-        for para in re.split(r'\n\s*\n', text):
+        for para in _RE_BLANK_LINE.split(text):
             if para.strip():
                 paragraphs.append(para)
                 
         # Gå igennem paragraffer og identificer brudpunkter
         for i, para in enumerate(paragraphs):
             # Check for primære markører (stærkeste brud)
-            for marker in primary_markers:
-                if re.search(marker, para, re.MULTILINE):
-                    breakpoints.append((i, 10))  # Giv høj vægt (10) til primære markører
-                    break
-            else:
-                # Hvis ingen primære markører blev fundet, check sekundære
-                for marker in secondary_markers:
-                    if re.search(marker, para, re.MULTILINE):
-                        breakpoints.append((i, 5))  # Giv medium vægt (5) til sekundære markører
-                        break
-                else:
-                    # Hvis ingen sekundære markører blev fundet, check tertiære
-                    for marker in tertiary_markers:
-                        if re.search(marker, para, re.MULTILINE):
-                            breakpoints.append((i, 2))  # Giv lav vægt (2) til tertiære markører
-                            break
+            if _RE_PRIMARY_MARKERS.search(para):
+                breakpoints.append((i, 10))  # Giv høj vægt (10) til primære markører
+            # Hvis ingen primære markører blev fundet, check sekundære
+            elif _RE_SECONDARY_MARKERS.search(para):
+                breakpoints.append((i, 5))  # Giv medium vægt (5) til sekundære markører
+            # Hvis ingen sekundære markører blev fundet, check tertiære
+            elif _RE_TERTIARY_MARKERS.search(para):
+                breakpoints.append((i, 2))  # Giv lav vægt (2) til tertiære markører
         
         # Hvis vi ikke har nogen brudpunkter, brug standardopdeling (afsnit)
         if not breakpoints:
-            # Del på afsnit, men slå sammen hvis de er for små
-            current_segment = ""
+            # Del på afsnit, men slå sammen hvis de er for små. Afsnittene samles i en liste
+            # og sættes først sammen når segmentet afsluttes
+            current_parts = []
+            current_length = 0  # len("\n\n".join(current_parts))
             segments = []
             for para in paragraphs:
-                if len(current_segment) + len(para) > base_target_size * 1.5:
-                    if current_segment:
-                        segments.append(current_segment)
-                        current_segment = para
+                if current_length + len(para) > base_target_size * 1.5:
+                    if current_parts:
+                        segments.append("\n\n".join(current_parts))
+                        current_parts = [para]
+                        current_length = len(para)
                     else:
                         # Dette afsnit er for stort alene, del det ved sætningsgrænser
                         segments.extend(self._split_by_size(para, target_size=base_target_size))
                 else:
-                    if current_segment:
-                        current_segment += "\n\n" + para
-                    else:
-                        current_segment = para
+                    current_length += len(para) + 2 if current_parts else len(para)
+                    current_parts.append(para)
             
-            if current_segment:
-                segments.append(current_segment)
+            if current_parts:
+                segments.append("\n\n".join(current_parts))
                 
             return segments
         
-        # Sortér breakpoints efter position
-        breakpoints.sort(key=lambda x: x[0])
+        # Brudpunkterne er allerede sorteret efter position og højst ét pr. afsnit, da de findes
+        # i afsnittenes rækkefølge
         
         # Opbyg segmenter
         segments = []
         start_idx = 0
         
+        # Samlet længde af paragraffer før hvert indeks, så et kandidatsegments længde kan beregnes
+        # uden at sætte teksten sammen for hvert brudpunkt der springes over
+        length_before = [0, *accumulate(map(len, paragraphs))]
+        
         for break_idx, weight in breakpoints:
             if break_idx <= start_idx:
                 continue  # Skip hvis vi allerede har brugt dette brudpunkt
                 
-            # Tilføj paragraffer fra start_idx til break_idx (ekskl.)
-            segment_paras = paragraphs[start_idx:break_idx]
-            
-            # Vurder om det er værd at lave et brud her baseret på størrelse og vægt
-            segment_text = "\n\n".join(segment_paras)
-            next_para = paragraphs[break_idx] if break_idx < len(paragraphs) else ""
+            # Længden af paragrafferne fra start_idx til break_idx (ekskl.) inkl. "\n\n" imellem
+            segment_length = length_before[break_idx] - length_before[start_idx] + 2 * (break_idx - start_idx - 1)
+            next_para_length = len(paragraphs[break_idx]) if break_idx < len(paragraphs) else 0
             
             # Hvis segmentet er meget lille, og vægten er lav, overvej at fortsætte
-            if len(segment_text) < base_target_size * 0.4 and weight < 5 and len(segment_text + next_para) <= base_target_size:
+            if segment_length < base_target_size * 0.4 and weight < 5 and segment_length + next_para_length <= base_target_size:
                 continue  # Skip dette brudpunkt og fortsæt til næste
                 
-            if segment_text:
-                segments.append(segment_text)
+            if segment_length:
+                segments.append("\n\n".join(paragraphs[start_idx:break_idx]))
             
             start_idx = break_idx
         
@@ -775,58 +1268,41 @@ class Indexer(BaseIndexer):
     
     def _split_into_sentences(self, text):
         """Opdeler tekst i sætninger med respekt for juridiske forkortelser"""
-        # Definer forkortelser der kan indeholde punktummer, men ikke indikerer sætningsslut
-        abbreviations = [
-            r'jf\.', r'bl\.a\.', r'f\.eks\.', r'pkt\.', r'nr\.', r'stk\.', 
-            r'ca\.', r'evt\.', r'osv\.', r'mv\.', r'inkl\.', r'ekskl\.',
-            r'hhv\.', r'vedr\.', r'afd\.', r'div\.', r'pga\.'
-        ]
-        
-        # Erstat forkortelser midlertidigt for at undgå forkert opdeling
-        for abbr in abbreviations:
-            text = re.sub(abbr, abbr.replace('.', '<DOT>'), text)
-        
-        # Del ved sætningsgrænser
-        sentences = re.split(r'(?<=[.!?])\s+(?=[A-ZÆØÅ])', text)
-        
-        # Gendan forkortelser
-        sentences = [s.replace('<DOT>', '.') for s in sentences]
-        
-        return sentences
+        return _RE_SENTENCE_SPLIT.split(text)
     
     def _split_by_size(self, text, target_size=None):
         """Opdeler tekst i chunks af målstørrelse med respekt for sætningsgrænser"""
         if target_size is None:
-            target_size = getattr(st.session_state, 'target_chunk_size', 1000)
+            target_size = self.settings["target_chunk_size"]
             
         sentences = self._split_into_sentences(text)
         chunks = []
-        current_chunk = ""
+        # Det aktuelle chunk holdes som en liste af dele, der hver efterfølges af et mellemrum
+        current_parts = []
+        current_length = 0
         
         for sentence in sentences:
             # Hvis sentence alene er større end målstørrelsen*1.5, del det yderligere
             if len(sentence) > target_size * 1.5:
                 # Del ved kommaer eller andre naturlige pauser
-                clause_splits = re.split(r'(?<=[,:])\s+', sentence)
-                
-                for clause in clause_splits:
-                    if len(current_chunk + clause + " ") <= target_size:
-                        current_chunk += clause + " "
-                    else:
-                        if current_chunk:
-                            chunks.append(current_chunk.strip())
-                        current_chunk = clause + " "
-            # Ellers forsøg at holde sætninger sammen
-            elif len(current_chunk + sentence + " ") <= target_size:
-                current_chunk += sentence + " "
+                pieces = _RE_CLAUSE_SPLIT.split(sentence)
             else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = sentence + " "
+                # Ellers forsøg at holde sætninger sammen
+                pieces = (sentence,)
+            
+            for piece in pieces:
+                if current_length + len(piece) + 1 <= target_size:
+                    current_parts.append(piece)
+                    current_length += len(piece) + 1
+                else:
+                    if current_parts:
+                        chunks.append(" ".join(current_parts).strip())
+                    current_parts = [piece]
+                    current_length = len(piece) + 1
         
         # Tilføj sidste chunk
-        if current_chunk:
-            chunks.append(current_chunk.strip())
+        if current_parts:
+            chunks.append(" ".join(current_parts).strip())
         
         return chunks
 
@@ -862,21 +1338,14 @@ class Indexer(BaseIndexer):
         return chunks
 
     def _extract_examples(self, text, context_summary, doc_id, section_id, section_title, subsection):
-        """Udtrækker eksempler fra teksten og tilføjer kontekst til hovedregel"""
-        # Definér mønstre for eksempler
-        example_patterns = [
-            r'(Eksempel\s+\d+\s*[:\.][^E]*?)(?=Eksempel\s+\d+|$)',  # Standard nummererede eksempler
-            r'(Eksempel\s*[:\.][^E]*?)(?=Eksempel|$)',              # Generelle eksempler uden nummer
-            r'(Følgende\s+eksempel[^\.]*?illustrerer.*?(?:\n\n|$))',  # Følgende eksempel illustrerer...
-            r'((?:Til\s+illustration|Som\s+eksempel)[^\.]*?(?:kan\s+nævnes|vises).*?(?:\n\n|$))',  # Til illustration/Som eksempel
-            r'(For\s+eksempel\s+(?:kan|vil|har).*?(?:\n\n|$))'        # For eksempel...
-        ]
-        
+        """Udtrækker eksempler fra teksten og tilføjer kontekst til hovedregel.
+        Returnerer (chunks, spans), hvor spans er eksemplernes (start, slut) i teksten."""
         chunks = []
+        spans = []
         example_count = 0
         
-        for pattern in example_patterns:
-            examples = re.finditer(pattern, text, re.DOTALL)
+        for pattern in _EXAMPLE_PATTERNS:
+            examples = pattern.finditer(text)
             
             for match in examples:
                 example_text = match.group(1).strip()
@@ -884,23 +1353,27 @@ class Indexer(BaseIndexer):
                     example_count += 1
                     
                     # Udled eksempel-nummer hvis det findes
-                    example_num_match = re.search(r'Eksempel\s+(\d+)', example_text)
+                    example_num_match = _RE_EXAMPLE_NUM.search(example_text)
                     example_num = example_num_match.group(1) if example_num_match else str(example_count)
                     
+                    # Afgør i ét gennemløb hvilke mønsterfamilier der kan matche eksemplet
+                    hints = _extraction_hints(example_text)
+                    
                     # Find domsreferencer i eksemplet
-                    case_refs = self._extract_case_refs_from_text(example_text)
+                    case_refs = self._extract_case_refs_from_text(example_text, hints)
                     
                     # Find lovhenvisninger i eksemplet
-                    structured_refs, primary_law_ref = self._extract_law_refs_from_text(example_text)
+                    structured_refs, primary_law_ref = self._extract_law_refs_from_text(example_text, hints)
                     
                     # Udled persongrupper
-                    affected_groups = self._extract_affected_groups(example_text)
+                    affected_groups = self._extract_affected_groups(example_text, hints)
                     
                     # Udled juridiske undtagelser
-                    legal_exceptions = self._extract_legal_exceptions(example_text)
+                    legal_exceptions = self._extract_legal_exceptions(example_text, hints)
                     
                     # Find kontekst for eksemplet (relaterede regler)
-                    related_rule = self._find_related_rule(text, example_text)
+                    span = _stripped_span(match)
+                    related_rule = self._find_related_rule(text, span[0])
                     
                     # Opret chunk for dette eksempel
                     example_chunk = self._create_chunk(
@@ -927,11 +1400,14 @@ class Indexer(BaseIndexer):
                     if primary_law_ref:
                         example_chunk["metadata"]["primary_law_ref"] = primary_law_ref
                     
+                    # Gem eksemplets placering i teksten
+                    example_chunk["metadata"]["source_span"] = list(span)
+                    spans.append(span)
+                    
                     chunks.append(example_chunk)
         
         # Identificer også implicitte eksempler (casebaserede beskrivelser uden "eksempel"-markør)
-        implicit_example_pattern = r'(?<!\w)((?:Hvis|Lad os antag|Tænk på)[^\.]*?(?:person|firma|virksomhed|selskab)[^\.]*?(?:der|som|hvilket)[^\.]*?(?:\n\n|$))'
-        implicit_examples = re.finditer(implicit_example_pattern, text, re.DOTALL)
+        implicit_examples = _RE_IMPLICIT_EXAMPLE.finditer(text)
         
         implicit_count = 0
         for match in implicit_examples:
@@ -940,13 +1416,15 @@ class Indexer(BaseIndexer):
                 implicit_count += 1
                 
                 # Håndter som et eksempel
-                case_refs = self._extract_case_refs_from_text(implicit_example_text)
-                structured_refs, primary_law_ref = self._extract_law_refs_from_text(implicit_example_text)
-                affected_groups = self._extract_affected_groups(implicit_example_text)
-                legal_exceptions = self._extract_legal_exceptions(implicit_example_text)
+                hints = _extraction_hints(implicit_example_text)
+                case_refs = self._extract_case_refs_from_text(implicit_example_text, hints)
+                structured_refs, primary_law_ref = self._extract_law_refs_from_text(implicit_example_text, hints)
+                affected_groups = self._extract_affected_groups(implicit_example_text, hints)
+                legal_exceptions = self._extract_legal_exceptions(implicit_example_text, hints)
                 
                 # Find kontekst for eksemplet
-                related_rule = self._find_related_rule(text, implicit_example_text)
+                span = _stripped_span(match)
+                related_rule = self._find_related_rule(text, span[0])
                 
                 # Opret chunk for dette implicitte eksempel
                 implicit_chunk = self._create_chunk(
@@ -970,33 +1448,34 @@ class Indexer(BaseIndexer):
                 
                 if primary_law_ref:
                     implicit_chunk["metadata"]["primary_law_ref"] = primary_law_ref
+                
+                implicit_chunk["metadata"]["source_span"] = list(span)
+                spans.append(span)
                     
                 chunks.append(implicit_chunk)
         
-        return chunks
+        return chunks, spans
     
-    def _find_related_rule(self, full_text, example_text):
-        """Finder den relaterede regel til et eksempel"""
+    def _find_related_rule(self, full_text, example_start):
+        """Finder den relaterede regel til et eksempel, der starter ved example_start i full_text"""
         # Forsøg at finde tekst før eksemplet der indeholder en regel
-        example_start = full_text.find(example_text)
         if example_start <= 0:
             return None
             
-        # Find teksten før eksemplet
-        text_before = full_text[:example_start].strip()
+        # Teksten før eksemplet uden efterfølgende blanktegn afgrænses med endpos i stedet for at
+        # kopiere den ud; mønstrene ser så teksten som om den sluttede dér
+        end = example_start
+        while end > 0 and full_text[end - 1].isspace():
+            end -= 1
         
         # Check for specifikke rege-lignende afsnit
-        rule_patterns = [
-            r'(?:Hovedregel|Regel).*?(?=\n\n)',
-            r'(?:Reglerne|Reglen).*?(?=\n\n)',
-            r'(?:Efter|Ifølge).*?(?:gælder|er).*?(?=\n\n)'
-        ]
-        
-        for pattern in rule_patterns:
-            rule_matches = list(re.finditer(pattern, text_before, re.DOTALL))
-            if rule_matches:
+        for pattern in _RULE_PATTERNS:
+            last_match = None
+            for last_match in pattern.finditer(full_text, 0, end):
+                pass
+            if last_match:
                 # Tag den sidste match (den nærmeste regel før eksemplet)
-                rule_text = rule_matches[-1].group(0).strip()
+                rule_text = last_match.group(0).strip()
                 # Begræns længden for at holde den kompakt
                 max_rule_length = 300
                 if len(rule_text) > max_rule_length:
@@ -1004,29 +1483,32 @@ class Indexer(BaseIndexer):
                 return rule_text
         
         # Hvis vi ikke finder en regel, prøv at tage det sidste afsnit før eksemplet
-        paragraphs = text_before.split("\n\n")
-        if paragraphs:
-            last_paragraph = paragraphs[-1].strip()
-            # Kun returner hvis det ser ud til at være relevant
-            if len(last_paragraph) > 30 and len(last_paragraph) < 300:
-                return last_paragraph
+        paragraph_start = full_text.rfind("\n\n", 0, end)
+        last_paragraph = full_text[paragraph_start + 2 if paragraph_start != -1 else 0:end].strip()
+        # Kun returner hvis det ser ud til at være relevant
+        if len(last_paragraph) > 30 and len(last_paragraph) < 300:
+            return last_paragraph
                 
         return None
 
-    def _extract_law_refs_from_text(self, text):
+    def _extract_law_refs_from_text(self, text, hints=None):
         """Udtrækker strukturerede lovhenvisninger fra tekst med dynamiske forkortelser"""
+        # Begge henvisningsmønstre kræver et paragraftegn
+        if not _has_hint("law", text, hints):
+            return [], None
+        
         law_refs = []
+        text_lower = _lower_aligned(text)
     
         # Find lovhenvisninger med lov + § + paragraf
-        law_pattern = r'([a-zæøåA-ZÆØÅ]+(?:lovens?|loven))\s+§[§]?\s*(\d+\s*[A-Za-z]?(?:\s*[-–]\s*\d+\s*[A-Za-z]?)?)'
-        for match in re.finditer(law_pattern, text, re.IGNORECASE):
-            lov_text = match.group(1).lower()
-            paragraf_range = match.group(2).strip()
+        for match in _RE_LAW_REF.finditer(text_lower):
+            lov_text = _original_group(text, match, 1).lower()
+            paragraf_range = _original_group(text, match, 2).strip()
             
             # Bestem forkortelse baseret på lovnavn ved hjælp af domænekonfigurationen
             prefix = None
-            for lovnavn, forkortelse in self.law_abbreviations.items():
-                if lovnavn.lower() in lov_text:
+            for lovnavn_lower, forkortelse in self._law_names_lower:
+                if lovnavn_lower in lov_text:
                     prefix = forkortelse
                     break
                     
@@ -1039,7 +1521,7 @@ class Indexer(BaseIndexer):
                 
             # Håndter paragraf-ranges (f.eks. §§ 4-6)
             if '-' in paragraf_range or '–' in paragraf_range:
-                range_match = re.search(r'(\d+)\s*[-–]\s*(\d+)', paragraf_range)
+                range_match = _RE_NUMBER_RANGE.search(paragraf_range)
                 if range_match:
                     start_num = int(range_match.group(1))
                     end_num = int(range_match.group(2))
@@ -1048,7 +1530,7 @@ class Indexer(BaseIndexer):
                         law_refs.append(ref)
             else:
                 # Udled stykke hvis det findes
-                stykke_match = re.search(r'(?:,?\s*(?:stk\.|stykke)\s*(\d+))', text)
+                stykke_match = _RE_STK_NUM.search(text)
                 stykke = stykke_match.group(1) if stykke_match else ""
                 
                 ref = f"{prefix} § {paragraf_range}"
@@ -1058,20 +1540,20 @@ class Indexer(BaseIndexer):
                 law_refs.append(ref)
         
         # Find direkte paragrafhenvisninger (§ 33 A eller §§ 4-6)
-        direct_pattern = r'(§[§]?\s*\d+\s*[A-Za-z]?(?:\s*[-–]\s*\d+\s*[A-Za-z]?)?)'
-        for match in re.finditer(direct_pattern, text):
+        for match in _RE_DIRECT_PARAGRAPH.finditer(text):
             # Håndter paragraf-ranges for direkte referencer
             direct_ref = match.group(1)
+            ref_start, ref_end = match.span(1)
             
             if '§§' in direct_ref and ('-' in direct_ref or '–' in direct_ref):
-                range_match = re.search(r'§§\s*(\d+)\s*[-–]\s*(\d+)', direct_ref)
+                range_match = _RE_PARAGRAPH_RANGE.search(direct_ref)
                 if range_match:
                     start_num = int(range_match.group(1))
                     end_num = int(range_match.group(2))
                     
                     # Find mulig lovkontekst i nærheden af referencen
-                    context_before = text[max(0, text.find(direct_ref)-50):text.find(direct_ref)]
-                    context_after = text[text.find(direct_ref)+len(direct_ref):min(len(text), text.find(direct_ref)+len(direct_ref)+50)]
+                    context_before = text[max(0, ref_start-50):ref_start]
+                    context_after = text[ref_end:ref_end+50]
                     
                     # Find hvilken lov der refereres til baseret på kontekst
                     prefix = self._determine_law_from_context(context_before + context_after)
@@ -1082,16 +1564,16 @@ class Indexer(BaseIndexer):
                             law_refs.append(ref)
             else:
                 # Udled paragraf og stykke
-                para_match = re.search(r'§\s*(\d+\s*[A-Za-z]?)', direct_ref)
-                stykke_match = re.search(r'(?:,?\s*(?:stk\.|stykke)\s*(\d+))', text)
+                para_match = _RE_PARAGRAPH_NUM.search(direct_ref)
+                stykke_match = _RE_STK_NUM.search(text)
                 
                 if para_match:
                     paragraf = para_match.group(1).strip()
                     stykke = stykke_match.group(1) if stykke_match else ""
                     
                     # Find mulig lovkontekst i nærheden af referencen
-                    context_before = text[max(0, text.find(direct_ref)-50):text.find(direct_ref)]
-                    context_after = text[text.find(direct_ref)+len(direct_ref):min(len(text), text.find(direct_ref)+len(direct_ref)+50)]
+                    context_before = text[max(0, ref_start-50):ref_start]
+                    context_after = text[ref_end:ref_end+50]
                     
                     # Find hvilken lov der refereres til baseret på kontekst
                     prefix = self._determine_law_from_context(context_before + context_after)
@@ -1104,9 +1586,8 @@ class Indexer(BaseIndexer):
                         law_refs.append(ref)
         
         # Tæl forekomster af hver reference for at finde primær reference
-        ref_counts = {}
-        for ref in law_refs:
-            ref_counts[ref] = text.lower().count(ref.lower())
+        text_lower = text.lower()
+        ref_counts = {ref: text_lower.count(ref.lower()) for ref in law_refs}
         
         # Find den mest omtalte reference som primær
         primary_ref = None
@@ -1128,13 +1609,13 @@ class Indexer(BaseIndexer):
         context_lower = context.lower()
         
         # Tjek først for lovnavne i konteksten
-        for lovnavn, forkortelse in self.law_abbreviations.items():
-            if lovnavn.lower() in context_lower:
+        for lovnavn_lower, forkortelse in self._law_names_lower:
+            if lovnavn_lower in context_lower:
                 return forkortelse
                 
         # Tjek for forkortelser i konteksten
-        for forkortelse in self.law_abbreviations.values():
-            if forkortelse.lower() in context_lower:
+        for forkortelse_lower, forkortelse in self._law_abbreviations_lower:
+            if forkortelse_lower in context_lower:
                 return forkortelse
                 
         # Returner standardværdi hvis ingen lov kunne bestemmes
@@ -1145,55 +1626,42 @@ class Indexer(BaseIndexer):
         # Sidste udvej: returner "LOV" som generisk forkortelse
         return "LOV"
 
-    def _extract_case_refs_from_text(self, text):
+    def _extract_case_refs_from_text(self, text, hints=None):
         """Udtrækker domsreferencer fra tekst"""
         case_refs = []
+        if not _has_hint("case", text, hints):
+            return case_refs
         
         # Find dynamiske mønstre baseret på retsområde og danske domstole
-        case_patterns = [
-            # Domme fra Højesteret, Landsretten, Sø- og Handelsretten, etc.
-            r'((?:UfR|U|TfS|FM|MAD)\s*\d{4}[.,]\s*\d+(?:\s*[A-ZØ]+)?)',
-            r'((?:Højesterets|Landsrettens|Sø-\s*og\s*Handelsrettens)\s*dom\s*af\s*\d{1,2}\.\s*\w+\s*\d{4})',
-            # Administrative afgørelser 
-            r'((?:SKM|LSR|TfS|TSS)[-\s]*\d{4}[.,]\s*\d+(?:\s*[A-ZØ]+)?)',
-            # Andre formater
-            r'([A-ZÆØÅ]{2,5}\s*\d{4}[-.,/]\s*\d+(?:\s*[A-ZØ]+)?)'
-        ]
-        
-        for pattern in case_patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
+        text_lower = _lower_aligned(text)
+        for pattern in _CASE_REF_PATTERNS:
+            matches = pattern.finditer(text_lower)
             for match in matches:
-                case_ref = match.group(1).strip()
+                case_ref = _original_group(text, match, 1).strip()
                 if case_ref and case_ref not in case_refs:
                     case_refs.append(case_ref)
         
         return case_refs
 
-    def _extract_affected_groups(self, text):
+    def _extract_affected_groups(self, text, hints=None):
         """Udtrækker berørte persongrupper fra teksten dynamisk fra domæne-konfigurationen"""
         affected_groups = []
+        text_lower = _lower_aligned(text)
         
         # Brug domænekonfigurationen til at finde persongrupper
+        # Alle nøgleord søges i ét gennemløb; grupperne tilføjes i konfigurationens rækkefølge
         if hasattr(self, 'person_groups') and self.person_groups:
-            for group, keywords in self.person_groups.items():
-                for keyword in keywords:
-                    if re.search(r'\b' + re.escape(keyword) + r'\b', text.lower()):
-                        affected_groups.append(group)
-                        break  # Kun tilføj gruppen én gang
+            found = _match_keyword_groups(self._person_group_matcher, text_lower)
+            affected_groups.extend(group for group in self.person_groups if group in found)
         
         # Særlige mønstre for at finde persongrupper
-        patterns = [
-            r'(?:for|gælder for|omfatter)\s+([^\.;,]+?)\s+(?:der|som|når)',
-            r'(?:personer|ydere|pligtige|borgere|virksomheder)\s+(?:der|som)\s+([^\.;,]+)',
-            r'([^\.;,]+)\s+(?:er|kan være|anses for)\s+(?:pligtig|omfattet|forpligtet|berettiget)'
-        ]
-        
+        patterns = _GROUP_PATTERNS if _has_hint("group_obligation", text, hints) else _GROUP_PATTERNS[:2]
         for pattern in patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
+            matches = pattern.finditer(text_lower)
             for match in matches:
-                group = match.group(1).strip()
+                group = _original_group(text, match, 1).strip()
                 # Rens gruppen for støjord
-                group = re.sub(r'\b(personer|ydere|pligtige|alle|disse|de|bestemte)\b', '', group).strip()
+                group = _RE_GROUP_NOISE.sub('', group).strip()
                 # Undgå for korte eller lange udtryk
                 if len(group) > 5 and len(group) < 50:
                     affected_groups.append(group)
@@ -1206,43 +1674,39 @@ class Indexer(BaseIndexer):
         
         return unique_groups
 
-    def _extract_legal_exceptions(self, text):
+    def _extract_legal_exceptions(self, text, hints=None):
         """Udtrækker juridiske undtagelser og specialregler"""
         exceptions = []
         
         # Mønstre der kan indikere undtagelser
-        exception_patterns = [
-            r'(?:undtagelse|særregel|specialregel)[^\.;,]*?(?=\.|;|$)',
-            r'(?:gælder ikke|finder ikke anvendelse)[^\.;,]*?(?=\.|;|$)',
-            r'(?:medmindre|dog ikke|undtaget herfra er)[^\.;,]*?(?=\.|;|$)',
-            r'(?:uanset|til trods for)[^\.;,]*?(?=\.|;|$)',
-            r'(?:Hovedreglen|Udgangspunktet).*?(?:men|dog)[^\.;,]*?(?=\.|;|$)'
-        ]
-        
+        exception_patterns = _EXCEPTION_PATTERNS if _has_hint("exception", text, hints) else ()
+        text_lower = _lower_aligned(text)
         for pattern in exception_patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
+            matches = pattern.finditer(text_lower)
             for match in matches:
-                exception = match.group(0).strip()
+                exception = _original_group(text, match).strip()
                 if exception and len(exception) > 10:  # Undgå for korte udtryk
                     exceptions.append(exception)
         
         # Tilføj domænespecifikke undtagelser fra domænekonfigurationen
         if hasattr(self, 'domain_config') and 'legal_exceptions' in self.domain_config:
             for exception in self.domain_config['legal_exceptions']:
-                if exception.lower() in text.lower() and exception not in exceptions:
+                if exception.lower() in text_lower and exception not in exceptions:
                     exceptions.append(exception)
         
         # Fjern duplikater
         unique_exceptions = []
+        seen = set()
         for exc in exceptions:
             # Normalisér til lowercase for sammenligning
             norm_exc = exc.lower()
-            if not any(norm_exc == e.lower() for e in unique_exceptions):
+            if norm_exc not in seen:
+                seen.add(norm_exc)
                 unique_exceptions.append(exc)
         
         return unique_exceptions
 
-    def _extract_concepts(self, text, themes=None):
+    def _extract_concepts(self, text, themes=None, hints=None):
         """Udtrækker dynamiske nøglekoncepter fra teksten baseret på dokumentets indhold"""
         # Start med eventuelle kendte temaer
         if themes and isinstance(themes, list):
@@ -1256,22 +1720,19 @@ class Indexer(BaseIndexer):
             domain_concepts = self.domain_config.get('key_concepts', [])
         
             # Tjek for hvert domæne-koncept om det findes i teksten
+            text_lower = text.lower()
             for concept in domain_concepts:
-                if concept.lower() in text.lower() and concept not in concepts:
+                if concept.lower() in text_lower and concept not in concepts:
                     concepts.append(concept)
     
         # Find definitioner direkte i teksten (dynamisk)
-        definition_patterns = [
-            r'Ved\s+([^\.;,]+)\s+forstås',
-            r'([^\.;,]+)\s+defineres\s+som',
-            r'([^\.;,]+)\s+betyder\s+i\s+denne\s+sammenhæng'
-        ]
-    
+        definition_patterns = _DEFINITION_PATTERNS if _has_hint("definition", text, hints) else ()
+        text_lower = _lower_aligned(text)
         for pattern in definition_patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
+            matches = pattern.finditer(text_lower)
             for match in matches:
-                term = match.group(1).strip().lower()
-                term = re.sub(r'\b(herved|således|dermed|hermed|at)\b', '', term).strip()
+                term = _original_group(text, match, 1).strip().lower()
+                term = _RE_TERM_NOISE.sub('', term).strip()
                 if len(term) > 3 and len(term) < 50 and term not in concepts:
                     concepts.append(term)
     
@@ -1331,8 +1792,9 @@ class Indexer(BaseIndexer):
         
         # Lingvistiske kompleksitetsmarkører
         complex_terms = ["dog", "medmindre", "såfremt", "forudsat", "betinget af", "undtagelsesvis"]
+        text_lower = text.lower()
         for term in complex_terms:
-            if term in text.lower():
+            if term in text_lower:
                 complexity_score += 1
                 
         # Konvertér score til kategorier
@@ -1348,9 +1810,10 @@ class Indexer(BaseIndexer):
         found_types = []
         
         # Tjek hvert spørgsmålsmønster fra domænekonfigurationen
+        text_lower = text.lower()
         for q_type, patterns in self.question_patterns.items():
             for pattern in patterns:
-                if re.search(pattern, text.lower()):
+                if re.search(pattern, text_lower):
                     found_types.append(q_type)
                     break  # Gå videre til næste spørgsmålstype når vi har et match
         
@@ -1381,17 +1844,20 @@ class Indexer(BaseIndexer):
 
     def _metadata_extractor(self, text, context_summary):
         """Centraliseret metadata-udtrækning fra tekst"""
+        # Afgør i ét gennemløb hvilke mønsterfamilier der kan matche teksten
+        hints = _extraction_hints(text)
+        
         # Udled lovhenvisninger
-        structured_refs, primary_law_ref = self._extract_law_refs_from_text(text)
+        structured_refs, primary_law_ref = self._extract_law_refs_from_text(text, hints)
         
         # Udled domsreferencer
-        case_references = self._extract_case_refs_from_text(text)
+        case_references = self._extract_case_refs_from_text(text, hints)
         
         # Udled persongrupper
-        affected_groups = self._extract_affected_groups(text)
+        affected_groups = self._extract_affected_groups(text, hints)
         
         # Udled juridiske undtagelser
-        legal_exceptions = self._extract_legal_exceptions(text)
+        legal_exceptions = self._extract_legal_exceptions(text, hints)
         
         # Udled temaer fra context_summary
         if context_summary and "key_concepts" in context_summary:
@@ -1400,7 +1866,7 @@ class Indexer(BaseIndexer):
             themes = self.default_themes
         
         # Udled koncepter baseret på indhold og kontekst
-        concepts = self._extract_concepts(text, themes)
+        concepts = self._extract_concepts(text, themes, hints)
         
         # Bestem kompleksitet
         complexity = self._determine_complexity(text, structured_refs, case_references)
@@ -1438,7 +1904,7 @@ class Indexer(BaseIndexer):
             metadata_dict = kwargs
         
         # Generer chunk ID
-        chunk_id = f"{section_id}_{subsection}_{example_num or chunk_type}_{hash(text[:50])}"
+        chunk_id = f"{section_id}_{subsection}_{example_num or chunk_type}_{_stable_hash(text[:50])}"
         
         # Opret chunk
         chunk = {
@@ -1491,7 +1957,7 @@ class Indexer(BaseIndexer):
     def _get_target_size_for_chunk_type(self, chunk_type):
         """Bestemmer målstørrelsen for en chunk baseret på indholdstypen"""
         # Sæt standardstørrelse fra session state
-        base_size = getattr(st.session_state, 'target_chunk_size', 1000)
+        base_size = self.settings["target_chunk_size"]
         
         # Juster baseret på chunk-type
         if chunk_type == "eksempel":
@@ -1525,7 +1991,7 @@ class Indexer(BaseIndexer):
     
         # Faktor baseret på længde
         length = len(text)
-        min_chunk_size = getattr(st.session_state, 'min_chunk_size', 250)
+        min_chunk_size = self.settings["min_chunk_size"]
     
         # Brug dynamisk målstørrelse baseret på chunk-type
         target_size = self._get_target_size_for_chunk_type(chunk_type)
@@ -1558,7 +2024,7 @@ class Indexer(BaseIndexer):
             score += min(0.15, 0.03 * len(concepts))  # Op til 0.15 for mange koncepter
     
         # Faktor baseret på tekst-kvalitet
-        if re.search(r'\bbestår af\b|\bdefineres som\b|\bforståes ved\b|\bfølger af\b', text, re.IGNORECASE):
+        if _RE_EXPLANATION.search(text):
             score += 0.1  # Definitioner og forklaringer er vigtige
     
         # Faktor baseret på indholdstype
@@ -1579,7 +2045,7 @@ class Indexer(BaseIndexer):
         chunks = []
     
         # 0. Håndter meget korte tekster
-        if len(text.strip()) < getattr(st.session_state, 'min_chunk_size', 250):
+        if len(text.strip()) < self.settings["min_chunk_size"]:
             return self._create_single_chunk(text, context_summary, doc_id, section_id, section_title, subsection)
         
         # Tjek først om hele teksten er et eksempel
@@ -1591,22 +2057,20 @@ class Indexer(BaseIndexer):
             is_example = False
         
         # 1. Uddrag eksempler først hvis aktiveret
-        if hasattr(st.session_state, 'extract_examples') and st.session_state.extract_examples:
-            example_chunks = self._extract_examples(text, context_summary, doc_id, section_id, section_title, subsection)
+        if self.settings["extract_examples"]:
+            example_chunks, example_spans = self._extract_examples(text, context_summary, doc_id, section_id, section_title, subsection)
             if example_chunks:
                 chunks.extend(example_chunks)
-                # Fjern eksemplerne fra teksten
-                for chunk in example_chunks:
-                    text = text.replace(chunk["content"], "")
+                # Fjern eksemplerne fra teksten ud fra deres position
+                text = _remove_spans(text, example_spans)
         
             # 2. Uddrag domsoversigter hvis aktiveret
-            if hasattr(st.session_state, 'extract_case_tables') and st.session_state.extract_case_tables and "dom" in text.lower():
-                table_chunks = self._extract_case_tables(text, context_summary, doc_id, section_id, section_title, subsection)
+            if self.settings["extract_case_tables"] and "dom" in text.lower():
+                table_chunks, table_spans = self._extract_case_tables(text, context_summary, doc_id, section_id, section_title, subsection)
                 if table_chunks:
                     chunks.extend(table_chunks)
-                    # Fjern tabellerne fra teksten
-                    for chunk in table_chunks:
-                        text = text.replace(chunk["content"], "")
+                    # Fjern tabellerne fra teksten ud fra deres position
+                    text = _remove_spans(text, table_spans)
         
             # 3. Del resten af teksten i semantiske chunks
             text = text.strip()
@@ -1625,12 +2089,12 @@ class Indexer(BaseIndexer):
                     ))
                 else:
                     # Del i semantiske chunks ved afsnit
-                    paragraphs = re.split(r'\n\s*\n', text)
+                    paragraphs = _RE_BLANK_LINE.split(text)
                     
                     for para in paragraphs:
                         if para.strip():
                             # Tjek om dette afsnit er for langt og skal deles yderligere
-                            target_size = getattr(st.session_state, 'target_chunk_size', 1000)
+                            target_size = self.settings["target_chunk_size"]
                             if len(para) > target_size:
                                 # Del i mindre afsnit ved sætningsgrænser
                                 sentences = self._split_into_sentences(para)
@@ -1686,18 +2150,13 @@ class Indexer(BaseIndexer):
         )]
 
     def _extract_case_tables(self, text, context_summary, doc_id, section_id, section_title, subsection):
-        """Udtrækker tabeller med domme og afgørelser"""
+        """Udtrækker tabeller med domme og afgørelser. Returnerer (chunks, spans) som _extract_examples"""
         chunks = []
+        spans = []
         
         # Find tabeller med domme
-        table_patterns = [
-            r'((?:Skemaet|Oversigten)\s+viser[\s\S]*?(?=\n\n|$))',
-            r'((?:Følgende|Nedenstående)\s+(?:afgørelser|domme|kendelser)[\s\S]*?(?=\n\n|$))',
-            r'((?:Domsoversigt|Afgørelsesoversigt)[\s\S]*?(?=\n\n|$))'
-        ]
-        
-        for pattern in table_patterns:
-            matches = re.finditer(pattern, text, re.DOTALL)
+        for pattern in _CASE_TABLE_PATTERNS:
+            matches = pattern.finditer(text)
             
             for match in matches:
                 table_text = match.group(1).strip()
@@ -1719,8 +2178,9 @@ class Indexer(BaseIndexer):
                             is_example=False,
                             case_references=case_refs
                         ))
+                        spans.append(_stripped_span(match))
         
-        return chunks
+        return chunks, spans
 
     def _get_hierarchy_path(self, section_id, context_summary):
         """Udleder hierarkisk sti baseret på afsnits-ID"""
@@ -1782,7 +2242,7 @@ class Indexer(BaseIndexer):
         st.write("Balancerer chunk-størrelser...")
         
         # Find meget små chunks (under min_chunk_size)
-        min_chunk_size = getattr(st.session_state, 'min_chunk_size', 250)
+        min_chunk_size = self.settings["min_chunk_size"]
         
         small_chunks = []
         normal_chunks = []
@@ -1930,127 +2390,123 @@ class Indexer(BaseIndexer):
         
         return balanced_chunks
 
-    def _normalize_law_references(self, chunks):
-        """Normaliserer lovhenvisninger til standardformat baseret på konfiguration"""
-        for chunk in chunks:
-            metadata = chunk["metadata"]
-            if "law_references" in metadata:
-                normalized_refs = []
-                
-                # Håndter både strukturerede og ustrukturerede referencer
-                if isinstance(metadata["law_references"], list):
-                    if all(isinstance(item, dict) for item in metadata["law_references"]):
-                        # Strukturerede referencer
-                        for ref_obj in metadata["law_references"]:
-                            ref = ref_obj["ref"]
-                            normalized = ref
-                            
-                            # Normaliser reference-teksten baseret på konfigurationen
-                            for lovnavn, abbr in self.law_abbreviations.items():
-                                if lovnavn.lower() in ref.lower():
-                                    para_match = re.search(r'§\s*(\d+\s*[A-Za-z]?)', ref)
-                                    stk_match = re.search(r'(?:stk\.|stykke)\s*(\d+)', ref)
-                                    
-                                    if para_match:
-                                        normalized = f"{abbr} § {para_match.group(1).strip()}"
-                                        if stk_match:
-                                            normalized += f", stk. {stk_match.group(1)}"
-                                        break
-                            
-                            # Tjek om det er en direkte paragrafhenvisning
-                            if normalized == ref and ref.startswith("§"):
-                                para_match = re.search(r'§\s*(\d+\s*[A-Za-z]?)', ref)
-                                stk_match = re.search(r'(?:stk\.|stykke)\s*(\d+)', ref)
+    def _normalize_chunk_law_references(self, chunk):
+        """Normaliserer et chunks lovhenvisninger til standardformat baseret på konfiguration"""
+        metadata = chunk["metadata"]
+        if "law_references" in metadata:
+            normalized_refs = []
+            
+            # Håndter både strukturerede og ustrukturerede referencer
+            if isinstance(metadata["law_references"], list):
+                if all(isinstance(item, dict) for item in metadata["law_references"]):
+                    # Strukturerede referencer
+                    for ref_obj in metadata["law_references"]:
+                        ref = ref_obj["ref"]
+                        normalized = ref
+                        
+                        # Normaliser reference-teksten baseret på konfigurationen
+                        ref_lower = ref.lower()
+                        for lovnavn_lower, abbr in self._law_names_lower:
+                            if lovnavn_lower in ref_lower:
+                                para_match = _RE_PARAGRAPH_NUM.search(ref)
+                                stk_match = _RE_STK_NUM.search(ref)
                                 
                                 if para_match:
-                                    # Brug dynamisk bestemt lovforkortelse eller default
-                                    lovprefix = self._determine_law_from_context(ref)
-                                    normalized = f"{lovprefix} § {para_match.group(1).strip()}"
+                                    normalized = f"{abbr} § {para_match.group(1).strip()}"
                                     if stk_match:
                                         normalized += f", stk. {stk_match.group(1)}"
+                                    break
+                        
+                        # Tjek om det er en direkte paragrafhenvisning
+                        if normalized == ref and ref.startswith("§"):
+                            para_match = _RE_PARAGRAPH_NUM.search(ref)
+                            stk_match = _RE_STK_NUM.search(ref)
                             
-                            # Opret nyt reference-objekt med normaliseret tekst
-                            normalized_refs.append({
-                                "ref": normalized,
-                                "is_primary": ref_obj.get("is_primary", False)
-                            })
-                    else:
-                        # Ustrukturerede referencer
-                        for ref in metadata["law_references"]:
-                            normalized = ref
-                            
-                            for lovnavn, abbr in self.law_abbreviations.items():
-                                if lovnavn.lower() in ref.lower():
-                                    para_match = re.search(r'§\s*(\d+\s*[A-Za-z]?)', ref)
-                                    stk_match = re.search(r'(?:stk\.|stykke)\s*(\d+)', ref)
-                                    
-                                    if para_match:
-                                        normalized = f"{abbr} § {para_match.group(1).strip()}"
-                                        if stk_match:
-                                            normalized += f", stk. {stk_match.group(1)}"
-                                        break
-                            
-                            if normalized == ref and ref.startswith("§"):
-                                para_match = re.search(r'§\s*(\d+\s*[A-Za-z]?)', ref)
-                                stk_match = re.search(r'(?:stk\.|stykke)\s*(\d+)', ref)
+                            if para_match:
+                                # Brug dynamisk bestemt lovforkortelse eller default
+                                lovprefix = self._determine_law_from_context(ref)
+                                normalized = f"{lovprefix} § {para_match.group(1).strip()}"
+                                if stk_match:
+                                    normalized += f", stk. {stk_match.group(1)}"
+                        
+                        # Opret nyt reference-objekt med normaliseret tekst
+                        normalized_refs.append({
+                            "ref": normalized,
+                            "is_primary": ref_obj.get("is_primary", False)
+                        })
+                else:
+                    # Ustrukturerede referencer
+                    for ref in metadata["law_references"]:
+                        normalized = ref
+                        
+                        ref_lower = ref.lower()
+                        for lovnavn_lower, abbr in self._law_names_lower:
+                            if lovnavn_lower in ref_lower:
+                                para_match = _RE_PARAGRAPH_NUM.search(ref)
+                                stk_match = _RE_STK_NUM.search(ref)
                                 
                                 if para_match:
-                                    lovprefix = self._determine_law_from_context(ref)
-                                    normalized = f"{lovprefix} § {para_match.group(1).strip()}"
+                                    normalized = f"{abbr} § {para_match.group(1).strip()}"
                                     if stk_match:
                                         normalized += f", stk. {stk_match.group(1)}"
+                                    break
+                        
+                        if normalized == ref and ref.startswith("§"):
+                            para_match = _RE_PARAGRAPH_NUM.search(ref)
+                            stk_match = _RE_STK_NUM.search(ref)
                             
-                            normalized_refs.append(normalized)
-                
-                metadata["normalized_law_references"] = normalized_refs
-        
-        return chunks
+                            if para_match:
+                                lovprefix = self._determine_law_from_context(ref)
+                                normalized = f"{lovprefix} § {para_match.group(1).strip()}"
+                                if stk_match:
+                                    normalized += f", stk. {stk_match.group(1)}"
+                        
+                        normalized_refs.append(normalized)
+            
+            metadata["normalized_law_references"] = normalized_refs
 
-    def _normalize_case_references(self, chunks):
-        """Normaliserer domsreferencer til standardformat"""
-        for chunk in chunks:
-            metadata = chunk["metadata"]
-            if "case_references" in metadata:
-                normalized_refs = []
+    def _normalize_chunk_case_references(self, chunk):
+        """Normaliserer et chunks domsreferencer til standardformat"""
+        metadata = chunk["metadata"]
+        if "case_references" in metadata:
+            normalized_refs = []
+            
+            for ref in metadata["case_references"]:
+                normalized = ref
                 
-                for ref in metadata["case_references"]:
-                    normalized = ref
-                    
-                    # Normalisér danske domsreferencer til standardformat
-                    # Højesteretsdomme (U/UfR)
-                    u_match = re.search(r'U[fF]?R?\s*(\d{4})[.,]\s*(\d+)(?:\s*([A-ZØ]+))?', ref)
-                    if u_match:
-                        if u_match.group(3):
-                            normalized = f"U.{u_match.group(1)}.{u_match.group(2)}.{u_match.group(3)}"
-                        else:
-                            normalized = f"U.{u_match.group(1)}.{u_match.group(2)}"
-                    
-                    # Skattesager (SKM)
-                    skm_match = re.search(r'SKM[-\s]*(\d{4})[.,]\s*(\d+)[.,]?\s*([A-Z]+)?', ref)
-                    if skm_match:
-                        if skm_match.group(3):
-                            normalized = f"SKM.{skm_match.group(1)}.{skm_match.group(2)}.{skm_match.group(3)}"
-                        else:
-                            normalized = f"SKM.{skm_match.group(1)}.{skm_match.group(2)}"
-                    
-                    # Landsskatteretsafgørelser (LSR)
-                    lsr_match = re.search(r'LSR\s*[-\s]*(\d{4})[.,]\s*(\d+)', ref)
-                    if lsr_match:
-                        normalized = f"LSR.{lsr_match.group(1)}.{lsr_match.group(2)}"
-                    
-                    # Tidsskrift for Skatter og Afgifter (TfS)
-                    tfs_match = re.search(r'TfS\s*(\d{4})[.,]\s*(\d+)(?:\s*([A-ZØ]+))?', ref)
-                    if tfs_match:
-                        if tfs_match.group(3):
-                            normalized = f"TfS.{tfs_match.group(1)}.{tfs_match.group(2)}.{tfs_match.group(3)}"
-                        else:
-                            normalized = f"TfS.{tfs_match.group(1)}.{tfs_match.group(2)}"
-                    
-                    normalized_refs.append(normalized)
+                # Normalisér danske domsreferencer til standardformat
+                # Højesteretsdomme (U/UfR)
+                u_match = _RE_CASE_U.search(ref)
+                if u_match:
+                    if u_match.group(3):
+                        normalized = f"U.{u_match.group(1)}.{u_match.group(2)}.{u_match.group(3)}"
+                    else:
+                        normalized = f"U.{u_match.group(1)}.{u_match.group(2)}"
                 
-                metadata["normalized_case_references"] = normalized_refs
-        
-        return chunks
+                # Skattesager (SKM)
+                skm_match = _RE_CASE_SKM.search(ref)
+                if skm_match:
+                    if skm_match.group(3):
+                        normalized = f"SKM.{skm_match.group(1)}.{skm_match.group(2)}.{skm_match.group(3)}"
+                    else:
+                        normalized = f"SKM.{skm_match.group(1)}.{skm_match.group(2)}"
+                
+                # Landsskatteretsafgørelser (LSR)
+                lsr_match = _RE_CASE_LSR.search(ref)
+                if lsr_match:
+                    normalized = f"LSR.{lsr_match.group(1)}.{lsr_match.group(2)}"
+                
+                # Tidsskrift for Skatter og Afgifter (TfS)
+                tfs_match = _RE_CASE_TFS.search(ref)
+                if tfs_match:
+                    if tfs_match.group(3):
+                        normalized = f"TfS.{tfs_match.group(1)}.{tfs_match.group(2)}.{tfs_match.group(3)}"
+                    else:
+                        normalized = f"TfS.{tfs_match.group(1)}.{tfs_match.group(2)}"
+                
+                normalized_refs.append(normalized)
+            
+            metadata["normalized_case_references"] = normalized_refs
 
     def _add_cross_references(self, chunks):
         """Tilføjer krydsreferencer mellem chunks med vægtede relationer"""
@@ -2271,71 +2727,55 @@ class Indexer(BaseIndexer):
         # Default
         return "related"
 
-    def _add_legal_status(self, chunks):
-        """Tilføjer juridisk status til chunks"""
-        for chunk in chunks:
-            content = chunk["content"].lower()
-            metadata = chunk["metadata"]
+    def _add_chunk_legal_status(self, chunk):
+        """Tilføjer juridisk status til et chunk"""
+        content = chunk["content"].lower()
+        metadata = chunk["metadata"]
+        
+        # Bestemmelse af juridisk status
+        if _RE_STATUS_REPEALED.search(content):
+            metadata["legal_status"] = "ophævet"
+        elif _RE_STATUS_TEMPORARY.search(content):
+            metadata["legal_status"] = "midlertidig"
             
-            # Bestemmelse af juridisk status
-            if re.search(r'\b(?:ophævet|bortfaldet|udgået|ikke længere gældende)\b', content):
-                metadata["legal_status"] = "ophævet"
-            elif re.search(r'\b(?:midlertidig|tidsbegrænset|gælder indtil|ophører den)\b', content):
-                metadata["legal_status"] = "midlertidig"
-                
-                # Forsøg at finde udløbsdato
-                date_match = re.search(r'(?:indtil|til|ophører|udløber)\s+(?:den)?\s+(\d{1,2}\.?\s+\w+\s+\d{4}|\d{2}/\d{2}/\d{4}|\d{4}-\d{2}-\d{2})', content)
-                if date_match:
-                    metadata["expiry_date"] = date_match.group(1)
-            else:
-                metadata["legal_status"] = "gældende"
-                
-            # Noter som er knyttet til specifik lovgivning kan have mere specifik status
-            if metadata.get("chunk_type") == "note" and metadata.get("law_references", []):
-                # Undersøg om noten refererer til ophævet lovgivning
-                if any("ophævet" in str(ref).lower() for ref in metadata["law_references"]):
-                    metadata["legal_status"] = "historisk"
-        
-        return chunks
+            # Forsøg at finde udløbsdato
+            date_match = _RE_EXPIRY_DATE.search(content)
+            if date_match:
+                metadata["expiry_date"] = date_match.group(1)
+        else:
+            metadata["legal_status"] = "gældende"
+            
+        # Noter som er knyttet til specifik lovgivning kan have mere specifik status
+        if metadata.get("chunk_type") == "note" and metadata.get("law_references", []):
+            # Undersøg om noten refererer til ophævet lovgivning
+            if any("ophævet" in str(ref).lower() for ref in metadata["law_references"]):
+                metadata["legal_status"] = "historisk"
 
-    def _ensure_complete_metadata(self, chunks):
-        """Sikrer at alle chunks har komplette metadata"""
-        required_fields = [
-            "doc_id", "doc_type", "version_date", "section", 
-            "section_title", "chunk_type", "is_example", "concepts",
-            "law_references", "case_references", "complexity", "authority",
-            "affected_groups", "legal_exceptions", "question_types"
-        ]
-        
-        list_fields = ["concepts", "law_references", "case_references", "affected_groups", 
-                      "legal_exceptions", "question_types"]
+    def _ensure_complete_chunk_metadata(self, chunk):
+        """Sikrer at et chunk har komplette metadata"""
+        # Sikre at metadata findes
+        if "metadata" not in chunk:
+            chunk["metadata"] = {}
+        
+        # Tilføj manglende felter
+        for field in _REQUIRED_METADATA_FIELDS:
+            if field not in chunk["metadata"]:
+                if field in _LIST_METADATA_FIELDS:
+                    chunk["metadata"][field] = []
+                else:
+                    chunk["metadata"][field] = ""
         
-        for chunk in chunks:
-            # Sikre at metadata findes
-            if "metadata" not in chunk:
-                chunk["metadata"] = {}
-            
-            # Tilføj manglende felter
-            for field in required_fields:
-                if field not in chunk["metadata"]:
-                    if field in list_fields:
-                        chunk["metadata"][field] = []
-                    else:
-                        chunk["metadata"][field] = ""
-            
-            # Tilføj retrievability score hvis den mangler
-            if "retrievability" not in chunk["metadata"]:
-                chunk_type = chunk["metadata"].get("chunk_type", "text")
-                chunk["metadata"]["retrievability"] = self._calculate_retrievability_enhanced(
-                    chunk["content"], 
-                    chunk_type, 
-                    chunk["metadata"].get("law_references", []), 
-                    chunk["metadata"].get("case_references", []),
-                    chunk["metadata"].get("concepts", [])
-                )
-            
-            # Sikr at legal_status findes
-            if "legal_status" not in chunk["metadata"]:
-                chunk["metadata"]["legal_status"] = "gældende"
+        # Tilføj retrievability score hvis den mangler
+        if "retrievability" not in chunk["metadata"]:
+            chunk_type = chunk["metadata"].get("chunk_type", "text")
+            chunk["metadata"]["retrievability"] = self._calculate_retrievability_enhanced(
+                chunk["content"], 
+                chunk_type, 
+                chunk["metadata"].get("law_references", []), 
+                chunk["metadata"].get("case_references", []),
+                chunk["metadata"].get("concepts", [])
+            )
         
-        return chunks
\ No newline at end of file
+        # Sikr at legal_status findes
+        if "legal_status" not in chunk["metadata"]:
+            chunk["metadata"]["legal_status"] = "gældende"
\ No newline at end of file
@@ -1,12 +1,17 @@
 # indexers/lovtekst_indexer.py
 import re
+import string
 import streamlit as st
-import json
-from .base_indexer import BaseIndexer
+from .base_indexer import BaseIndexer, load_prompt
 from utils import api_utils, text_analysis, validation, pdf_utils, indexing
 from utils.optimization import cached_call_gpt4o, process_segments_parallel, optimize_chunks
 
 class Indexer(BaseIndexer):
+    # Promptskabelonerne ligger i indexers/prompts og indlæses én gang ved import.
+    # Indekseringsprompten er en string.Template, så kun de dynamiske felter udfyldes pr. segment.
+    CONTEXT_PROMPT = load_prompt("lovtekst_context")
+    INDEXING_PROMPT = string.Template(load_prompt("lovtekst_indexing"))
+    
     def __init__(self):
         super().__init__()
         self.name = "Lovtekst-indekserer"
@@ -47,15 +52,13 @@ class Indexer(BaseIndexer):
         Processer lovtekst-dokument med indeksering
         """
         # 1. Preprocessering
-        processed_text, text_sections = pdf_utils.preprocess_legal_text(text)
-        st.session_state.original_text_sections = text_sections
-        st.session_state.original_text = text
+        # Sektionsudsnittene bruges ikke videre, så de gemmes ikke i session state
+        processed_text, _ = pdf_utils.preprocess_legal_text(text)
         
         # 2. Segmentering
         segments, preserved_content, segment_stats = text_analysis.segment_text_for_processing(
             processed_text, max_segment_length=options.get("max_text_length", 30000)
         )
-        st.session_state.preserved_content = preserved_content
         processing_stats = segment_stats
         
         # Hent doc_type_key fra options
@@ -70,7 +73,8 @@ class Indexer(BaseIndexer):
             
             context_summary = cached_call_gpt4o(
                 context_prompt_with_text,
-                model=options.get("model", "gpt-4o")
+                model=options.get("model", "gpt-4o"),
+                prompt_cache_key=f"lovtekst-context-{doc_type_key}"
             )
             if not context_summary:
                 st.error("Kunne ikke generere kontekstopsummering. Prøv igen.")
@@ -91,95 +95,19 @@ class Indexer(BaseIndexer):
         if chunks:
             chunks = optimize_chunks(chunks)
         
+        # Session state skrives først når dokumentet er færdigbehandlet, ikke midt i beregningen
+        st.session_state.preserved_content = preserved_content
+        
         return chunks, context_summary
     
     def get_context_prompt_template(self, doc_type_key):
         """Henter kontekstprompt skabelonen baseret på dokumenttype."""
-        return """
-        Du er en ekspert i dansk skatteret. Analyser denne lovtekst og opbyg en forståelse af dens struktur og indhold.
-        
-        RETURNER DIN SVAR SOM JSON.
-        
-        Returner en JSON-opsummering med:
-        - Dokumentets struktur (paragraffer og stykker)
-        - Hovedtemaer og nøglebegreber i dokumentet
-        - Juridiske undtagelser og specialtilfælde
-        - Noter og fortolkningsbidrag hvis de findes
-        
-        Format:
-        {
-          "document_id": "unik_id_for_dokumentet",
-          "document_type": "lovtekst", 
-          "version_date": "YYYY-MM-DD",
-          "summary": {
-            "main_themes": ["tema1", "tema2"],
-            "key_concepts": ["nøgleord1", "nøgleord2"],
-            "document_structure": {
-              "§ 1": ["Stk. 1", "Stk. 2"],
-              "§ 2": ["Stk. 1"]
-            },
-            "section_titles": {"§ 1": "Titel for paragraf 1"},
-            "notes_overview": {
-              "794": {
-                "text": "Første del af noten...",
-                "references": ["§ 33 A"],
-                "key_legal_exceptions": ["Undtagelsesregel 1"]
-              }
-            },
-            "legal_exceptions": [
-              {
-                "rule": "Hovedregel",
-                "exception": "Undtagelse",
-                "source": "§ X, Stk. Y"
-              }
-            ]
-          }
-        }
-        """
+        return self.CONTEXT_PROMPT
     
     def get_indexing_prompt_template(self, doc_type_key, context_summary, doc_id, section_number):
         """Henter indekseringsprompt skabelonen baseret på dokumenttype."""
-        return f"""
-        Du er en ekspert i dansk skatteret der skal indeksere lovtekst.
-        Din opgave er at opdele denne tekst i chunks. Hvert chunk skal være en logisk indholdsdel.
-        
-        Du har fået denne kontekst:
-        {json.dumps(context_summary, ensure_ascii=False)}
-        
-        Jeg viser dig nu sektion {section_number} af dokumentet, som du skal opdele i chunks.
-        
-        Du SKAL følge disse regler:
-        1. BEVAR DEN KOMPLETTE, UÆNDREDE tekst i hvert chunk. Lav ALDRIG opsummeringer eller parafraseringer.
-        2. Opdel teksten logisk ved paragraffer eller naturlige brudpunkter.
-        3. Opdel ALDRIG midt i en sætning.
-        4. Chunks må ikke være for lange eller korte. Aim for hele logiske afsnit.
-        5. Du SKAL returnere resultatet som et JSON-objekt med en top-level ARRAY kaldet "chunks".
-        
-        VIGTIGT: Returneringsformatet SKAL være nøjagtigt dette:
-        {{
-          "chunks": [
-            {{
-              "content": "NØJAGTIG tekst fra kilden uden ændringer",
-              "metadata": {{
-                "doc_id": "{doc_id}",
-                "paragraph": "§ X",
-                "stykke": "Stk. Y",
-                "concepts": ["nøgleord1", "nøgleord2", "nøgleord3"],
-                "law_references": ["Ligningslovens § 33 A, stk. 1"],
-                "is_note": false,
-                "note_number": "",
-                "theme": "tema",
-                "subtheme": "undertema",
-                "status": "gældende",
-                "affected_groups": []
-              }}
-            }},
-            {{
-              "content": "NØJAGTIG tekst fra anden chunk",
-              "metadata": {{ ... }}
-            }}
-          ]
-        }}
-        
-        RETURNER DIN SVAR SOM JSON med strukturen som er angivet ovenfor. Det er meget vigtigt at der er en "chunks" array på øverste niveau.
-        """
\ No newline at end of file
+        return self.INDEXING_PROMPT.substitute(
+            context_json=self._context_json(context_summary),
+            doc_id=doc_id,
+            section_number=section_number
+        )
\ No newline at end of file
@@ -1,12 +1,18 @@
 # indexers/vejledning_indexer.py
 import re
+import string
 import streamlit as st
-import json
-from .base_indexer import BaseIndexer
+from .base_indexer import BaseIndexer, load_prompt
 from utils import api_utils, text_analysis, validation, pdf_utils, indexing
 from utils.optimization import cached_call_gpt4o, process_segments_parallel
 
 class Indexer(BaseIndexer):
+    # Promptskabelonerne ligger i indexers/prompts og indlæses én gang ved import.
+    # Indekseringsprompten er en string.Template, så kun de dynamiske felter udfyldes pr. segment.
+    CONTEXT_PROMPT_JV = load_prompt("vejledning_jv_context")
+    CONTEXT_PROMPT_DEFAULT = load_prompt("vejledning_default_context")
+    INDEXING_PROMPT = string.Template(load_prompt("vejledning_indexing"))
+    
     def __init__(self):
         super().__init__()
         self.name = "Vejlednings-indekserer"
@@ -80,7 +86,8 @@ class Indexer(BaseIndexer):
             
             context_summary = cached_call_gpt4o(
                 context_prompt_with_text,
-                model=options.get("model", "gpt-4o")
+                model=options.get("model", "gpt-4o"),
+                prompt_cache_key=f"vejledning-context-{vejledning_type}"
             )
             if not context_summary:
                 st.error("Kunne ikke generere vejledningsanalyse. Prøv igen.")
@@ -170,141 +177,17 @@ class Indexer(BaseIndexer):
     def get_context_prompt_template(self, vejledning_type):
         """Bygger en kontekst-prompt skabelon specifikt til vejledninger"""
         if vejledning_type == "den_juridiske_vejledning":
-            return """
-            Du er en ekspert i dansk skatteret, særligt Den Juridiske Vejledning. 
-            Læs hele teksten og opbyg en forståelse af vejledningens struktur, temaer og relationer.
-            
-            RETURNER DIN SVAR SOM JSON.
-            
-            Returner en JSON-opsummering med:
-            - Vejledningens hovedafsnit og underafsnit (identificeret ved nummerering som A.1.2)
-            - Centrale temaer der behandles i vejledningen
-            - Lovhenvisninger og referencer til paragraf/stykker i skattelovgivningen
-            - Referencer til afgørelser og domme (SKM, TfS, mv.)
-            - Eksempler og deres formål
-            - Fortolkningsbidrag til lovgivningen
-            - Administrativ praksis beskrevet i vejledningen
-            
-            Format:
-            {
-              "document_id": "unik_id_for_dokumentet",
-              "document_type": "juridisk_vejledning", 
-              "version_date": "YYYY-MM-DD",
-              "summary": {
-                "main_sections": ["A.1", "A.2"],
-                "section_hierarchy": {"A.1": ["A.1.1", "A.1.2"]},
-                "section_titles": {"A.1": "Titel for sektion A.1"},
-                "key_concepts": ["nøgleord1", "nøgleord2"],
-                "law_references": {
-                  "§ 33 A": ["A.1.1", "A.2.3"],
-                  "Kildeskattelovens § 1": ["A.3.2"]
-                },
-                "examples": {
-                  "1": {
-                    "location": "A.1.2",
-                    "describes": "Eksempel på grænsegænger-situation",
-                    "law_reference": "§ 33 A, stk. 1"
-                  }
-                },
-                "case_references": {
-                  "SKM.2019.123": {
-                    "location": "A.2.1",
-                    "relevance": "Etablerer praksis for..."
-                  }
-                },
-                "administrative_practice": [
-                  {
-                    "theme": "Grænsegængere",
-                    "sections": ["A.1.3"],
-                    "description": "Administration af reglerne for grænsegængere"
-                  }
-                ]
-              }
-            }
-            """
-        else:
-            # Default vejlednings-prompt for andre typer
-            return """
-            Du er en ekspert i dansk skatteret. Læs denne vejledning og opbyg en forståelse af dens struktur og indhold.
-            
-            RETURNER DIN SVAR SOM JSON.
-            
-            Returner en JSON-opsummering med:
-            - Vejledningens hovedpunkter og underpunkter
-            - Centrale temaer der behandles
-            - Lovhenvisninger og referencer
-            - Eksempler og deres formål
-            
-            Format:
-            {
-              "document_id": "unik_id_for_dokumentet",
-              "document_type": "vejledning", 
-              "version_date": "YYYY-MM-DD",
-              "summary": {
-                "main_sections": ["1", "2", "3"],
-                "section_hierarchy": {"1": ["1.1", "1.2"]},
-                "key_concepts": ["nøgleord1", "nøgleord2"],
-                "law_references": {"§ 33 A": ["sektion 1.1"]},
-                "examples": {"1": {"location": "sektion 1.2", "describes": "Eksempel på..."}}
-              }
-            }
-            """
+            return self.CONTEXT_PROMPT_JV
+        # Default vejlednings-prompt for andre typer
+        return self.CONTEXT_PROMPT_DEFAULT
     
     def get_indexing_prompt_template(self, vejledning_type, context_summary, doc_id, section_number):
         """Bygger en indekseringsprompt for vejledninger"""
-        return f"""
-        Du er en ekspert i dansk skatteret der skal indeksere skatteretlige vejledninger. 
-        Du har fået denne kontekst: {json.dumps(context_summary, ensure_ascii=False)}.
-        
-        Dette er sektion {section_number} af dokumentet. Din opgave er at opdele denne sektion i semantisk meningsfulde chunks.
-        
-        Opdel teksten i semantisk meningsfulde chunks baseret på vejledningens struktur (punkter og underpunkter).
-        CHUNK ALDRIG MIDT I EN SÆTNING. 
-        
-        VIGTIGSTE REGEL: Bevar den KOMPLETTE, UÆNDREDE tekst fra kilden. Lav ALDRIG opsummeringer eller parafraseringer.
-        
-        RETURNER DIN SVAR SOM JSON.
-        
-        Tildel følgende metadata til hvert chunk:
-        1. Dokument-ID: "{doc_id}"
-        2. Afsnitsnummer (f.eks. "A.1.2" eller "3.4")
-        3. Afsnitstitel hvis den findes
-        4. Nøgleord (maks 5 pr. chunk)
-        5. Lovhenvisninger (hvilke paragraffer og stykker fortolkes)
-        6. Er dette et eksempel? (true/false)
-        7. Referencer til domme/afgørelser
-        8. Normaliserede referencer (fx "SKM2006635SKAT" → "SKM.2006.635")
-        9. Tema og undertema
-        10. Chunk-type (indledning, definition, beskrivelse, eksempel, praksis)
-        11. Administrativ praksis (beskrivelse af praksis hvis relevant)
-        12. Målgruppe (hvem er vejledningen rettet mod)
-        13. Kompleksitetsgrad (simpel, moderat, kompleks)
-        
-        Returner JSON:
-        {{
-          "chunks": [
-            {{
-              "content": "NØJAGTIG tekst fra kilden uden ændringer",
-              "metadata": {{
-                "doc_id": "{doc_id}",
-                "section": "A.1.2",
-                "section_title": "Titel på afsnittet",
-                "concepts": ["nøgleord1", "nøgleord2", "nøgleord3", "nøgleord4", "nøgleord5"],
-                "law_references": ["Ligningslovens § 33 A, stk. 1", "Kildeskattelovens § 1"],
-                "is_example": false,
-                "case_references": ["SKM.2019.123", "TfS.2018.456"],
-                "normalized_references": ["SKM.2019.123", "TfS.2018.456"],
-                "theme": "tema",
-                "subtheme": "undertema",
-                "chunk_type": "beskrivelse/eksempel/praksis",
-                "administrative_practice": "beskrivelse af praksis eller null",
-                "target_audience": ["skatteydere", "virksomheder", "rådgivere"],
-                "complexity": "simpel/moderat/kompleks"
-              }}
-            }}
-          ]
-        }}
-        """
+        return self.INDEXING_PROMPT.substitute(
+            context_json=self._context_json(context_summary),
+            doc_id=doc_id,
+            section_number=section_number
+        )
     
     def _extract_examples_and_references(self, chunks):
         """Udtrækker eksempler og lovhenvisninger fra chunks"""
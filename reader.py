@@ -1,6 +1,6 @@
 # reader.py - opdateret version
 import streamlit as st
-import json
+import orjson
 import os
 import numpy as np
 import time
@@ -356,8 +356,8 @@ def upload_json_page():
     
     if uploaded_file and st.button("Indlæs JSON"):
         try:
-            content = uploaded_file.read().decode("utf-8")
-            json_data = json.loads(content)
+            # orjson læser UTF-8 bytes direkte uden et mellemtrin som str
+            json_data = orjson.loads(uploaded_file.read())
             if isinstance(json_data, dict) and "chunks" in json_data:
                 st.session_state.chunks = json_data["chunks"]
             elif isinstance(json_data, list):
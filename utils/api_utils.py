@@ -1,20 +1,172 @@
 import os
 import json
+import orjson
 import time
-from openai import OpenAI
+import asyncio
+import threading
+import httpx
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
 import streamlit as st
 
+try:
+    import h2  # noqa: F401  HTTP/2-understøttelse i httpx (pip install httpx[http2])
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Fejl hvor et nyt forsøg efter en pause typisk lykkes (429, 5xx, timeouts og afbrudte forbindelser)
+TRANSIENT_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+def _is_transient_error(e):
+    return isinstance(e, TRANSIENT_ERRORS) or "rate_limit_exceeded" in str(e)
+
+class TokenBucket:
+    """
+    Token-bucket der styrer tempoet af API-kald efter OpenAI's rate limits.
+    
+    Grænserne opdateres løbende fra x-ratelimit-headers i API-svarene, så der
+    kun ventes når budgettet for tokens eller requests faktisk er brugt op.
+    """
+    
+    def __init__(self, tpm_limit=30000, rpm_limit=500):
+        self.tpm_limit = tpm_limit
+        self.rpm_limit = rpm_limit
+        self.tokens = float(tpm_limit)
+        self.requests = float(rpm_limit)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_refill
+        self.tokens = min(self.tpm_limit, self.tokens + elapsed * self.tpm_limit / 60.0)
+        self.requests = min(self.rpm_limit, self.requests + elapsed * self.rpm_limit / 60.0)
+        self.last_refill = now
+    
+    def _wait_time(self, needed_tokens):
+        needed_tokens = min(needed_tokens, self.tpm_limit)
+        token_wait = (needed_tokens - self.tokens) * 60.0 / self.tpm_limit
+        request_wait = (1 - self.requests) * 60.0 / self.rpm_limit
+        return max(0.0, token_wait, request_wait)
+    
+    def _try_acquire(self, needed_tokens):
+        """Trækker kaldet fra budgettet hvis der er plads. Returnerer ellers ventetiden."""
+        with self.lock:
+            self._refill()
+            wait = self._wait_time(needed_tokens)
+            if wait <= 0:
+                self.tokens -= needed_tokens
+                self.requests -= 1
+            return wait
+    
+    def acquire(self, needed_tokens):
+        """Blokerer indtil der er plads til kaldet og trækker det fra budgettet."""
+        while True:
+            wait = self._try_acquire(needed_tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+    
+    async def acquire_async(self, needed_tokens):
+        """Som acquire, men venter uden at blokere event-loopet."""
+        while True:
+            wait = self._try_acquire(needed_tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+    
+    def update_from_headers(self, headers):
+        """Synkroniserer budgettet med x-ratelimit-headers fra et API-svar."""
+        def read_int(name):
+            try:
+                return int(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+        
+        limit_tokens = read_int("x-ratelimit-limit-tokens")
+        limit_requests = read_int("x-ratelimit-limit-requests")
+        remaining_tokens = read_int("x-ratelimit-remaining-tokens")
+        remaining_requests = read_int("x-ratelimit-remaining-requests")
+        
+        with self.lock:
+            self._refill()
+            if limit_tokens:
+                self.tpm_limit = limit_tokens
+            if limit_requests:
+                self.rpm_limit = limit_requests
+            if remaining_tokens is not None:
+                self.tokens = float(remaining_tokens)
+            if remaining_requests is not None:
+                self.requests = float(remaining_requests)
+
+# Fælles bucket for alle chat-kald i processen
+token_bucket = TokenBucket()
+
 @st.cache_resource
 def get_openai_client():
     """Henter OpenAI-klienten baseret på miljøvariabel eller Streamlit secrets."""
+    return OpenAI(api_key=get_api_key())
+
+def get_api_key():
+    """Henter API-nøglen fra miljøvariabel eller Streamlit secrets."""
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key:
         api_key = st.secrets.get("OPENAI_API_KEY", None)
         if not api_key:
             raise ValueError("OPENAI_API_KEY ikke fundet i miljøvariablerne eller Streamlit secrets")
-    return OpenAI(api_key=api_key)
+    return api_key
+
+def make_async_openai_client(max_connections=64):
+    """
+    Opretter en asynkron OpenAI-klient med en fælles forbindelsespulje.
+    
+    Klienten er bundet til det event-loop den bruges i, så den oprettes pr. kørsel
+    og bør lukkes med 'async with'.
+    """
+    # Med HTTP/2 deler samtidige kald få forbindelser i stedet for én TLS-forbindelse pr. kald
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections // 2),
+        timeout=httpx.Timeout(600.0, connect=10.0),
+        http2=HTTP2_AVAILABLE
+    )
+    return AsyncOpenAI(api_key=get_api_key(), http_client=http_client)
+
+def _cache_body(prompt_cache_key):
+    """
+    Ekstra felter til chat-kaldet. prompt_cache_key sendes via extra_body, så det også
+    virker med ældre versioner af openai-pakken. API'et cacher kun præfikser på over 1024 tokens.
+    """
+    return {"prompt_cache_key": prompt_cache_key} if prompt_cache_key else None
+
+def _ensure_json_instruction(prompt):
+    """Tilføjer json-reference i prompten, som API'et kræver i JSON-mode."""
+    # Tjek om json allerede er nævnt i prompten
+    if "json" not in prompt.lower() and "JSON" not in prompt:
+        if "RETURNER DIN SVAR SOM JSON" not in prompt:
+            prompt = prompt + "\n\nRETURNER DIN SVAR SOM JSON."
+    return prompt
+
+def _parse_json_content(content):
+    """Parser et JSON-svar og forsøger en simpel reparation hvis det fejler."""
+    try:
+        return orjson.loads(content)
+    except json.JSONDecodeError as e:
+        st.warning(f"JSON decode fejl: {str(e)}. Forsøger at reparere JSON...")
+        # Simpel reparation af JSON-fejl
+        content = content.strip()
+        if not content.startswith('{'):
+            content = '{' + content.split('{', 1)[1]
+        if not content.endswith('}'):
+            content = content.rsplit('}', 1)[0] + '}'
+        try:
+            return orjson.loads(content)
+        except json.JSONDecodeError as e2:
+            st.error(f"Kunne ikke reparere JSON: {str(e2)}")
+            # Vis starten af indholdet for fejlsøgning
+            st.code(content[:500] + "..." if len(content) > 500 else content)
+            return {"error": "JSON parse error", "content": content}
 
-def call_gpt4o(prompt, model="gpt-4o", json_mode=True, max_retries=3, retry_delay=10):
+def call_gpt4o(prompt, model="gpt-4o", json_mode=True, max_retries=3, retry_delay=10, prompt_cache_key=None):
     """
     Kalder GPT-4o med håndtering af rate limits og fejl.
     
@@ -24,6 +176,7 @@ def call_gpt4o(prompt, model="gpt-4o", json_mode=True, max_retries=3, retry_dela
         json_mode: Om svaret skal være i JSON-format
         max_retries: Maksimalt antal forsøg ved fejl
         retry_delay: Ventetid mellem forsøg (i sekunder)
+        prompt_cache_key: Nøgle der sender kald med samme statiske præfiks til samme prompt-cache
         
     Returns:
         JSON-objekt eller tekst fra modellen
@@ -32,10 +185,7 @@ def call_gpt4o(prompt, model="gpt-4o", json_mode=True, max_retries=3, retry_dela
     
     # Tilføj json-reference i prompten hvis json_mode er aktiveret
     if json_mode:
-        # Tjek om json allerede er nævnt i prompten
-        if "json" not in prompt.lower() and "JSON" not in prompt:
-            if "RETURNER DIN SVAR SOM JSON" not in prompt:
-                prompt = prompt + "\n\nRETURNER DIN SVAR SOM JSON."
+        prompt = _ensure_json_instruction(prompt)
     
     for attempt in range(max_retries):
         try:
@@ -50,12 +200,18 @@ def call_gpt4o(prompt, model="gpt-4o", json_mode=True, max_retries=3, retry_dela
             messages = [{"role": "user", "content": prompt}]
             response_format = {"type": "json_object"} if json_mode else None
             
-            response = client.chat.completions.create(
+            # Vent kun hvis token- eller request-budgettet er opbrugt
+            token_bucket.acquire(estimate_tokens(prompt))
+            
+            raw_response = client.chat.completions.with_raw_response.create(
                 model=model,
                 messages=messages,
                 response_format=response_format,
-                temperature=0.1
+                temperature=0.1,
+                extra_body=_cache_body(prompt_cache_key)
             )
+            token_bucket.update_from_headers(raw_response.headers)
+            response = raw_response.parse()
             
             content = response.choices[0].message.content
             
@@ -63,23 +219,7 @@ def call_gpt4o(prompt, model="gpt-4o", json_mode=True, max_retries=3, retry_dela
             st.info(f"Svar modtaget fra API. Længde: {len(content)} tegn")
             
             if json_mode:
-                try:
-                    return json.loads(content)
-                except json.JSONDecodeError as e:
-                    st.warning(f"JSON decode fejl: {str(e)}. Forsøger at reparere JSON...")
-                    # Simpel reparation af JSON-fejl
-                    content = content.strip()
-                    if not content.startswith('{'):
-                        content = '{' + content.split('{', 1)[1]
-                    if not content.endswith('}'):
-                        content = content.rsplit('}', 1)[0] + '}'
-                    try:
-                        return json.loads(content)
-                    except json.JSONDecodeError as e2:
-                        st.error(f"Kunne ikke reparere JSON: {str(e2)}")
-                        # Vis starten af indholdet for fejlsøgning
-                        st.code(content[:500] + "..." if len(content) > 500 else content)
-                        return {"error": "JSON parse error", "content": content}
+                return _parse_json_content(content)
             
             return content
             
@@ -90,17 +230,75 @@ def call_gpt4o(prompt, model="gpt-4o", json_mode=True, max_retries=3, retry_dela
             if "response_format" in error_message and "json" in error_message:
                 st.warning("Fejl med JSON format. Forsøger igen uden JSON mode...")
                 # Deaktiver json_mode og forsøg igen
-                return call_gpt4o(prompt, model=model, json_mode=False, max_retries=max_retries-1, retry_delay=retry_delay)
+                return call_gpt4o(prompt, model=model, json_mode=False, max_retries=max_retries-1, retry_delay=retry_delay,
+                                  prompt_cache_key=prompt_cache_key)
             
-            # Håndtering af rate limit errors
-            if "rate_limit_exceeded" in error_message and attempt < max_retries - 1:
-                wait_time = retry_delay * (attempt + 1)  # Eksponentiel backoff
-                st.warning(f"Rate limit overskredet. Venter {wait_time} sekunder før næste forsøg...")
+            # Håndtering af rate limit og midlertidige serverfejl
+            if _is_transient_error(e) and attempt < max_retries - 1:
+                wait_time = retry_delay * (2 ** attempt)  # Eksponentiel backoff
+                st.warning(f"Midlertidig fejl fra API'et ({type(e).__name__}). Venter {wait_time} sekunder før næste forsøg...")
                 time.sleep(wait_time)
             else:
                 st.error(f"Fejl ved kald til OpenAI: {e}")
                 return None
 
+async def acall_gpt4o(client, prompt, model="gpt-4o", json_mode=True, max_retries=3, retry_delay=10, prompt_cache_key=None):
+    """
+    Asynkron udgave af call_gpt4o til mange samtidige kald fra ét event-loop.
+    
+    Args:
+        client: AsyncOpenAI-klient fra make_async_openai_client
+        prompt: Teksten der sendes til modellen
+        model: Modelnavn ("gpt-4o" eller "gpt-3.5-turbo")
+        json_mode: Om svaret skal være i JSON-format
+        max_retries: Maksimalt antal forsøg ved fejl
+        retry_delay: Ventetid mellem forsøg (i sekunder)
+        prompt_cache_key: Nøgle der sender kald med samme statiske præfiks til samme prompt-cache
+        
+    Returns:
+        JSON-objekt eller tekst fra modellen
+    """
+    if json_mode:
+        prompt = _ensure_json_instruction(prompt)
+    
+    for attempt in range(max_retries):
+        try:
+            await token_bucket.acquire_async(estimate_tokens(prompt))
+            
+            raw_response = await client.chat.completions.with_raw_response.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                response_format={"type": "json_object"} if json_mode else None,
+                temperature=0.1,
+                extra_body=_cache_body(prompt_cache_key)
+            )
+            token_bucket.update_from_headers(raw_response.headers)
+            content = raw_response.parse().choices[0].message.content
+            
+            if json_mode:
+                return _parse_json_content(content)
+            
+            return content
+            
+        except Exception as e:
+            error_message = str(e)
+            
+            # Særlig håndtering af response_format fejl
+            if "response_format" in error_message and "json" in error_message:
+                st.warning("Fejl med JSON format. Forsøger igen uden JSON mode...")
+                return await acall_gpt4o(client, prompt, model=model, json_mode=False,
+                                         max_retries=max_retries-1, retry_delay=retry_delay,
+                                         prompt_cache_key=prompt_cache_key)
+            
+            # Håndtering af rate limit og midlertidige serverfejl
+            if _is_transient_error(e) and attempt < max_retries - 1:
+                wait_time = retry_delay * (2 ** attempt)  # Eksponentiel backoff
+                st.warning(f"Midlertidig fejl fra API'et ({type(e).__name__}). Venter {wait_time} sekunder før næste forsøg...")
+                await asyncio.sleep(wait_time)
+            else:
+                st.error(f"Fejl ved kald til OpenAI: {e}")
+                return None
+
 def generate_embedding(text, max_retries=3, retry_delay=5):
     """
     Genererer embedding for en tekst med håndtering af rate limits.
@@ -123,8 +321,7 @@ def generate_embedding(text, max_retries=3, retry_delay=5):
             )
             return response.data[0].embedding
         except Exception as e:
-            error_message = str(e)
-            if "rate_limit_exceeded" in error_message and attempt < max_retries - 1:
+            if _is_transient_error(e) and attempt < max_retries - 1:
                 wait_time = retry_delay * (attempt + 1)
                 time.sleep(wait_time)
             else:
@@ -5,13 +5,14 @@ import time
 import re
 from . import api_utils
 
-def build_faiss_index(chunks, batch_size=20):
+def build_faiss_index(chunks, batch_size=20, quantization="none"):
     """
     Bygger et FAISS-indeks fra chunks med batch-behandling af embeddings.
     
     Args:
         chunks: Liste af chunks
         batch_size: Antal chunks at behandle ad gangen
+        quantization: "none" (float32), "sq8" (8-bit skalarkvantisering) eller "pq" (produktkvantisering)
     
     Returns:
         FAISS-indeks og embedding dictionary
@@ -51,13 +52,26 @@ def build_faiss_index(chunks, batch_size=20):
         embedding_dim = len(list(embedding_dict.values())[0]["embedding"])  # 3072 for text-embedding-3-large
         num_chunks = len(embedding_dict)
         
-        # Sæt nlist = 100 for ~10.000 chunks, ellers √n
-        nlist = 100 if 5000 <= num_chunks <= 15000 else int(np.sqrt(num_chunks))
-        if nlist < 1:
-            nlist = 1
+        if num_chunks >= 10000:
+            # Store indekser: flere clusters, og centroiderne findes via HNSW i stedet for fladt
+            nlist = min(4096, 4 * int(np.sqrt(num_chunks)))
+            quantizer = faiss.IndexHNSWFlat(embedding_dim, 32)
+        else:
+            # Sæt nlist = 100 for 5.000-10.000 chunks, ellers √n
+            nlist = 100 if num_chunks >= 5000 else int(np.sqrt(num_chunks))
+            if nlist < 1:
+                nlist = 1
+            quantizer = faiss.IndexFlatL2(embedding_dim)
         
-        quantizer = faiss.IndexFlatL2(embedding_dim)
-        index = faiss.IndexIVFFlat(quantizer, embedding_dim, nlist)
+        if quantization == "pq" and num_chunks >= 256 and embedding_dim % 64 == 0:
+            # 64 delvektorer á 8 bit, dvs. 64 bytes per vektor. Kræver mindst 256 træningsvektorer
+            index = faiss.IndexIVFPQ(quantizer, embedding_dim, nlist, 64, 8)
+        elif quantization in ("sq8", "pq"):
+            if quantization == "pq":
+                st.info("For få chunks til produktkvantisering. Bruger 8-bit skalarkvantisering.")
+            index = faiss.IndexIVFScalarQuantizer(quantizer, embedding_dim, nlist, faiss.ScalarQuantizer.QT_8bit)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, embedding_dim, nlist)
         
         vectors = np.array([data["embedding"] for data in embedding_dict.values()], dtype=np.float32)
         
@@ -94,7 +108,7 @@ def search_faiss_index(query, index, embedding_dict, top_k=10):
     
     # Sæt antal clusters at søge i (nprobe)
     if hasattr(index, 'nprobe'):
-        index.nprobe = min(10, index.ntotal)  # Søg i op til 10 clusters
+        index.nprobe = min(16, index.nlist)  # Søg i op til 16 clusters
     
     distances, indices = index.search(query_vector, top_k)
     
@@ -1,56 +1,86 @@
 import os
-import json
+import copy
+import orjson
 import hashlib
 import time
+import diskcache
+import asyncio
+import threading
+import itertools
+import multiprocessing
 import streamlit as st
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
 import re
 
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:  # Ældre Streamlit-versioner
+    add_script_run_ctx = get_script_run_ctx = None
+
 def ensure_cache_directory(cache_dir="cache"):
     """Sikrer at cache-mappen eksisterer."""
     if not os.path.exists(cache_dir):
         os.makedirs(cache_dir)
     return cache_dir
 
-def cached_call_gpt4o(prompt, model="gpt-4o", json_mode=True, cache_dir="cache"):
+# Svar gemmes i 30 dage; diskcache rydder selv op når size_limit nås.
+# LLM_CACHE_DIR flytter cachen, f.eks. til en mappe der deles mellem flere checkouts.
+GPT_CACHE_DIR = os.environ.get("LLM_CACHE_DIR", "cache")
+GPT_CACHE_EXPIRE = 30 * 24 * 3600
+_gpt_caches = {}
+
+def get_gpt_cache(cache_dir=GPT_CACHE_DIR):
+    """Returnerer den persistente diskcache for API-svar i cache_dir."""
+    cache = _gpt_caches.get(cache_dir)
+    if cache is None:
+        cache = diskcache.Cache(ensure_cache_directory(cache_dir), size_limit=2 * 2**30)
+        _gpt_caches[cache_dir] = cache
+    return cache
+
+def gpt_cache_key(prompt, model, json_mode):
+    """Generér en unik nøgle baseret på hele prompten, model og json_mode."""
+    hash_input = f"{model}|{json_mode}|{prompt}".encode('utf-8')
+    return hashlib.blake2b(hash_input, digest_size=16).hexdigest()
+
+def cached_call_gpt4o(prompt, model="gpt-4o", json_mode=True, cache_dir=GPT_CACHE_DIR, prompt_cache_key=None):
     """
     Kalder GPT-4o med caching for at undgå gentagne API-kald.
     
+    Cachen ligger på disk (SQLite via diskcache), så den overlever genstart af
+    Streamlit og deles mellem processer.
+    
     Args:
         prompt: Teksten der sendes til modellen
         model: Modelnavn ("gpt-4o" eller "gpt-3.5-turbo")
         json_mode: Om svaret skal være i JSON-format
-        cache_dir: Mappe til at gemme cache-filer
+        cache_dir: Mappe til at gemme cache-filer (standard: LLM_CACHE_DIR eller 'cache')
+        prompt_cache_key: Videregives til API'ets prompt-caching; indgår ikke i diskcachens nøgle
         
     Returns:
         JSON-objekt eller tekst fra modellen (cachelagret hvis tilgængelig)
     """
     from utils import api_utils  # Importér her for at undgå cirkulære importer
     
-    # Sikr at cache-mappen eksisterer
-    ensure_cache_directory(cache_dir)
-    
-    # Generér en unik nøgle baseret på prompt og model
-    # Brug kun de første 10000 tegn af prompten for store dokumenter
-    hash_input = f"{prompt[:10000]}{model}{json_mode}".encode('utf-8')
-    cache_key = hashlib.md5(hash_input).hexdigest()
-    cache_path = os.path.join(cache_dir, f"{cache_key}.json")
+    cache = get_gpt_cache(cache_dir)
+    cache_key = gpt_cache_key(prompt, model, json_mode)
     
     # Tjek om resultatet allerede er cachet
-    if os.path.exists(cache_path):
-        try:
-            with open(cache_path, "r", encoding="utf-8") as f:
-                st.info("Bruger cachelagret resultat")
-                
-                # Tæl cache hits hvis attributten eksisterer
-                if hasattr(cached_call_gpt4o, 'cache_hits'):
-                    cached_call_gpt4o.cache_hits += 1
-                else:
-                    cached_call_gpt4o.cache_hits = 1
-                    
-                return json.load(f)
-        except Exception as e:
-            st.warning(f"Kunne ikke indlæse cache: {e}")
+    try:
+        cached = cache.get(cache_key)
+    except Exception as e:
+        st.warning(f"Kunne ikke indlæse cache: {e}")
+        cached = None
+    
+    if cached is not None:
+        st.info("Bruger cachelagret resultat")
+        
+        # Tæl cache hits hvis attributten eksisterer
+        if hasattr(cached_call_gpt4o, 'cache_hits'):
+            cached_call_gpt4o.cache_hits += 1
+        else:
+            cached_call_gpt4o.cache_hits = 1
+            
+        return cached
     
     # Hvis ikke cachet, kald API'et
     # Tæl cache misses hvis attributten eksisterer
@@ -59,18 +89,240 @@ def cached_call_gpt4o(prompt, model="gpt-4o", json_mode=True, cache_dir="cache")
     else:
         cached_call_gpt4o.cache_misses = 1
         
-    result = api_utils.call_gpt4o(prompt, model=model, json_mode=json_mode)
+    result = api_utils.call_gpt4o(prompt, model=model, json_mode=json_mode, prompt_cache_key=prompt_cache_key)
     
     # Gem resultatet i cache
     if result:
         try:
-            with open(cache_path, "w", encoding="utf-8") as f:
-                json.dump(result, f, ensure_ascii=False, indent=2)
+            cache.set(cache_key, result, expire=GPT_CACHE_EXPIRE)
         except Exception as e:
             st.warning(f"Kunne ikke gemme cache: {e}")
     
     return result
 
+# Lille trådpulje til netværkskald der skal køre mens scriptet laver andet arbejde
+_background_executor = ThreadPoolExecutor(max_workers=2)
+
+def start_context_call(prompt, model="gpt-4o", prompt_cache_key=None):
+    """
+    Starter kontekstanalysen i baggrunden og returnerer en Future med resultatet.
+    
+    Kaldet venter typisk flere sekunder på netværket. Future'en kan gives direkte til
+    process_segments_parallel, som først venter på den når segmenterne er forberedt.
+    """
+    script_ctx = get_script_run_ctx() if get_script_run_ctx else None
+    
+    def run():
+        # Giv tråden Streamlit-konteksten, så st-kald virker fra baggrundstråden
+        if script_ctx is not None:
+            add_script_run_ctx(threading.current_thread(), script_ctx)
+        return cached_call_gpt4o(prompt, model=model, prompt_cache_key=prompt_cache_key)
+    
+    return _background_executor.submit(run)
+
+def map_in_threads(func, items, max_workers=4, max_pending=None):
+    """
+    Kører func på hvert element i en trådpulje med scriptets Streamlit-kontekst.
+    
+    Beregnet til synkrone, I/O-bundne kald (f.eks. cached_call_gpt4o). Giver (index, future)
+    tilbage i den rækkefølge kaldene bliver færdige, så kalderen kan opdatere fremskridt og
+    håndtere fejl pr. element uden at de øvrige afbrydes.
+    
+    items kan være en generator; der hentes højst max_pending elementer (standard: to pr.
+    tråd) ad gangen, og færdige futures slippes så snart de er givet videre.
+    """
+    script_ctx = get_script_run_ctx() if get_script_run_ctx else None
+    max_workers = max(1, max_workers)
+    max_pending = max_pending or 2 * max_workers
+    
+    def run(item):
+        if script_ctx is not None:
+            add_script_run_ctx(threading.current_thread(), script_ctx)
+        return func(item)
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from _map_bounded(executor, run, items, max_pending)
+
+def map_in_processes(func, items, max_workers=None, initializer=None, initargs=()):
+    """
+    Som map_in_threads, men i en procespulje til CPU-tunge kald, der i tråde ville vente på GIL'en.
+    
+    func skal ligge på modulniveau, og elementer og resultater skal kunne pickles. Fælles tilstand
+    sendes én gang pr. proces via initializer/initargs i stedet for med hvert element. Processerne
+    startes med 'spawn', så de ikke arver låse, forbindelser og åbne caches fra serverens tråde;
+    Streamlit-konteksten følger ikke med.
+    """
+    max_workers = max(1, max_workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=initializer,
+        initargs=initargs
+    ) as executor:
+        yield from _map_bounded(executor, func, items, 2 * max_workers)
+
+def _map_bounded(executor, func, items, max_pending):
+    """Giver (index, future) for func(item) i den rækkefølge de bliver færdige, med højst max_pending i gang"""
+    indexed_items = enumerate(items)
+    pending = {executor.submit(func, item): i for i, item in itertools.islice(indexed_items, max_pending)}
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future
+        # Fyld op med lige så mange nye elementer, som der blev færdige
+        for i, item in itertools.islice(indexed_items, len(done)):
+            pending[executor.submit(func, item)] = i
+
+def segment_template_digest(get_template_func, doc_type_key):
+    """
+    Hash af indekseringspromptens faste tekst for dokumenttypen, så ændringer i skabelonen
+    eller skemaet giver nye cachenøgler i stedet for gamle svar.
+    Skabelonen bygges uden kontekst, dokument-id og segmentnummer, så kun den faste tekst tæller.
+    """
+    template = get_template_func(doc_type_key, None, "", 0) or ""
+    return hashlib.blake2b(template.encode('utf-8'), digest_size=16).hexdigest()
+
+def segment_context_digest(context_summary):
+    """Hash af den kontekstopsummering der indsættes i segmentpromptene (allerede beskåret hvor indekseren gør det)"""
+    context_bytes = orjson.dumps(context_summary, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    return hashlib.blake2b(context_bytes, digest_size=16).hexdigest()
+
+def segment_cache_key(segment, model, doc_type_key, template_digest, context_digest):
+    """
+    Cachenøgle for et segments indekseringssvar, uafhængig af dokument-id og position.
+    
+    Promptskabelonen og kontekstopsummeringen indgår via template_digest og context_digest,
+    da modellen bygger metadata som versionsdato, lovpræfiks og dokumenttypefelter på konteksten.
+    Et cachetræf kommer derfor kun fra en prompt der er identisk bortset fra dokument-id og
+    sektionsnummer, og overfører chunkenes indhold og metadata uændret; kun doc_id,
+    segment_position og segment_count skrives om til det aktuelle dokument.
+    """
+    hash_input = f"segment|{model}|{doc_type_key}|{template_digest}|{context_digest}|{segment}".encode('utf-8')
+    return hashlib.blake2b(hash_input, digest_size=16).hexdigest()
+
+def split_long_segments(segments, max_segment_len=15000):
+    """Deler segmenter der er for lange til ét API-kald op med semantisk forståelse."""
+    processed_segments = []
+    for i, segment in enumerate(segments):
+        if len(segment) > max_segment_len:
+            st.warning(f"Segment {i+1} er for langt ({len(segment)} tegn). Opdeler det i mindre dele.")
+            # Del segmentet op med semantisk forståelse
+            parts = split_segment_semantically(segment, max_segment_len)
+            processed_segments.extend(parts)
+            st.info(f"Segment {i+1} opdelt i {len(parts)} dele.")
+        else:
+            processed_segments.append(segment)
+    
+    st.info(f"Total {len(processed_segments)} segmenter at behandle efter opdeling.")
+    return processed_segments
+
+# Tokenbudget for segmenttekst der samles i ét kald. Holdes lavt nok til at svaret,
+# som gentager hele teksten, kan være i modellens output
+PACK_TOKEN_BUDGET = 6000
+
+def pack_segments(segment_tuples, max_segments, token_budget=PACK_TOKEN_BUDGET):
+    """
+    Samler (segment, index)-par grådigt i pakker på højst max_segments segmenter og
+    token_budget estimerede tokens. Et segment der alene overstiger budgettet får sin egen pakke.
+    """
+    from utils.api_utils import estimate_tokens  # Importér her for at undgå cirkulære importer
+    
+    packs = []
+    pack, pack_tokens = [], 0
+    for segment_info in segment_tuples:
+        tokens = estimate_tokens(segment_info[0])
+        if pack and (len(pack) >= max_segments or pack_tokens + tokens > token_budget):
+            packs.append(pack)
+            pack, pack_tokens = [], 0
+        pack.append(segment_info)
+        pack_tokens += tokens
+    if pack:
+        packs.append(pack)
+    return packs
+
+def build_segment_prompt(get_template_func, doc_type_key, context_summary, doc_id, segment_idx):
+    """Henter indekseringsprompten for et segment (uden selve teksten)."""
+    indexing_prompt = get_template_func(doc_type_key, context_summary, doc_id, segment_idx+1)
+    
+    if not indexing_prompt or len(indexing_prompt) < 10:
+        st.error(f"Ugyldig prompt for segment {segment_idx+1}. Prompt er for kort eller tom.")
+        return None
+    return indexing_prompt
+
+def add_segment_text(indexing_prompt, segment, segment_idx):
+    """Tilføjer segmentets tekst til prompten og sikrer JSON-instruktionen."""
+    indexing_prompt_with_text = indexing_prompt + f"\n\nDokument (del {segment_idx+1}):\n" + segment
+    
+    # Sikr at vi bruger JSON-mode
+    if "RETURNER DIN SVAR SOM JSON" not in indexing_prompt_with_text:
+        indexing_prompt_with_text += "\n\nRETURNER DIN SVAR SOM JSON."
+    return indexing_prompt_with_text
+
+def parse_segment_result(result, segment_idx, segment_count, doc_id):
+    """Normaliserer et API-svar for et segment til {"chunks": [...]}."""
+    if not result:
+        st.error(f"Intet resultat for segment {segment_idx+1}.")
+        return {"chunks": []}
+    
+    # Tjek resultatet
+    if isinstance(result, dict):
+        if "chunks" in result:
+            # Tilføj segment position til hvert chunk for sortering og kontekst
+            for chunk in result["chunks"]:
+                if "metadata" in chunk:
+                    chunk["metadata"]["segment_position"] = segment_idx
+                    chunk["metadata"]["segment_count"] = segment_count
+                    chunk["metadata"]["doc_id"] = doc_id
+            return result
+        else:
+            st.warning(f"Segment {segment_idx+1}: Resultat indeholder ikke 'chunks'. Nøgler: {list(result.keys())}")
+            # Forsøg at tilpasse resultatformatet til forventet format
+            if "content" in result:
+                st.info(f"Segment {segment_idx+1}: Forsøger at udtrække chunks fra 'content'.")
+                try:
+                    # Konverter til JSON igen hvis det er en streng
+                    if isinstance(result["content"], str):
+                        content_json = orjson.loads(result["content"])
+                        if "chunks" in content_json:
+                            return content_json
+                    return {"chunks": [{"content": result["content"], "metadata": {"segment_position": segment_idx}}]}
+                except Exception as e:
+                    st.error(f"Kunne ikke udtrække chunks: {e}")
+            return {"chunks": []}
+    elif isinstance(result, str):
+        st.warning(f"Segment {segment_idx+1}: Resultat er en streng, ikke et JSON-objekt. Forsøger at parse.")
+        try:
+            # Forsøg at udtrække JSON fra strengen
+            if "{" in result and "}" in result:
+                json_str = result[result.find("{"):result.rfind("}")+1]
+                json_obj = orjson.loads(json_str)
+                if "chunks" in json_obj:
+                    # Tilføj segment position
+                    for chunk in json_obj["chunks"]:
+                        if "metadata" in chunk:
+                            chunk["metadata"]["segment_position"] = segment_idx
+                            chunk["metadata"]["segment_count"] = segment_count
+                            chunk["metadata"]["doc_id"] = doc_id
+                    return json_obj
+            return {"chunks": [{"content": result, "metadata": {"segment_position": segment_idx}}]}
+        except Exception as e:
+            st.error(f"Kunne ikke parse JSON fra streng: {e}")
+            return {"chunks": []}
+    
+    # Fallback
+    return {"chunks": []}
+
+def sort_chunks_by_position(chunks):
+    """Sorterer chunks efter segment- og chunkposition hvis metadata indeholder dette."""
+    try:
+        chunks.sort(key=lambda c: (
+            c.get("metadata", {}).get("segment_position", 0),
+            c.get("metadata", {}).get("chunk_position", 0)
+        ))
+    except Exception as e:
+        st.warning(f"Kunne ikke sortere chunks: {e}")
+    return chunks
+
 def process_segments_parallel(segments, doc_type_key, context_summary, doc_id, options, get_template_func=None):
     """
     Behandler segmenter parallelt med begrænset samtidighed og forbedret fejlhåndtering.
@@ -78,7 +330,7 @@ def process_segments_parallel(segments, doc_type_key, context_summary, doc_id, o
     Args:
         segments: Liste af tekstsegmenter
         doc_type_key: Nøgle til dokumenttype
-        context_summary: Kontekstopsummering
+        context_summary: Kontekstopsummering, eller en Future fra start_context_call
         doc_id: Dokument-id
         options: Processeringsindstillinger
         get_template_func: Funktion til at hente indexing prompt template
@@ -93,100 +345,40 @@ def process_segments_parallel(segments, doc_type_key, context_summary, doc_id, o
         st.error("Mangler get_template_func parameter")
         return []
     
-    # Begræns segmentlængde og del op hvis nødvendigt
-    max_segment_len = 15000  # Maksimal sikker segmentlængde
-    processed_segments = []
-    for i, segment in enumerate(segments):
-        if len(segment) > max_segment_len:
-            st.warning(f"Segment {i+1} er for langt ({len(segment)} tegn). Opdeler det i mindre dele.")
-            # Del segmentet op med semantisk forståelse
-            parts = split_segment_semantically(segment, max_segment_len)
-            processed_segments.extend(parts)
-            st.info(f"Segment {i+1} opdelt i {len(parts)} dele.")
-        else:
-            processed_segments.append(segment)
+    segments = split_long_segments(segments)
+    batch_size = max(1, int(options.get("batch_size", 1)))
+    
+    # Alle segmentkald for samme dokumenttype deler promptens statiske præfiks
+    prompt_cache_key = f"indexing-{doc_type_key}"
+    
+    def build_prompt(segment_idx):
+        return build_segment_prompt(get_template_func, doc_type_key, context_summary, doc_id, segment_idx)
     
-    segments = processed_segments
-    st.info(f"Total {len(segments)} segmenter at behandle efter opdeling.")
+    def parse_result(result, segment_idx):
+        return parse_segment_result(result, segment_idx, len(segments), doc_id)
     
-    def process_single_segment(segment_info):
+    async def process_single_segment(client, segment_info):
         segment, segment_idx = segment_info
-        time.sleep(segment_idx * 1.0)  # Længere ventetid mellem kald
         
         try:
-            # Hent indekseringsprompt med den medfølgte funktion
-            if hasattr(get_template_func, '__self__'):  # Det er en objektmetode
-                indexing_prompt = get_template_func(doc_type_key, context_summary, doc_id, segment_idx+1)
-            else:  # Det er en normal funktion
-                indexing_prompt = get_template_func(doc_type_key, context_summary, doc_id, segment_idx+1)
-            
-            if not indexing_prompt or len(indexing_prompt) < 10:
-                st.error(f"Ugyldig prompt for segment {segment_idx+1}. Prompt er for kort eller tom.")
+            indexing_prompt = build_prompt(segment_idx)
+            if indexing_prompt is None:
                 return {"chunks": []}
             
             # Tilføj teksten til prompten
-            indexing_prompt_with_text = indexing_prompt + f"\n\nDokument (del {segment_idx+1}):\n" + segment
-            
-            # Sikr at vi bruger JSON-mode
-            if "RETURNER DIN SVAR SOM JSON" not in indexing_prompt_with_text:
-                indexing_prompt_with_text += "\n\nRETURNER DIN SVAR SOM JSON."
+            indexing_prompt_with_text = add_segment_text(indexing_prompt, segment, segment_idx)
             
             # Direkte kald til API i stedet for cached_call_gpt4o for mere kontrol
-            result = api_utils.call_gpt4o(
+            result = await api_utils.acall_gpt4o(
+                client,
                 indexing_prompt_with_text, 
                 model=options.get("model", "gpt-4o"),
-                json_mode=True
+                json_mode=True,
+                retry_delay=options.get("wait_time", 5),
+                prompt_cache_key=prompt_cache_key
             )
             
-            if not result:
-                st.error(f"Intet resultat for segment {segment_idx+1}.")
-                return {"chunks": []}
-            
-            # Tjek resultatet
-            if isinstance(result, dict):
-                if "chunks" in result:
-                    # Tilføj segment position til hvert chunk for sortering og kontekst
-                    for chunk in result["chunks"]:
-                        if "metadata" in chunk:
-                            chunk["metadata"]["segment_position"] = segment_idx
-                            chunk["metadata"]["segment_count"] = len(segments)
-                    return result
-                else:
-                    st.warning(f"Segment {segment_idx+1}: Resultat indeholder ikke 'chunks'. Nøgler: {list(result.keys())}")
-                    # Forsøg at tilpasse resultatformatet til forventet format
-                    if "content" in result:
-                        st.info(f"Segment {segment_idx+1}: Forsøger at udtrække chunks fra 'content'.")
-                        try:
-                            # Konverter til JSON igen hvis det er en streng
-                            if isinstance(result["content"], str):
-                                content_json = json.loads(result["content"])
-                                if "chunks" in content_json:
-                                    return content_json
-                            return {"chunks": [{"content": result["content"], "metadata": {"segment_position": segment_idx}}]}
-                        except Exception as e:
-                            st.error(f"Kunne ikke udtrække chunks: {e}")
-                    return {"chunks": []}
-            elif isinstance(result, str):
-                st.warning(f"Segment {segment_idx+1}: Resultat er en streng, ikke et JSON-objekt. Forsøger at parse.")
-                try:
-                    # Forsøg at udtrække JSON fra strengen
-                    if "{" in result and "}" in result:
-                        json_str = result[result.find("{"):result.rfind("}")+1]
-                        json_obj = json.loads(json_str)
-                        if "chunks" in json_obj:
-                            # Tilføj segment position
-                            for chunk in json_obj["chunks"]:
-                                if "metadata" in chunk:
-                                    chunk["metadata"]["segment_position"] = segment_idx
-                                    chunk["metadata"]["segment_count"] = len(segments)
-                            return json_obj
-                    return {"chunks": [{"content": result, "metadata": {"segment_position": segment_idx}}]}
-                except Exception as e:
-                    st.error(f"Kunne ikke parse JSON fra streng: {e}")
-                    return {"chunks": []}
-            
-            # Fallback
-            return {"chunks": []}
+            return parse_result(result, segment_idx)
             
         except Exception as e:
             st.error(f"Fejl ved behandling af segment {segment_idx+1}: {str(e)}")
@@ -195,42 +387,397 @@ def process_segments_parallel(segments, doc_type_key, context_summary, doc_id, o
             st.code(traceback.format_exc())
             return {"chunks": []}
     
-    all_chunks = []
-    segment_tuples = [(segment, i) for i, segment in enumerate(segments)]
-    
-    # Bearbejd hvert segment sekventielt for at undgå problemer med rate limits
-    for i, segment_info in enumerate(segment_tuples):
-        progress_pct = (i / len(segment_tuples)) * 100
-        st.write(f"Behandler segment {i+1}/{len(segment_tuples)} ({progress_pct:.1f}%)...")
+    async def process_segment_batch(client, batch):
+        """Sender flere segmenter i ét API-kald og fordeler svaret tilbage efter delnummer."""
+        if len(batch) == 1:
+            return [await process_single_segment(client, batch[0])]
         
-        segment_result = process_single_segment(segment_info)
+        try:
+            indexing_prompt = build_prompt(batch[0][1])
+            if indexing_prompt is None:
+                return [{"chunks": []} for _ in batch]
+            
+            prompt_parts = [
+                indexing_prompt,
+                f"\n\nNedenfor følger {len(batch)} dele af dokumentet. Indekser hver del for sig."
+            ]
+            for segment, segment_idx in batch:
+                prompt_parts.append(f"\n\nDokument (del {segment_idx+1}):\n{segment}")
+            prompt_parts.append(
+                '\n\nRETURNER DIN SVAR SOM JSON på formen {"results": [{"index": <delnummer>, "chunks": [...]}]} '
+                "med ét element per del."
+            )
+            
+            result = await api_utils.acall_gpt4o(
+                client,
+                "".join(prompt_parts),
+                model=options.get("model", "gpt-4o"),
+                json_mode=True,
+                retry_delay=options.get("wait_time", 5),
+                prompt_cache_key=prompt_cache_key
+            )
+            
+            if not isinstance(result, dict) or not isinstance(result.get("results"), list):
+                st.warning("Batch-svaret havde ikke det forventede format. Behandler delene enkeltvis.")
+                return [await process_single_segment(client, segment_info) for segment_info in batch]
+            
+            # Fordel svarene tilbage til segmenterne efter deres index
+            results_by_index = {}
+            for item in result["results"]:
+                if isinstance(item, dict):
+                    try:
+                        results_by_index[int(item.get("index"))] = item
+                    except (TypeError, ValueError):
+                        continue
+            
+            return [parse_result(results_by_index.get(segment_idx+1), segment_idx) for _, segment_idx in batch]
+            
+        except Exception as e:
+            st.error(f"Fejl ved batch-behandling af segmenter: {str(e)}")
+            return [{"chunks": []} for _ in batch]
+    
+    # Konteksten indgår i cachenøglerne, så et igangværende kontekstkald har kørt
+    # sideløbende med opdelingen ovenfor og afventes først her
+    if isinstance(context_summary, Future):
+        context_summary = context_summary.result()
+        if not context_summary:
+            return []
+    
+    # Identiske segmenter (standardtekster, forbehold o.l.) sendes kun til API'et én gang.
+    # Svaret gemmes også i diskcachen under segmentets indholdshash, så en ny kørsel med samme
+    # kontekst (f.eks. genindeksering) kan genbruge det med dokumentets egne metadata.
+    model = options.get("model", "gpt-4o")
+    segment_cache = get_gpt_cache()
+    template_digest = segment_template_digest(get_template_func, doc_type_key)
+    context_digest = segment_context_digest(context_summary)
+    segment_keys = [
+        segment_cache_key(segment, model, doc_type_key, template_digest, context_digest) for segment in segments
+    ]
+    first_idx = {}
+    for i, key in enumerate(segment_keys):
+        first_idx.setdefault(key, i)
+    
+    results = {}
+    segment_tuples = []
+    for key, i in first_idx.items():
+        try:
+            cached_chunks = segment_cache.get(key)
+        except Exception as e:
+            st.warning(f"Kunne ikke indlæse cache: {e}")
+            cached_chunks = None
+        if cached_chunks:
+            results[i] = parse_result({"chunks": copy.deepcopy(cached_chunks)}, i)
+        else:
+            segment_tuples.append((segments[i], i))
+    
+    reused = len(segments) - len(segment_tuples)
+    if reused:
+        st.info(f"{reused} af {len(segments)} segmenter genbruges fra tidligere eller identiske segmenter.")
+    
+    # Korte segmenter samles i samme kald op til tokenbudgettet, så den faste omkostning
+    # ved prompten og kaldet deles mellem dem
+    batches = pack_segments(segment_tuples, batch_size, options.get("pack_token_budget", PACK_TOKEN_BUDGET))
+    
+    # API-kald er I/O-bundne, så alle batches sendes fra ét event-loop over en fælles
+    # forbindelsespulje. Et fast antal workers henter hver den næste batch så snart den
+    # forrige er færdig, så der altid er op til `concurrency` kald undervejs uden at alle
+    # kald oprettes på én gang. Tempoet styres derudover af token-bucket i api_utils.
+    concurrency = max(1, min(int(options.get("concurrency", 4)), len(batches) or 1))
+    
+    def store_batch_results(batch, batch_results):
+        for (segment, i), segment_result in zip(batch, batch_results):
+            results[i] = segment_result
+            if segment_result and segment_result.get("chunks"):
+                try:
+                    segment_cache.set(segment_keys[i], segment_result["chunks"], expire=GPT_CACHE_EXPIRE)
+                except Exception as e:
+                    st.warning(f"Kunne ikke gemme cache: {e}")
+    
+    async def run_batches(progress_bar):
+        pending = iter(batches)
+        done = 0
+        async with api_utils.make_async_openai_client() as client:
+            async def worker():
+                nonlocal done
+                for batch in pending:
+                    # Resultatet gemmes med det samme, så færdige segmenter er cachet selv hvis kørslen afbrydes
+                    store_batch_results(batch, await process_segment_batch(client, batch))
+                    done += 1
+                    progress_bar.progress(done / len(batches))
+            await asyncio.gather(*[worker() for _ in range(concurrency)])
+    
+    if batches:
+        st.info(f"Sender {len(batches)} API-kald med op til {concurrency} samtidige.")
+        # Coroutinerne kører i Streamlit-scriptets egen tråd, så st-kald virker uændret
+        asyncio.run(run_batches(st.progress(0.0)))
+    
+    all_chunks = []
+    for i, key in enumerate(segment_keys):
+        segment_result = results.get(first_idx[key])
+        if segment_result and first_idx[key] != i:
+            # Dubletter får en kopi af det første segments chunks med deres egen position
+            segment_result = parse_result({"chunks": copy.deepcopy(segment_result["chunks"])}, i)
         
         if segment_result and "chunks" in segment_result and segment_result["chunks"]:
             chunk_count = len(segment_result["chunks"])
             all_chunks.extend(segment_result["chunks"])
-            st.success(f"Segment {i+1} behandlet: {chunk_count} chunks genereret")
+            st.success(f"Segment {i+1}/{len(segments)} behandlet: {chunk_count} chunks genereret")
         else:
             st.warning(f"Kunne ikke indeksere segment {i+1}. Fortsætter med næste segment.")
-        
-        # Vent mellem segmenter for at undgå rate limits
-        if i < len(segment_tuples) - 1:
-            wait_time = options.get("wait_time", 5)
-            st.info(f"Venter {wait_time} sekunder før næste segment...")
-            time.sleep(wait_time)
     
     # Vis det samlede resultat
     st.success(f"Behandling fuldført. Genereret {len(all_chunks)} chunks fra {len(segments)} segmenter.")
     
     # Sorter chunks efter position hvis metadata indeholder dette
+    return sort_chunks_by_position(all_chunks)
+
+def run_batch_job(lines, doc_id, poll_interval=30):
+    """
+    Sender JSONL-linjer som ét batch-job og venter på resultatet.
+    
+    Returns:
+        Ordbog fra nummeret i custom_id til det parsede svar; tom hvis jobbet fejler
+    """
+    from utils import api_utils  # Importér her for at undgå cirkulære importer
+    
+    client = api_utils.get_openai_client()
     try:
-        all_chunks.sort(key=lambda c: (
-            c.get("metadata", {}).get("segment_position", 0),
-            c.get("metadata", {}).get("chunk_position", 0)
-        ))
+        batch_file = client.files.create(
+            file=(f"{doc_id}_segments.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch"
+        )
+        batch = client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
     except Exception as e:
-        st.warning(f"Kunne ikke sortere chunks: {e}")
+        st.error(f"Kunne ikke oprette batch-job: {e}")
+        return {}
+    
+    st.info(f"Batch-job {batch.id} oprettet med {len(lines)} segmenter. Venter på resultat...")
+    status_text = st.empty()
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        counts = batch.request_counts
+        if counts is not None:
+            status_text.text(f"Batch-status: {batch.status} ({counts.completed}/{counts.total} færdige)")
+        else:
+            status_text.text(f"Batch-status: {batch.status}")
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+    
+    if batch.status != "completed" or not batch.output_file_id:
+        st.error(f"Batch-job {batch.id} blev ikke fuldført (status: {batch.status}).")
+        return {}
+    
+    # Saml svarene og fordel dem efter segmentnummer
+    results_by_segment = {}
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            item = orjson.loads(line)
+            segment_idx = int(item["custom_id"].rsplit("-", 1)[1])
+            content = item["response"]["body"]["choices"][0]["message"]["content"]
+            results_by_segment[segment_idx] = orjson.loads(content)
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            st.warning(f"Kunne ikke læse et batch-svar: {e}")
+    
+    return results_by_segment
+
+def prefetch_gpt_batch(prompts, model="gpt-4o", batch_name="prompts", cache_dir=GPT_CACHE_DIR, poll_interval=30):
+    """
+    Sender JSON-prompts der ikke allerede er cachet som ét batch-job og lægger svarene i
+    cached_call_gpt4o's diskcache. Efterfølgende kald til cached_call_gpt4o med samme prompt
+    og model finder dermed svaret i cachen uden et synkront API-kald.
+    """
+    cache = get_gpt_cache(cache_dir)
+    keys = [gpt_cache_key(prompt, model, True) for prompt in prompts]
+    
+    lines = []
+    for i, (prompt, key) in enumerate(zip(prompts, keys)):
+        try:
+            if key in cache:
+                continue
+        except Exception as e:
+            st.warning(f"Kunne ikke indlæse cache: {e}")
+        lines.append(orjson.dumps({
+            "custom_id": f"prompt-{i}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model,
+                "messages": [{"role": "user", "content": prompt}],
+                "response_format": {"type": "json_object"},
+                "temperature": 0.1
+            }
+        }).decode("utf-8"))
+    
+    if not lines:
+        return
+    
+    for i, result in run_batch_job(lines, batch_name, poll_interval).items():
+        if result:
+            try:
+                cache.set(keys[i], result, expire=GPT_CACHE_EXPIRE)
+            except Exception as e:
+                st.warning(f"Kunne ikke gemme cache: {e}")
+
+async def acached_call_gpt4o(client, prompt, model="gpt-4o", json_mode=True, cache_dir=GPT_CACHE_DIR, prompt_cache_key=None):
+    """
+    Asynkron udgave af cached_call_gpt4o med samme diskcache og cachenøgler.
+    
+    client er en AsyncOpenAI-klient fra api_utils.make_async_openai_client, så mange samtidige
+    kald deler én forbindelsespulje i stedet for at optage en tråd hver.
+    """
+    from utils import api_utils  # Importér her for at undgå cirkulære importer
+    
+    cache = get_gpt_cache(cache_dir)
+    cache_key = gpt_cache_key(prompt, model, json_mode)
+    
+    try:
+        cached = cache.get(cache_key)
+    except Exception as e:
+        st.warning(f"Kunne ikke indlæse cache: {e}")
+        cached = None
+    
+    if cached is not None:
+        return cached
+    
+    result = await api_utils.acall_gpt4o(client, prompt, model=model, json_mode=json_mode,
+                                         prompt_cache_key=prompt_cache_key)
+    
+    if result:
+        try:
+            cache.set(cache_key, result, expire=GPT_CACHE_EXPIRE)
+        except Exception as e:
+            st.warning(f"Kunne ikke gemme cache: {e}")
+    
+    return result
+
+def prefetch_gpt_async(prompts, model="gpt-4o", prompt_cache_keys=None, cache_dir=GPT_CACHE_DIR, max_concurrency=32):
+    """
+    Kører JSON-prompts samtidigt og lægger svarene i cached_call_gpt4o's diskcache, som
+    prefetch_gpt_batch men uden batch-jobbets ventetid.
+    
+    Fejl ignoreres her; det efterfølgende kald til cached_call_gpt4o prøver igen og
+    håndterer dem som hidtil.
+    """
+    from utils import api_utils  # Importér her for at undgå cirkulære importer
+    
+    prompt_cache_keys = prompt_cache_keys or [None] * len(prompts)
+    
+    async def run_all():
+        semaphore = asyncio.Semaphore(max_concurrency)
+        async with api_utils.make_async_openai_client() as client:
+            async def run_one(prompt, prompt_cache_key):
+                async with semaphore:
+                    return await acached_call_gpt4o(client, prompt, model=model, cache_dir=cache_dir,
+                                                    prompt_cache_key=prompt_cache_key)
+            await asyncio.gather(*[run_one(prompt, key) for prompt, key in zip(prompts, prompt_cache_keys)],
+                                 return_exceptions=True)
+    
+    # Coroutinerne kører i Streamlit-scriptets egen tråd, så st-kald virker uændret
+    asyncio.run(run_all())
+
+def process_segments_batched(segments, doc_type_key, context_summary, doc_id, options, get_template_func=None,
+                             poll_interval=30):
+    """
+    Behandler segmenter via OpenAI's Batch API i stedet for ét synkront kald pr. segment.
+    
+    Batch-jobs koster halvt så meget pr. token og tæller ikke mod de almindelige rate limits,
+    men kan tage op til 24 timer. Velegnet når ingen venter på resultatet.
+    
+    Args:
+        segments: Liste af tekstsegmenter
+        doc_type_key: Nøgle til dokumenttype
+        context_summary: Kontekstopsummering
+        doc_id: Dokument-id
+        options: Processeringsindstillinger
+        get_template_func: Funktion til at hente indexing prompt template
+        poll_interval: Sekunder mellem statusforespørgsler
+        
+    Returns:
+        Liste af chunks fra alle segmenter
+    """
+    if get_template_func is None:
+        st.error("Mangler get_template_func parameter")
+        return []
+    
+    segments = split_long_segments(segments)
+    model = options.get("model", "gpt-4o")
+    
+    # Identiske segmenter sendes kun med én gang i batch-jobbet, og segmenter der allerede
+    # ligger i diskcachen (fra et tidligere job eller en almindelig kørsel) sendes slet ikke
+    segment_cache = get_gpt_cache()
+    template_digest = segment_template_digest(get_template_func, doc_type_key)
+    context_digest = segment_context_digest(context_summary)
+    segment_keys = [
+        segment_cache_key(segment, model, doc_type_key, template_digest, context_digest) for segment in segments
+    ]
+    first_idx = {}
+    for i, key in enumerate(segment_keys):
+        first_idx.setdefault(key, i)
+    
+    results_by_segment = {}
+    for key, segment_idx in first_idx.items():
+        try:
+            cached_chunks = segment_cache.get(key)
+        except Exception as e:
+            st.warning(f"Kunne ikke indlæse cache: {e}")
+            cached_chunks = None
+        if cached_chunks:
+            results_by_segment[segment_idx] = {"chunks": cached_chunks}
+    
+    # Én JSONL-linje pr. unikt segment; custom_id bruges til at finde segmentet igen
+    lines = []
+    for segment_idx in first_idx.values():
+        if segment_idx in results_by_segment:
+            continue
+        segment = segments[segment_idx]
+        indexing_prompt = build_segment_prompt(get_template_func, doc_type_key, context_summary, doc_id, segment_idx)
+        if indexing_prompt is None:
+            continue
+        lines.append(orjson.dumps({
+            "custom_id": f"segment-{segment_idx}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model,
+                "messages": [{"role": "user", "content": add_segment_text(indexing_prompt, segment, segment_idx)}],
+                "response_format": {"type": "json_object"},
+                "temperature": 0.1,
+                "prompt_cache_key": f"indexing-{doc_type_key}"
+            }
+        }).decode("utf-8"))
+    
+    if results_by_segment:
+        st.info(f"{len(results_by_segment)} segmenter genbruges fra cachen og sendes ikke med i batch-jobbet.")
+    
+    if lines:
+        job_results = run_batch_job(lines, doc_id, poll_interval)
+        for segment_idx, result in job_results.items():
+            if isinstance(result, dict) and result.get("chunks"):
+                try:
+                    segment_cache.set(segment_keys[segment_idx], result["chunks"], expire=GPT_CACHE_EXPIRE)
+                except Exception as e:
+                    st.warning(f"Kunne ikke gemme cache: {e}")
+        results_by_segment.update(job_results)
+    elif not results_by_segment:
+        return []
+    
+    all_chunks = []
+    for segment_idx, key in enumerate(segment_keys):
+        # Dubletter og cachede svar får en kopi med deres egen position
+        result = copy.deepcopy(results_by_segment.get(first_idx[key]))
+        segment_result = parse_segment_result(result, segment_idx, len(segments), doc_id)
+        if segment_result and segment_result.get("chunks"):
+            all_chunks.extend(segment_result["chunks"])
+        else:
+            st.warning(f"Kunne ikke indeksere segment {segment_idx+1}.")
     
-    return all_chunks
+    st.success(f"Batch-behandling fuldført. Genereret {len(all_chunks)} chunks fra {len(segments)} segmenter.")
+    return sort_chunks_by_position(all_chunks)
 
 def split_segment_semantically(segment, max_length=15000):
     """
@@ -1,9 +1,11 @@
 import os
+import io
 import json
+import orjson
 import pickle
-import faiss
 import shutil
 import glob
+import numpy as np
 import pandas as pd
 from datetime import datetime
 
@@ -60,12 +62,29 @@ def save_faiss_index(doc_id, index, embedding_dict):
         os.makedirs(doc_dir)
     
     # Gem FAISS-indeks
+    import faiss  # Importeres først når der arbejdes med indekser
     faiss.write_index(index, os.path.join(doc_dir, "index.faiss"))
     
     # Gem embeddings dictionary
     with open(os.path.join(doc_dir, "embeddings.pkl"), "wb") as f:
         pickle.dump(embedding_dict, f)
 
+def serialize_embeddings(embedding_dict):
+    """
+    Serialiserer embeddings som komprimeret .npz i kolonneformat.
+    
+    Alle vektorer samles i én float32-matrix, og chunks gemmes som JSON,
+    så filen kan indlæses uden pickle.
+    """
+    keys = list(embedding_dict.keys())
+    ids = np.array(keys)
+    vectors = np.asarray([embedding_dict[k]["embedding"] for k in keys], dtype=np.float32)
+    chunks_json = orjson.dumps([embedding_dict[k]["chunk"] for k in keys], option=orjson.OPT_NON_STR_KEYS)
+    
+    buf = io.BytesIO()
+    np.savez_compressed(buf, ids=ids, vectors=vectors, chunks=np.frombuffer(chunks_json, dtype=np.uint8))
+    return buf.getvalue()
+
 def save_processing_stats(doc_id, stats):
     """Gemmer processeringsstatistik."""
     ensure_directories()
@@ -93,8 +112,8 @@ def load_document_metadata(doc_id):
     if not os.path.exists(metadata_path):
         return None
     
-    with open(metadata_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(metadata_path, "rb") as f:
+        return orjson.loads(f.read())
 
 def load_chunks(doc_id):
     """Indlæser chunks fra et dokument."""
@@ -104,17 +123,25 @@ def load_chunks(doc_id):
     if not os.path.exists(chunks_path):
         return None
     
-    with open(chunks_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(chunks_path, "rb") as f:
+        return orjson.loads(f.read())
 
-def load_faiss_index(doc_id):
-    """Indlæser FAISS-indeks."""
+def load_faiss_index(doc_id, mmap=True):
+    """
+    Indlæser FAISS-indeks.
+    
+    Med mmap=True memory-mappes indekset skrivebeskyttet, så kun de sider der
+    rammes ved søgning læses ind. Brug mmap=False hvis indekset skal gemmes igen.
+    """
     doc_dir = get_document_dir(doc_id)
     index_path = os.path.join(doc_dir, "index.faiss")
     
     if not os.path.exists(index_path):
         return None
     
+    import faiss  # Importeres først når der arbejdes med indekser
+    if mmap:
+        return faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
     return faiss.read_index(index_path)
 
 def load_embeddings(doc_id):
@@ -136,8 +163,8 @@ def load_processing_stats(doc_id):
     if not os.path.exists(stats_path):
         return None
     
-    with open(stats_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(stats_path, "rb") as f:
+        return orjson.loads(f.read())
 
 def delete_document(doc_id):
     """Sletter et dokument og alle dets filer."""
@@ -161,8 +188,14 @@ def list_documents():
             metadata_path = os.path.join(doc_dir, "metadata.json")
             
             if os.path.exists(metadata_path):
-                with open(metadata_path, "r", encoding="utf-8") as f:
-                    metadata = json.load(f)
+                with open(metadata_path, "rb") as f:
+                    metadata = orjson.loads(f.read())
+                
+                chunks_path = os.path.join(doc_dir, "chunks.json")
+                chunks_count = 0
+                if os.path.exists(chunks_path):
+                    with open(chunks_path, "rb") as f:
+                        chunks_count = len(orjson.loads(f.read()))
                 
                 # Opret en enkel oversigt
                 doc_info = {
@@ -172,7 +205,7 @@ def list_documents():
                     "version_date": metadata.get("version_date", "Ukendt dato"),
                     "saved_at": metadata.get("saved_at", "Ukendt gemmetidspunkt"),
                     "has_index": os.path.exists(os.path.join(doc_dir, "index.faiss")),
-                    "chunks_count": len(json.load(open(os.path.join(doc_dir, "chunks.json"), "r", encoding="utf-8"))) if os.path.exists(os.path.join(doc_dir, "chunks.json")) else 0
+                    "chunks_count": chunks_count
                 }
                 documents.append(doc_info)
     
@@ -202,14 +235,14 @@ def save_complete_document(doc_id, metadata, chunks, index, embedding_dict, stat
     
     return True
 
-def load_complete_document(doc_id):
+def load_complete_document(doc_id, load_index=True, mmap_index=True):
     """Indlæser alle data for et dokument i én funktion."""
     if not document_exists(doc_id):
         return None
     
     metadata = load_document_metadata(doc_id)
     chunks = load_chunks(doc_id)
-    index = load_faiss_index(doc_id)
+    index = load_faiss_index(doc_id, mmap=mmap_index) if load_index else None
     embeddings = load_embeddings(doc_id)
     stats = load_processing_stats(doc_id)
     
@@ -241,7 +274,8 @@ def rename_document(old_doc_id, new_doc_id, new_title=None):
     
     try:
         # Indlæs al data fra det gamle dokument
-        old_data = load_complete_document(old_doc_id)
+        # Indekset skal kunne skrives igen, så det indlæses uden mmap
+        old_data = load_complete_document(old_doc_id, mmap_index=False)
         if not old_data:
             return False
         
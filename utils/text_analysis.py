@@ -1,31 +1,61 @@
 import re
+import functools
+import itertools
 import streamlit as st
 import numpy as np
 
-def segment_text_for_processing(text, max_segment_length=30000):
+_RE_EXAMPLE = re.compile(r'(Eksempel(?:\s+\d+)?:(?:.*?)(?=\n\n\w|Eksempel(?:\s+\d+)?:|$))', re.DOTALL)
+
+def new_preserved_content():
+    """Returnerer en tom oversigt over indhold som skal bevares intakt."""
+    return {
+        "notes": {},
+        "paragraphs": {},
+        "sections": {},
+        "examples": {}
+    }
+
+def iter_segments_for_processing(text, max_segment_length=30000, preserved_content=None, counts=None):
     """
-    Opdeler tekst i segmenter til indeksering med forbedret juridisk hensyn.
+    Opdeler tekst i segmenter som segment_text_for_processing, men leverer hvert segment
+    så snart det er dannet. Første segment kan dermed sendes til kontekstanalyse mens
+    resten af teksten stadig segmenteres.
     
     Args:
         text: Tekst der skal segmenteres
         max_segment_length: Maksimal længde på et segment
+        preserved_content: Ordbog fra new_preserved_content der udfyldes undervejs
+        counts: Ordbog der udfyldes med antal hoved- og notesegmenter
         
-    Returns:
-        Liste af tekstsegmenter og bevarede indholdselementer
+    Yields:
+        Tekstsegmenter på højst max_segment_length tegn
     """
-    # Log original tekstlængde
-    st.write(f"Original tekstlængde: {len(text)} tegn")
-    st.write(f"Maksimal segmentlængde: {max_segment_length} tegn")
-    
-    segments = []
+    if preserved_content is None:
+        preserved_content = new_preserved_content()
+    if counts is None:
+        counts = {}
+    counts["main_segments"] = 0
+    counts["note_segments"] = 0
+    
+    def finalize(segment):
+        # Opdel eventuelle resterende store segmenter
+        if len(segment) > max_segment_length:
+            st.warning(f"Fandt et segment på {len(segment)} tegn, som er større end max ({max_segment_length}). Opdeler det yderligere.")
+            # Del i mindre stykker
+            for i in range(0, len(segment), max_segment_length // 2):
+                yield segment[i:i + max_segment_length // 2]
+        else:
+            yield segment
     
-    # Oversigt over indhold som skal bevares intakt
-    preserved_content = {
-        "notes": {},
-        "paragraphs": {},
-        "sections": {},
-        "examples": {}
-    }
+    def main_segment(segment):
+        counts["main_segments"] += 1
+        # Udpak eksempler fra segmentet mens det alligevel er i hånden
+        for match in _RE_EXAMPLE.finditer(segment):
+            example_text = match.group(1).strip()
+            # Generer et unikt ID for eksemplet
+            example_id = f"eks_{len(preserved_content['examples'])+1}"
+            preserved_content["examples"][example_id] = example_text
+        yield from finalize(segment)
     
     # 1. Del efter "NOTER:" mærket hvis det findes
     parts = re.split(r'(NOTER:|\nNoter\n)', text, 1)
@@ -54,19 +84,21 @@ def segment_text_for_processing(text, max_segment_length=30000):
     
     # A. Prøv først at finde afsnit baseret på juridisk vejlednings-struktur (C.F.X.X.X)
     jv_section_pattern = r'(C\.F\.\d+\.\d+\.\d+\s+.+?)(?=C\.F\.\d+\.\d+\.\d+|$)'
-    jv_matches = list(re.finditer(jv_section_pattern, main_text, re.DOTALL))
+    jv_matches = re.finditer(jv_section_pattern, main_text, re.DOTALL)
+    first_jv_match = next(jv_matches, None)
     
-    if jv_matches:
+    if first_jv_match:
         # Den Juridiske Vejledning-struktur
-        for match in jv_matches:
+        for match in itertools.chain([first_jv_match], jv_matches):
             segment = match.group(1)
-            segments.append(segment)
             
             # Uddrag afsnits-ID
             section_id_match = re.search(r'(C\.F\.\d+\.\d+\.\d+)', segment)
             if section_id_match:
                 section_id = section_id_match.group(1)
                 preserved_content["sections"][section_id] = segment
+            
+            yield from main_segment(segment)
     else:
         # B. Prøv at finde paragrafgrænser hvis det ikke er JV
         paragraph_pattern = r'(§\s+\d+[A-Za-z]?|Kapitel\s+\d+|Afsnit\s+\d+)'
@@ -86,7 +118,7 @@ def segment_text_for_processing(text, max_segment_length=30000):
                 # Hvis current_segment ville blive for stort, gem det og start en ny
                 if len(current_segment + full_paragraph) > max_segment_length:
                     if current_segment:
-                        segments.append(current_segment)
+                        yield from main_segment(current_segment)
                     
                     # Hvis selve paragraffen er for stor, opdel den
                     if len(full_paragraph) > max_segment_length:
@@ -99,13 +131,13 @@ def segment_text_for_processing(text, max_segment_length=30000):
                         for part in sub_parts:
                             if len(current_sub_segment + part) > max_segment_length:
                                 if current_sub_segment:
-                                    segments.append(current_sub_segment)
+                                    yield from main_segment(current_sub_segment)
                                 current_sub_segment = part
                             else:
                                 current_sub_segment += part
                         
                         if current_sub_segment:
-                            segments.append(current_sub_segment)
+                            yield from main_segment(current_sub_segment)
                     else:
                         current_segment = full_paragraph
                 else:
@@ -113,22 +145,14 @@ def segment_text_for_processing(text, max_segment_length=30000):
         
         # Tilføj sidste segment
         if current_segment:
-            segments.append(current_segment)
+            yield from main_segment(current_segment)
         
         # C. Hvis ingen paragraffer blev fundet, del ved semantiske grænser
-        if not segments:
-            segments = split_with_juridical_awareness(main_text, max_segment_length)
-    
-    # 3. Udpak eksempler
-    example_pattern = r'(Eksempel(?:\s+\d+)?:(?:.*?)(?=\n\n\w|Eksempel(?:\s+\d+)?:|$))'
-    for segment in ' '.join(segments):
-        for match in re.finditer(example_pattern, segment, re.DOTALL):
-            example_text = match.group(1).strip()
-            # Generer et unikt ID for eksemplet
-            example_id = f"eks_{len(preserved_content['examples'])+1}"
-            preserved_content["examples"][example_id] = example_text
+        if not counts["main_segments"]:
+            for segment in split_with_juridical_awareness(main_text, max_segment_length):
+                yield from main_segment(segment)
     
-    # 4. Behandl noter som separate segmenter
+    # 3. Behandl noter som separate segmenter
     note_segments = []
     
     # Opdel noterne i mindre chunks også
@@ -149,26 +173,21 @@ def segment_text_for_processing(text, max_segment_length=30000):
         # Forsøg at opdele notes_text baseret på note-numre
         note_segments = split_notes_text(notes_text, max_segment_length)
     
-    # Kombiner hoved-segmenter og note-segmenter
-    segments.extend(note_segments)
-    
-    # Opdel eventuelle resterende store segmenter
-    final_segments = []
-    for segment in segments:
-        if len(segment) > max_segment_length:
-            st.warning(f"Fandt et segment på {len(segment)} tegn, som er større end max ({max_segment_length}). Opdeler det yderligere.")
-            # Del i mindre stykker
-            for i in range(0, len(segment), max_segment_length // 2):
-                part = segment[i:i + max_segment_length // 2]
-                final_segments.append(part)
-        else:
-            final_segments.append(segment)
+    counts["note_segments"] = len(note_segments)
+    for segment in note_segments:
+        yield from finalize(segment)
+
+def summarize_segments(segments, preserved_content, counts):
+    """
+    Samler statistik for en færdig segmentering og logger segmentlængderne.
     
-    # Log statistik
+    Returns:
+        Ordbog med statistik over segmenter og bevaret indhold
+    """
     stats = {
-        "main_segments": len(segments) - len(note_segments),
-        "note_segments": len(note_segments),
-        "total_segments": len(final_segments),
+        "main_segments": counts.get("main_segments", 0),
+        "note_segments": counts.get("note_segments", 0),
+        "total_segments": len(segments),
         "preserved_notes": len(preserved_content["notes"]),
         "preserved_paragraphs": len(preserved_content["paragraphs"]),
         "preserved_sections": len(preserved_content["sections"]),
@@ -176,11 +195,33 @@ def segment_text_for_processing(text, max_segment_length=30000):
     }
     
     # Log information om segmenter
-    st.write(f"Segmenteret tekst i {len(final_segments)} dele:")
-    for i, segment in enumerate(final_segments):
+    st.write(f"Segmenteret tekst i {len(segments)} dele:")
+    for i, segment in enumerate(segments):
         st.write(f"Segment {i+1}: {len(segment)} tegn")
     
-    return final_segments, preserved_content, stats
+    return stats
+
+def segment_text_for_processing(text, max_segment_length=30000):
+    """
+    Opdeler tekst i segmenter til indeksering med forbedret juridisk hensyn.
+    
+    Args:
+        text: Tekst der skal segmenteres
+        max_segment_length: Maksimal længde på et segment
+        
+    Returns:
+        Liste af tekstsegmenter og bevarede indholdselementer
+    """
+    # Log original tekstlængde
+    st.write(f"Original tekstlængde: {len(text)} tegn")
+    st.write(f"Maksimal segmentlængde: {max_segment_length} tegn")
+    
+    preserved_content = new_preserved_content()
+    counts = {}
+    segments = list(iter_segments_for_processing(text, max_segment_length, preserved_content, counts))
+    stats = summarize_segments(segments, preserved_content, counts)
+    
+    return segments, preserved_content, stats
 
 def split_with_juridical_awareness(text, max_length=15000):
     """
@@ -419,16 +460,56 @@ def split_notes_text(notes_text, max_length=15000):
     
     return segments
 
-def normalize_case_references(chunks):
+@functools.lru_cache(maxsize=1)
+def build_ref_scanner():
+    """
+    Bygger ét samlet mønster for domsreferencer med navngivne grupper pr. referencetype.
+    
+    Returns:
+        Kompileret re.Pattern til normalize_case_references
+    """
+    return re.compile(
+        # SKM-format: SKM2020.123.LSR
+        r'(?P<skm>SKM)[.\s]?(?P<skm_year>\d{4})[.\s]?(?P<skm_num>\d+)[.\s]?(?P<skm_inst>[A-Z]+)'
+        # TfS-format: TfS 2020, 123 H
+        r'|(?P<tfs>TfS)[.\s]?(?P<tfs_year>\d{4})[,.\s]?(?P<tfs_num>\d+)(?:[.\s]?(?P<tfs_inst>[A-Z]+))?'
+        # U-format (Ugeskrift for Retsvæsen): U 2020.123 H
+        r'|(?P<u>U)[.\s]?(?P<u_year>\d{4})[.\s]?(?P<u_num>\d+)(?:[.\s]?(?P<u_inst>[A-Z]+))?'
+    )
+
+def _normalize_case_reference(ref, scanner):
+    """Normaliserer én domsreference til PREFIX.YEAR.NUMBER.INSTANCE eller returnerer den uændret."""
+    match = scanner.search(ref)
+    if not match:
+        # Hvis ingen match, behold originalen
+        return ref
+    
+    for kind, prefix in (("skm", "SKM"), ("tfs", "TfS"), ("u", "U")):
+        if match.group(kind):
+            normalized = f"{prefix}.{match.group(kind + '_year')}.{match.group(kind + '_num')}"
+            instance = match.group(kind + "_inst")
+            if instance:
+                normalized += f".{instance}"
+            return normalized
+    return ref
+
+def normalize_case_references(chunks, scanner=None):
     """
     Normaliserer domsreferencer til standardformat på tværs af alle chunks.
     
     Args:
         chunks: Liste af chunks at behandle
+        scanner: Forudkompileret mønster fra build_ref_scanner (valgfrit)
         
     Returns:
         Liste af chunks med normaliserede referencer
     """
+    if scanner is None:
+        scanner = build_ref_scanner()
+    
+    # De samme referencer går igen i mange chunks, så hver reference normaliseres kun én gang
+    normalized_cache = {}
+    
     for chunk in chunks:
         if "metadata" not in chunk:
             continue
@@ -441,41 +522,14 @@ def normalize_case_references(chunks):
         
         normalized_refs = []
         for ref in metadata["case_references"]:
-            # Standardformat: PREFIX.YEAR.NUMBER.INSTANCE
-            
-            # SKM-format: SKM2020.123.LSR -> SKM.2020.123.LSR
-            skm_match = re.search(r'SKM[.\s]?(\d{4})[.\s]?(\d+)[.\s]?([A-Z]+)', ref)
-            if skm_match:
-                normalized = f"SKM.{skm_match.group(1)}.{skm_match.group(2)}.{skm_match.group(3)}"
-                normalized_refs.append(normalized)
-                continue
-            
-            # TfS-format: TfS 2020, 123 H -> TfS.2020.123.H
-            tfs_match = re.search(r'TfS[.\s]?(\d{4})[,.\s]?(\d+)(?:[.\s]?([A-Z]+))?', ref)
-            if tfs_match:
-                instance = tfs_match.group(3) or ''
-                normalized = f"TfS.{tfs_match.group(1)}.{tfs_match.group(2)}"
-                if instance:
-                    normalized += f".{instance}"
-                normalized_refs.append(normalized)
-                continue
-            
-            # U-format (Ugeskrift for Retsvæsen): U 2020.123 H -> U.2020.123.H
-            u_match = re.search(r'U[.\s]?(\d{4})[.\s]?(\d+)(?:[.\s]?([A-Z]+))?', ref)
-            if u_match:
-                instance = u_match.group(3) or ''
-                normalized = f"U.{u_match.group(1)}.{u_match.group(2)}"
-                if instance:
-                    normalized += f".{instance}"
-                normalized_refs.append(normalized)
-                continue
-            
-            # Hvis ingen match, behold originalen
-            normalized_refs.append(ref)
+            normalized = normalized_cache.get(ref)
+            if normalized is None:
+                normalized = _normalize_case_reference(ref, scanner)
+                normalized_cache[ref] = normalized
+            normalized_refs.append(normalized)
         
-        # Fjern duplikater
-        normalized_refs = list(set(normalized_refs))
-        metadata["normalized_case_references"] = normalized_refs
+        # Fjern duplikater men bevar rækkefølgen
+        metadata["normalized_case_references"] = list(dict.fromkeys(normalized_refs))
     
     return chunks
 